@@ -0,0 +1,103 @@
+"""
+Measures the CPU time spent per stream of audio for the old PCM path (FFmpeg decodes to PCM, volume is scaled
+in Python and discord.py encodes to Opus) and the Opus paths (FFmpeg copies the Opus stream, or applies the
+volume and encodes it). Each stream reads AUDIO_SECONDS of audio as fast as FFmpeg produces it, with
+several streams running concurrently like guilds playing at once.
+
+Needs FFmpeg on the PATH and libopus loadable by discord.py. The input should be an Opus/WebM file or URL,
+e.g. the stream URL of a YouTube video.
+
+Usage: python -m benchmarks.opus_playback <file or url> [concurrent streams]
+"""
+
+import sys
+import threading
+import time
+
+import discord
+import psutil
+
+AUDIO_SECONDS = 30
+FRAMES = int(AUDIO_SECONDS / 0.02)
+FFMPEG_OPTIONS = {"before_options": "-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5", "options": "-vn"}
+
+
+def pcm_stream(source: str) -> None:
+    audio = discord.PCMVolumeTransformer(discord.FFmpegPCMAudio(source, **FFMPEG_OPTIONS), 0.5)
+    encoder = discord.opus.Encoder()
+
+    for _ in range(FRAMES):
+        frame = audio.read()
+
+        if not frame:
+            break
+
+        # What discord.py's player does with each frame of a PCM source
+        encoder.encode(frame, encoder.SAMPLES_PER_FRAME)
+
+    audio.cleanup()
+
+
+def opus_stream(source: str, volume: float) -> None:
+    passthrough = volume == 1
+    options = FFMPEG_OPTIONS["options"] + ("" if passthrough else f" -filter:a volume={volume:.2f}")
+    audio = discord.FFmpegOpusAudio(source, codec="opus" if passthrough else None, before_options=FFMPEG_OPTIONS["before_options"], options=options)
+
+    for _ in range(FRAMES):
+        if not audio.read():
+            break
+
+    audio.cleanup()
+
+
+def children_cpu(process: psutil.Process) -> float:
+    total = 0.0
+
+    for child in process.children(recursive=True):
+        try:
+            times = child.cpu_times()
+            total += times.user + times.system
+        except psutil.Error:
+            pass
+
+    return total
+
+
+def run(name: str, target, args: tuple, streams: int) -> None:
+    process = psutil.Process()
+    threads = [threading.Thread(target=target, args=args) for _ in range(streams)]
+    children = 0.0
+    start_cpu = sum(process.cpu_times()[:2])
+    start = time.perf_counter()
+
+    for thread in threads:
+        thread.start()
+
+    # FFmpeg processes are gone (and their CPU time with them) once their stream ends, so sample until then
+    while any(thread.is_alive() for thread in threads):
+        children = max(children, children_cpu(process))
+        time.sleep(0.05)
+
+    elapsed = time.perf_counter() - start
+    bot_cpu = sum(process.cpu_times()[:2]) - start_cpu
+    print(f"{name:>22}: {streams} streams in {elapsed:5.2f}s, bot CPU {bot_cpu / streams / AUDIO_SECONDS * 100:5.2f}% "
+          f"and FFmpeg CPU {children / streams / AUDIO_SECONDS * 100:5.2f}% of a core per stream")
+
+
+def main() -> None:
+    if len(sys.argv) < 2:
+        sys.exit(__doc__)
+
+    source = sys.argv[1]
+    streams = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+
+    if not discord.opus.is_loaded():
+        discord.opus._load_default()
+
+    run("PCM + Python volume", pcm_stream, (source,), streams)
+    run("Opus + FFmpeg volume", opus_stream, (source, 0.5), streams)
+    run("Opus passthrough", opus_stream, (source, 1), streams)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Compares the single-pass HTML to Discord markdown converter with the regex + BeautifulSoup path it replaced,
+on the post bodies stored in the local Piazza mirrors (built by the Piazza cog's mirror_sync).
+
+Usage: python -m benchmarks.piazza_markdown [mirror database ...]
+"""
+
+import glob
+import html
+import re
+import sqlite3
+import sys
+import time
+
+from bs4 import BeautifulSoup
+
+from util.html_markdown import html_to_markdown
+from util.piazza_mirror import MIRROR_DIRECTORY
+
+ROUNDS = 5
+
+
+def legacy_clean_response(res: str) -> str:
+    if not res:
+        return ""
+
+    if len(res) > 1024:
+        res = res[:1000]
+        res += "...\n\n *(Read more)*"
+
+    tag_regex = re.compile("<.*?>")
+    return html.unescape(re.sub(tag_regex, "", res))
+
+
+def legacy_first_image_url(res: str) -> str:
+    if res:
+        img = BeautifulSoup(res, "html.parser").find("img")
+
+        if img:
+            return f"https://piazza.com{img['src']}" if img["src"].startswith("/") else img["src"]
+
+    return ""
+
+
+def legacy(body: str) -> tuple[str, str]:
+    return legacy_clean_response(body), legacy_first_image_url(body)
+
+
+def single_pass(body: str) -> tuple[str, str]:
+    text, images = html_to_markdown(body, base_url="https://piazza.com")
+    return text, images[0] if images else ""
+
+
+def load_bodies(paths: list[str]) -> list[str]:
+    bodies = []
+
+    for path in paths:
+        db = sqlite3.connect(path)
+        bodies += [row[0] for row in db.execute("SELECT body_html FROM posts WHERE body_html != ''")]
+        db.close()
+
+    return bodies
+
+
+def bench(convert, bodies: list[str]) -> float:
+    best = float("inf")
+
+    for _ in range(ROUNDS):
+        start = time.perf_counter()
+
+        for body in bodies:
+            convert(body)
+
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+
+def main() -> None:
+    paths = sys.argv[1:] or glob.glob(f"{MIRROR_DIRECTORY}/*.db")
+    bodies = load_bodies(paths)
+
+    if not bodies:
+        sys.exit("No post bodies found; pass a mirror database or let the bot build one first.")
+
+    print(f"{len(bodies)} post bodies, {sum(map(len, bodies)) / len(bodies):.0f} characters on average, best of {ROUNDS}")
+
+    for name, convert in (("regex + BeautifulSoup", legacy), ("single pass", single_pass)):
+        elapsed = bench(convert, bodies)
+        print(f"{name:>22}: {elapsed * 1000:8.1f} ms total, {elapsed / len(bodies) * 1e6:7.1f} us per body")
+
+    over = sum(len(single_pass(body)[0]) > 1024 for body in bodies) + sum(len(legacy(body)[0]) > 1024 for body in bodies)
+    images = sum(bool(single_pass(body)[1]) for body in bodies)
+    print(f"{images} bodies with images, {over} converted bodies over the 1024 character field limit")
+
+
+if __name__ == "__main__":
+    main()
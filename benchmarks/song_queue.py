@@ -0,0 +1,84 @@
+"""
+Compares the fair treap-backed song queue with the deque-backed asyncio.Queue it replaced, timing !queue page
+reads, !remove and !move at different positions in queues of growing length.
+
+Usage: python -m benchmarks.song_queue [queue length ...]
+"""
+
+import asyncio
+import itertools
+import random
+import sys
+import time
+
+from util.fair_queue import FairQueue
+
+OPERATIONS = 2000
+PAGE = 10
+REQUESTERS = 20
+
+
+class LegacyQueue(asyncio.Queue):
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return list(itertools.islice(self._queue, item.start, item.stop, item.step))
+        else:
+            return self._queue[item]
+
+    def remove(self, index: int):
+        del self._queue[index]
+
+    def move(self, index: int, to: int):
+        item = self._queue[index]
+        del self._queue[index]
+        self._queue.insert(to, item)
+
+
+def timed(func, positions: list[int]) -> float:
+    start = time.perf_counter()
+
+    for i in positions:
+        func(i)
+
+    return (time.perf_counter() - start) / len(positions) * 1e6
+
+
+def remove_and_requeue(queue, index: int) -> None:
+    # Re-adding keeps the length constant
+    queue.remove(index)
+
+    if isinstance(queue, LegacyQueue):
+        queue.put_nowait(index)
+    else:
+        queue.put(index)
+
+
+def run(length: int) -> None:
+    legacy = LegacyQueue()
+    fair = FairQueue(lambda song: song % REQUESTERS)
+
+    for i in range(length):
+        legacy.put_nowait(i)
+        fair.put(i)
+
+    positions = [random.randrange(length - 1) for _ in range(OPERATIONS)]
+    pages = [p - p % PAGE for p in positions]
+
+    print(f"{length} songs:")
+
+    for name, queue in (("deque", legacy), ("treap", fair)):
+        page = timed(lambda i: queue[i:i + PAGE], pages)
+        move = timed(lambda i: queue.move(i, length - 1 - i), positions)
+        remove = timed(lambda i: remove_and_requeue(queue, i), positions)
+        print(f"  {name}: page {page:7.1f} us, move {move:7.1f} us, remove {remove:7.1f} us")
+
+
+def main() -> None:
+    lengths = [int(arg) for arg in sys.argv[1:]] or [100, 1000, 10000, 100000]
+
+    for length in lengths:
+        run(length)
+
+
+if __name__ == "__main__":
+    main()
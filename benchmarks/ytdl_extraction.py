@@ -0,0 +1,87 @@
+"""
+Compares running youtube-dl extractions on the default thread pool with the dedicated process pool, measuring
+throughput of a burst of concurrent extractions and how late the event loop runs while they're in progress.
+
+Usage:
+    python -m benchmarks.ytdl_extraction <url> [url ...]    extracts the given URLs
+    python -m benchmarks.ytdl_extraction --synthetic [n]    runs n CPU-bound stand-ins for extraction (no network)
+"""
+
+import asyncio
+import functools
+import json
+import re
+import statistics
+import sys
+import time
+
+import youtube_dl
+
+from cogs.music import YTDLSource
+from util.ytdl_pool import ExtractionPool
+
+TICK = 0.005
+
+
+def synthetic_extraction(seed: int) -> dict:
+    # Parses and searches a large player response, like extractors do with YouTube's pages
+    page = json.dumps({"formats": [{"itag": i, "url": f"https://example.com/{seed}/{i}?expire=0&sig={'x' * 200}"} for i in range(30000)]})
+    return {"matches": len(re.findall(r"itag\": (\d+)", page)), "formats": len(json.loads(page)["formats"])}
+
+
+async def measure_lag(done: asyncio.Event) -> list[float]:
+    lags = []
+
+    while not done.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(time.perf_counter() - start - TICK)
+
+    return lags
+
+
+async def run_burst(name: str, jobs: list) -> None:
+    done = asyncio.Event()
+    lag_task = asyncio.create_task(measure_lag(done))
+    start = time.perf_counter()
+    results = await asyncio.gather(*jobs, return_exceptions=True)
+    elapsed = time.perf_counter() - start
+    done.set()
+    lags = sorted(await lag_task)
+    errors = sum(isinstance(result, BaseException) for result in results)
+    p99 = lags[int(len(lags) * 0.99)] if lags else 0.0
+
+    print(f"{name:>8}: {len(jobs)} extractions in {elapsed:6.2f}s ({len(jobs) / elapsed:5.2f}/s, {errors} failed), "
+          f"loop lag median {statistics.median(lags or [0]) * 1000:6.1f} ms, p99 {p99 * 1000:6.1f} ms, max {(lags or [0])[-1] * 1000:6.1f} ms")
+
+
+async def main() -> None:
+    if sys.argv[1:2] == ["--synthetic"]:
+        count = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+        work = [functools.partial(synthetic_extraction, i) for i in range(count)]
+    elif sys.argv[1:]:
+        ytdl = youtube_dl.YoutubeDL(YTDL_OPTIONS)
+        work = [functools.partial(ytdl.extract_info, url, download=False) for url in sys.argv[1:]]
+    else:
+        sys.exit(__doc__)
+
+    loop = asyncio.get_event_loop()
+    await run_burst("threads", [loop.run_in_executor(None, job) for job in work])
+
+    pool = ExtractionPool(YTDL_OPTIONS)
+    # Start the workers before timing, as the bot does on its first extraction
+    await pool.run(synthetic_extraction, 0)
+
+    if sys.argv[1] == "--synthetic":
+        jobs = [pool.run(synthetic_extraction, i) for i in range(len(work))]
+    else:
+        jobs = [pool.extract(url) for url in sys.argv[1:]]
+
+    await run_burst("processes", jobs)
+    pool.shutdown()
+
+
+YTDL_OPTIONS = YTDLSource.YTDL_OPTIONS
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -6,6 +6,7 @@ import re
 import shutil
 import traceback
 from datetime import datetime
+from functools import partial
 from os.path import isfile
 from typing import Optional
 
@@ -17,9 +18,13 @@ from dotenv import load_dotenv
 
 from util import canvas_handler
 from util.badargs import BadArgs
+from util.cache import ResultCache
 from util.canvas_handler import CanvasHandler
 from util.create_file import create_file_if_not_exists
+from util.grade_stats import render_histogram
 from util.json import read_json, write_json
+from util.paginator import Paginator
+from util.role_sync import RoleSyncWorker, compute_role_diff, get_desired_roles, get_managed_roles
 
 CANVAS_COLOR = 0xe13f2b
 CANVAS_THUMBNAIL_URL = "https://lh3.googleusercontent.com/2_M-EEPXb2xTMQSTZpSUefHR3TjgOCsawM3pjVG47jI-BrHoXGhKBpdEHeLElT95060B=s180"
@@ -34,6 +39,16 @@ CANVAS_FILE = "data/canvas.json"
 EMBED_CHAR_LIMIT = 6000
 MAX_MODULE_IDENTIFIER_LENGTH = 120
 
+# Used for caching !asgn and !annc results. Data fetched by the background pollers is reused
+# for queries if it is at most POLLER_DATA_MAX_AGE seconds old.
+QUERY_CACHE_TTL = 60
+POLLER_DATA_MAX_AGE = 60
+
+# Used for mirroring Canvas discussions
+MAX_DISCUSSION_ENTRY_LENGTH = 500
+# Embed titles are limited to 256 characters, including the "New replies in ... (continued)" around the title
+MAX_DISCUSSION_TITLE_LENGTH = 256 - len("New replies in  (continued)")
+
 
 class Canvas(commands.Cog):
     def __init__(self, bot: commands.Bot):
@@ -44,6 +59,10 @@ class Canvas(commands.Cog):
             write_json({}, CANVAS_FILE)
 
         self.canvas_dict = read_json(CANVAS_FILE)
+        self.role_sync_worker = RoleSyncWorker()
+        self._tracking_discussions = False
+        self._syncing_rosters = False
+        self.query_cache = ResultCache(QUERY_CACHE_TTL)
 
     @commands.command(hidden=True)
     @commands.has_permissions(administrator=True)
@@ -63,6 +82,7 @@ class Canvas(commands.Cog):
             raise BadArgs("Canvas Handler doesn't exist.")
 
         c_handler.track_course(course_ids, self.bot.notify_unpublished)
+        self.query_cache.clear()
 
         await self.send_canvas_track_msg(c_handler, ctx)
 
@@ -97,6 +117,7 @@ class Canvas(commands.Cog):
             raise BadArgs("Canvas Handler doesn't exist.")
 
         c_handler.untrack_course(course_ids)
+        self.query_cache.clear()
 
         if not c_handler.courses:
             self.bot.d_handler.canvas_handlers.remove(c_handler)
@@ -135,19 +156,23 @@ class Canvas(commands.Cog):
             due = "2-week"
             course_ids = args
 
-        assignments = c_handler.get_assignments(due, course_ids, CANVAS_API_URL)
+        key = (ctx.guild.id, "asgn", tuple(sorted(course_ids)), due)
+        assignments = await self.query_cache.get(key, lambda: self.bot.loop.run_in_executor(None, c_handler.get_assignments, due, course_ids, CANVAS_API_URL, POLLER_DATA_MAX_AGE))
 
         if not assignments:
             pattern = r"\d{4}-\d{2}-\d{2}"
             return await ctx.send(f"No assignments due by {due}{' (at 00:00)' if re.match(pattern, due) else ''}.")
 
-        for data in assignments:
+        def render_page(i: int) -> discord.Embed:
+            data = assignments[i]
             embed_var = discord.Embed(title=data[2], url=data[3], description=data[4], color=CANVAS_COLOR, timestamp=datetime.strptime(data[5], "%Y-%m-%d %H:%M:%S"))
             embed_var.set_author(name=data[0], url=data[1])
             embed_var.set_thumbnail(url=CANVAS_THUMBNAIL_URL)
             embed_var.add_field(name="Due at", value=data[6])
-            embed_var.set_footer(text="Created at", icon_url=CANVAS_THUMBNAIL_URL)
-            await ctx.send(embed=embed_var)
+            embed_var.set_footer(text=f"Assignment {i + 1}/{len(assignments)} • Created at", icon_url=CANVAS_THUMBNAIL_URL)
+            return embed_var
+
+        await Paginator(self.bot, len(assignments), render_page).send(ctx)
 
     @commands.command(hidden=True)
     @commands.is_owner()
@@ -248,12 +273,197 @@ class Canvas(commands.Cog):
             since = "2-week"
             course_ids = args
 
-        for data in c_handler.get_course_stream_ch(since, course_ids, CANVAS_API_URL, CANVAS_API_KEY):
+        key = (ctx.guild.id, "annc", tuple(sorted(course_ids)), since)
+        announcements = await self.query_cache.get(key, lambda: self.bot.loop.run_in_executor(None, c_handler.get_course_stream_ch, since, course_ids, CANVAS_API_URL, CANVAS_API_KEY, POLLER_DATA_MAX_AGE))
+
+        if not announcements:
+            return await ctx.send(f"No announcements since {since}." if since else "No announcements.")
+
+        def render_page(i: int) -> discord.Embed:
+            data = announcements[i]
             embed_var = discord.Embed(title=data[2], url=data[3], description=data[4], color=CANVAS_COLOR)
             embed_var.set_author(name=data[0], url=data[1])
             embed_var.set_thumbnail(url=CANVAS_THUMBNAIL_URL)
             embed_var.add_field(name="Created at", value=data[5])
-            await ctx.send(embed=embed_var)
+            embed_var.set_footer(text=f"Announcement {i + 1}/{len(announcements)}")
+            return embed_var
+
+        await Paginator(self.bot, len(announcements), render_page).send(ctx)
+
+    @commands.command(hidden=True)
+    @commands.has_permissions(administrator=True)
+    @commands.cooldown(1, 10, commands.BucketType.guild)
+    async def gradestats(self, ctx: commands.Context, assignment: str, *course_ids: str):
+        """
+        `!gradestats <assignment ID or name> [course IDs...]`
+
+        Sends the grade distribution (mean, median, quartiles, histogram, late and missing counts) of an
+        assignment in the tracked courses. Quote names that contain spaces, e.g. `!gradestats "Lab 3"`.
+
+        *Only usable by TAs and Profs
+        """
+
+        c_handler = self._get_canvas_handler(ctx.message.guild)
+
+        if not isinstance(c_handler, CanvasHandler):
+            raise BadArgs("Canvas Handler doesn't exist.")
+
+        async with ctx.typing():
+            matches = await self.bot.loop.run_in_executor(None, c_handler.find_assignments, assignment, course_ids)
+
+            if not matches:
+                raise BadArgs("No matching assignment found.")
+            elif len(matches) > 1:
+                raise BadArgs("Multiple assignments match, please use one of these IDs:\n" + "\n".join(f"`{a.id}`: {a.name} ({c.name})" for c, a in matches[:10]))
+
+            course, asgn = matches[0]
+            stats = await self.bot.loop.run_in_executor(None, c_handler.get_grade_stats, course, asgn)
+            image = await self.bot.loop.run_in_executor(None, partial(render_histogram, stats, asgn.name))
+
+        def fmt(value: Optional[float]) -> str:
+            return "N/A" if value is None else f"{value:.2f}"
+
+        embed_var = discord.Embed(title=f"Grade distribution: {asgn.name}", url=getattr(asgn, "html_url", None), color=CANVAS_COLOR)
+        embed_var.set_author(name=course.name)
+        embed_var.set_thumbnail(url=CANVAS_THUMBNAIL_URL)
+        embed_var.add_field(name="Graded", value=f"{stats['graded']}/{stats['submissions']}")
+        embed_var.add_field(name="Points possible", value=fmt(stats["points_possible"]))
+        embed_var.add_field(name="Mean (SD)", value=f"{fmt(stats['mean'])} ({fmt(stats['std'])})")
+        embed_var.add_field(name="Min / Max", value=f"{fmt(stats['min'])} / {fmt(stats['max'])}")
+        embed_var.add_field(name="Q1 / Median / Q3", value=f"{fmt(stats['q1'])} / {fmt(stats['median'])} / {fmt(stats['q3'])}")
+        embed_var.add_field(name="Late / Missing / Excused", value=f"{stats['late']} / {stats['missing']} / {stats['excused']}")
+        embed_var.set_image(url="attachment://gradestats.png")
+        embed_var.set_footer(text=f"Last graded at {stats['latest_graded_at'] or 'N/A'}{' (cached)' if stats['cached'] else ''}")
+        await ctx.send(embed=embed_var, file=discord.File(image, "gradestats.png"))
+
+    @commands.command(hidden=True)
+    @commands.has_permissions(administrator=True)
+    async def clink(self, ctx: commands.Context, login_id: str, member: Optional[discord.Member] = None):
+        """
+        `!clink <Canvas login ID> [member]`
+
+        Links a member's Discord account (yours by default) to the Canvas user with the given login ID.
+        Linked accounts receive the roles of their Canvas enrollments when the server syncs its roster, so
+        only admins can link accounts.
+        """
+
+        member = member or ctx.author
+        guild_dict = self.canvas_dict.setdefault(str(ctx.guild.id), {"courses": [], "live_channels": [], "due_week": {}, "due_day": {}})
+        links = guild_dict.setdefault("links", {})
+        login_id = login_id.lower()
+
+        if any(identity == login_id and member_id != str(member.id) for member_id, identity in links.items()):
+            raise BadArgs("That Canvas account is already linked to another member.")
+
+        links[str(member.id)] = login_id
+        write_json(self.canvas_dict, "data/canvas.json")
+        await ctx.message.add_reaction("✅")
+
+    @commands.command(hidden=True)
+    @commands.has_permissions(administrator=True)
+    async def rolemap(self, ctx: commands.Context, course_id: str, enrollment: str, role: discord.Role):
+        """
+        `!rolemap <course ID> <student | ta | teacher | section ID> <role>`
+
+        Maps a Canvas enrollment type or section of a tracked course to a Discord role, opting the course
+        in to roster syncing. Linked members get the roles of their enrollments on the next `!rolesync`
+        and in the periodic sync.
+        """
+
+        c_handler = self._get_canvas_handler(ctx.message.guild)
+
+        if not isinstance(c_handler, CanvasHandler) or course_id not in (str(c.id) for c in c_handler.courses):
+            raise BadArgs("That course isn't being tracked.")
+
+        mapping = self.canvas_dict[str(ctx.guild.id)].setdefault("role_sync", {}).setdefault(course_id, {"sections": {}})
+
+        if enrollment.lower() in ("student", "ta", "teacher"):
+            mapping[enrollment.lower()] = role.id
+        elif enrollment.isdigit():
+            mapping["sections"][enrollment] = role.id
+        else:
+            raise BadArgs("Enrollment must be student, ta, teacher or a section ID.", show_help=True)
+
+        write_json(self.canvas_dict, "data/canvas.json")
+        await ctx.send(f"Mapped {enrollment} in course {course_id} to {role.name}.")
+
+    @commands.command(hidden=True)
+    @commands.has_permissions(administrator=True)
+    @commands.cooldown(1, 60, commands.BucketType.guild)
+    async def rolesync(self, ctx: commands.Context, *course_ids: str):
+        """
+        `!rolesync [course IDs...]`
+
+        Syncs Discord roles with the Canvas roster of the given courses, or of all courses with a role mapping.
+        """
+
+        c_handler = self._get_canvas_handler(ctx.message.guild)
+
+        if not isinstance(c_handler, CanvasHandler):
+            raise BadArgs("Canvas Handler doesn't exist.")
+
+        async with ctx.typing():
+            result = await self._sync_roles(c_handler, course_ids)
+
+        await ctx.send(f"Roster sync done: {result['updated']} members updated, {result['failed']} failed.")
+
+    async def _sync_roles(self, ch: CanvasHandler, course_ids: tuple[str, ...] = ()) -> dict[str, int]:
+        """
+        Syncs member roles with the rosters of the courses tracked by ch that have a role mapping. The roster of
+        each course is fetched with one paginated request, and only members whose managed roles differ from the
+        roster are edited.
+        """
+
+        guild_dict = self.canvas_dict.get(str(ch.guild.id), {})
+        role_sync = guild_dict.get("role_sync", {})
+        links = guild_dict.get("links", {})
+        desired, managed = {}, set()
+
+        for c in ch.courses:
+            if str(c.id) in role_sync and (not course_ids or str(c.id) in course_ids):
+                roster = await self.bot.loop.run_in_executor(None, ch.get_roster, c)
+
+                for identity, roles in get_desired_roles(roster, role_sync[str(c.id)]).items():
+                    desired.setdefault(identity, set()).update(roles)
+
+                managed |= get_managed_roles(role_sync[str(c.id)])
+
+        changes = compute_role_diff(ch.guild, links, desired, managed)
+        return await self.role_sync_worker.apply(ch.guild, changes)
+
+    async def roster_sync(self) -> None:
+        """
+        Every x interval, we sync member roles with the Canvas rosters of courses that have a role mapping.
+        """
+
+        # on_ready fires again after a reconnect, and one loop is enough
+        if self._syncing_rosters:
+            return
+
+        self._syncing_rosters = True
+        await self.bot.wait_until_ready()
+
+        while True:
+            for ch in self.bot.d_handler.canvas_handlers:
+                if self.canvas_dict.get(str(ch.guild.id), {}).get("role_sync"):
+                    try:
+                        await self._sync_roles(ch)
+                    except Exception:
+                        print(traceback.format_exc(), flush=True)
+
+            await asyncio.sleep(60 * 30)
+
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def cachestats(self, ctx: commands.Context):
+        """
+        `!cachestats`
+
+        Shows hit/miss counts of the `!asgn`/`!annc` result cache.
+        """
+
+        stats = self.query_cache.stats()
+        await ctx.send(f"Entries: {stats['entries']}\nHits: {stats['hits']}\nMisses: {stats['misses']}\nCoalesced: {stats['coalesced']}\nHit rate: {stats['hit_rate']:.1%}")
 
     @commands.command(hidden=True)
     @commands.is_owner()
@@ -311,6 +521,88 @@ class Canvas(commands.Cog):
 
             await asyncio.sleep(30)
 
+    async def discussion_tracking(self) -> None:
+        """
+        Every x interval, we mirror new discussion topics and replies for courses being tracked into the
+        channels that are live tracking the courses. Each topic gets a root message per channel, and its
+        entries are sent as replies to that message.
+        """
+
+        # on_ready fires again after a reconnect, and one loop is enough
+        if self._tracking_discussions:
+            return
+
+        self._tracking_discussions = True
+        await self.bot.wait_until_ready()
+
+        while True:
+            for ch in filter(operator.attrgetter("live_channels"), self.bot.d_handler.canvas_handlers):
+                for c in ch.courses:
+                    try:
+                        state = CanvasHandler.load_discussion_state(c.id)
+                        updates, new_state = await self.bot.loop.run_in_executor(None, ch.get_discussion_updates, c, state, self.bot.notify_unpublished)
+
+                        # Topics with updates keep their old state until they've been sent, so a failure part
+                        # way through only resends the topics that weren't sent yet
+                        pending = {update["topic_id"] for update in updates}
+                        saved_state = {topic_id: (state or {}).get(topic_id) if topic_id in pending else topic_state for topic_id, topic_state in new_state.items()}
+                        saved_state = {topic_id: topic_state for topic_id, topic_state in saved_state.items() if topic_state}
+                        CanvasHandler.save_discussion_state(c.id, saved_state)
+
+                        for update in updates:
+                            threads = new_state[update["topic_id"]]["threads"]
+
+                            for channel in ch.live_channels:
+                                # A channel the bot can no longer send to mustn't hold up the others
+                                try:
+                                    await self._send_discussion_update(channel, update, threads)
+                                except Exception:
+                                    print(traceback.format_exc(), flush=True)
+
+                            saved_state[update["topic_id"]] = new_state[update["topic_id"]]
+                            CanvasHandler.save_discussion_state(c.id, saved_state)
+                    except Exception:
+                        print(traceback.format_exc(), flush=True)
+
+            await asyncio.sleep(60)
+
+    async def _send_discussion_update(self, channel: discord.TextChannel, update: dict, threads: dict[str, int]) -> None:
+        """
+        Sends a discussion topic's new entries to channel as replies to the topic's root message, sending
+        the root message first if the topic has none in this channel yet. `threads` maps channel IDs to
+        root message IDs and is updated in place.
+        """
+
+        root_id = threads.get(str(channel.id))
+        title = update["title"]
+
+        if len(title) > MAX_DISCUSSION_TITLE_LENGTH:
+            title = f"{title[:MAX_DISCUSSION_TITLE_LENGTH - 3]}..."
+
+        if root_id is None:
+            embed_var = discord.Embed(title=f"Discussion: {title}", url=update["url"], description=update["message"], color=CANVAS_COLOR)
+            embed_var.set_thumbnail(url=CANVAS_THUMBNAIL_URL)
+            embed_var.add_field(name="Posted by", value=update["author"])
+            embed_var.add_field(name="Posted at", value=update["posted_at"])
+            root_id = (await channel.send(embed=embed_var)).id
+            threads[str(channel.id)] = root_id
+
+        reference = discord.MessageReference(message_id=root_id, channel_id=channel.id, fail_if_not_exists=False)
+        embed_var = discord.Embed(title=f"New replies in {title}", url=update["url"], color=CANVAS_COLOR)
+
+        for entry in update["entries"]:
+            name = f"{'↳ ' if entry['reply'] else ''}{entry['author']} at {CanvasHandler._format_canvas_time(entry['created_at'])}"
+            value = entry["message"][:MAX_DISCUSSION_ENTRY_LENGTH]
+
+            if len(embed_var.fields) == 25 or len(name) + len(value) + len(embed_var) > EMBED_CHAR_LIMIT:
+                await channel.send(embed=embed_var, reference=reference, mention_author=False)
+                embed_var = discord.Embed(title=f"New replies in {title} (continued)", url=update["url"], color=CANVAS_COLOR)
+
+            embed_var.add_field(name=name, value=value or "\u200b", inline=False)
+
+        if embed_var.fields:
+            await channel.send(embed=embed_var, reference=reference, mention_author=False)
+
     async def assignment_reminder(self) -> None:
         while True:
             for ch in filter(operator.attrgetter("live_channels"), self.bot.d_handler.canvas_handlers):
@@ -318,7 +610,8 @@ class Canvas(commands.Cog):
 
                 for c in ch.courses:
                     for time in ("week", "day"):
-                        data_list = ch.get_assignments(f"1-{time}", (str(c.id),), CANVAS_API_URL)
+                        # The day reminder reuses the assignments just fetched for the week reminder
+                        data_list = ch.get_assignments(f"1-{time}", (str(c.id),), CANVAS_API_URL, None if time == "week" else POLLER_DATA_MAX_AGE)
 
                         if time == "week":
                             recorded_ass_ids = ch.due_week[str(c.id)]
@@ -9,21 +9,65 @@ You also need FFmpeg in your PATH environment variable or the FFmpeg.exe binary
 """
 
 import asyncio
-import functools
-import itertools
+import collections
 import math
+import os
 import random
 import re
+import shlex
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from typing import Optional
 
 import discord
-import youtube_dl
+import psutil
 from async_timeout import timeout
 from discord.ext import commands
 
-# Silence useless bug reports messages
+from util.audio_cache import AudioCache
 from util.badargs import BadArgs
+from util.broadcast import Broadcast, BroadcastSubscriber
+from util.fair_queue import FairQueue
+from util.paginator import Paginator
+from util.playback_stats import PlaybackStats
+from util.ytdl_cache import STREAM_URL_MARGIN, ExtractionCache, stream_url_expiry
+from util.ytdl_pool import ExtractionError, ExtractionPool
 
-youtube_dl.utils.bug_reports_message = lambda: ""
+# Links to a single video or track, which youtube-dl can resolve in one pass, and links to playlists
+DIRECT_URL = re.compile(r"https://(www\.youtube\.com/watch\?v=|youtu\.be/|soundcloud\.com/(?!.*/sets/))", flags=re.IGNORECASE)
+PLAYLIST_URL = re.compile(r"https://(www\.youtube\.com/playlist\?|soundcloud\.com/.+/sets/)", flags=re.IGNORECASE)
+
+# Playlists are cut off after this many songs
+MAX_PLAYLIST_SONGS = 500
+
+# Only songs up to this long are saved to the audio cache
+MAX_CACHED_SECONDS = 60 * 30
+
+# The next song's FFmpeg pipeline is started PREFETCH_LEAD seconds before the current song ends, so it has
+# connected and buffered audio by the time it's played. GAP_SAMPLES track changes are kept per guild.
+PREFETCH_LEAD = 15
+GAP_SAMPLES = 100
+
+# Voice states of guilds that have been disconnected with nothing queued for VOICE_STATE_IDLE seconds are
+# dropped, checked every VOICE_STATE_EVICT_INTERVAL seconds
+VOICE_STATE_IDLE = 60 * 10
+VOICE_STATE_EVICT_INTERVAL = 60
+
+# Servers listed on each page of !mstats
+MSTATS_SERVERS_PER_PAGE = 5
+
+# What FFmpeg logs when it reconnects to a stream
+FFMPEG_RECONNECT_LOG = b"Will reconnect"
+
+
+def process_rss(pid: int) -> int:
+    try:
+        return psutil.Process(pid).memory_info().rss
+    except psutil.Error:
+        return 0
 
 
 class VoiceError(Exception):
@@ -34,7 +78,88 @@ class YTDLError(Exception):
     pass
 
 
-class YTDLSource(discord.PCMVolumeTransformer):
+class Track:
+    """
+    Metadata of a song, as resolved by youtube-dl. Holds no FFmpeg process or open stream, so queueing a
+    song only costs a few hundred bytes until it's played.
+
+    Songs from playlists start out with just what the playlist lists about them, and are only resolved
+    once they're next in the queue.
+    """
+
+    __slots__ = ("title", "url", "stream_url", "expires", "acodec", "uploader", "uploader_url", "thumbnail", "seconds", "duration", "is_live", "resolved")
+
+    def __init__(self, data: dict):
+        self.update(data)
+
+    def update(self, data: dict) -> None:
+        """
+        Fills in the track's metadata and stream URL from youtube-dl's info
+        """
+
+        self.resolved = True
+        self.title = data.get("title")
+        self.url = data.get("webpage_url")
+        self.uploader = data.get("uploader")
+        self.uploader_url = data.get("uploader_url")
+        self.thumbnail = data.get("thumbnail")
+        self.acodec = data.get("acodec")
+        self.seconds = int(data.get("duration") or 0)
+        self.duration = self.parse_duration(self.seconds)
+        self.is_live = bool(data.get("is_live"))
+        self.set_stream_url(data.get("url"), data.get("stream_expires"))
+
+    @classmethod
+    def from_entry(cls, entry: dict) -> Optional["Track"]:
+        """
+        Returns an unresolved track for a playlist entry listed by youtube-dl, or None if it has no link
+        """
+
+        url = entry.get("webpage_url") or entry.get("url")
+
+        if not url:
+            return None
+
+        # YouTube's playlists link their videos by ID
+        if "://" not in url and entry.get("ie_key") == "Youtube":
+            url = f"https://www.youtube.com/watch?v={url}"
+
+        track = cls({"title": entry.get("title") or url, "webpage_url": url, "uploader": entry.get("uploader"), "duration": entry.get("duration")})
+        track.resolved = False
+        return track
+
+    def __str__(self):
+        return f"**{self.title}** by **{self.uploader}**"
+
+    def set_stream_url(self, stream_url: Optional[str], expires: Optional[float] = None) -> None:
+        self.stream_url = stream_url
+        self.expires = expires if stream_url and expires else stream_url_expiry(stream_url)
+
+    @property
+    def expired(self) -> bool:
+        return self.expires - time.time() < STREAM_URL_MARGIN
+
+    @staticmethod
+    def parse_duration(duration: int):
+        minutes, seconds = divmod(duration, 60)
+        hours, minutes = divmod(minutes, 60)
+        days, hours = divmod(hours, 24)
+
+        duration = []
+
+        if days > 0:
+            duration.append(f"{days} days")
+        if hours > 0:
+            duration.append(f"{hours} hours")
+        if minutes > 0:
+            duration.append(f"{minutes} minutes")
+        if seconds > 0:
+            duration.append(f"{seconds} seconds")
+
+        return ", ".join(duration)
+
+
+class YTDLSource(discord.FFmpegOpusAudio):
     YTDL_OPTIONS = {
         "format": "bestaudio/best",
         "extractaudio": True,
@@ -57,37 +182,94 @@ class YTDLSource(discord.PCMVolumeTransformer):
         "executable": "C:/FFmpeg/bin/ffmpeg.exe"
     }
 
-    ytdl = youtube_dl.YoutubeDL(YTDL_OPTIONS)
+    # Length of the audio in each packet read from FFmpeg
+    FRAME_LENGTH = 0.02
 
-    def __init__(self, ctx: commands.Context, source: discord.FFmpegPCMAudio, *, data: dict, volume: float = 0.5):
-        super().__init__(source, volume)
-        self.requester = ctx.author
-        self.channel = ctx.channel
-        self.data = data
-        self.uploader = data.get("uploader")
-        self.uploader_url = data.get("uploader_url")
-        date = data.get("upload_date")
-        self.upload_date = date[6:8] + "." + date[4:6] + "." + date[0:4]
-        self.title = data.get("title")
-        self.thumbnail = data.get("thumbnail")
-        self.description = data.get("description")
-        self.duration = self.parse_duration(int(data.get("duration")))
-        self.tags = data.get("tags")
-        self.url = data.get("webpage_url")
-        self.views = data.get("view_count")
-        self.likes = data.get("like_count")
-        self.dislikes = data.get("dislike_count")
-        self.stream_url = data.get("url")
+    pool = ExtractionPool(YTDL_OPTIONS)
+    cache = ExtractionCache()
+    audio_cache = AudioCache()
+    # Live streams being played, by URL and volume
+    broadcasts: dict[tuple[str, float], Broadcast] = {}
+
+    def __init__(self, track: Track, *, volume: float = 0.5, start: float = 0.0, path: Optional[str] = None):
+        """
+        Spawns FFmpeg, which opens the stream (or the cached file at `path`) right away and sends Opus packets
+        that discord.py passes straight through to Discord. Opus audio played at 100% volume is copied without
+        being decoded at all; otherwise FFmpeg applies the volume and encodes to Opus itself, so no audio is
+        processed in Python.
+        """
+
+        self.track = track
+        self.volume = volume
+        self.start = start
+        self.path = path
+        self.frames = 0
+        self.reconnects = 0
+        # Set by the voice state playing the source
+        self.stats: Optional[PlaybackStats] = None
+        passthrough = volume == 1 and (path or track.acodec == "opus")
+        # Reconnecting only applies to streams
+        before_options = ("" if path else self.FFMPEG_OPTIONS["before_options"]) + (f" -ss {start:.2f}" if start else "")
+        options = self.FFMPEG_OPTIONS["options"] + ("" if passthrough else f" -filter:a volume={volume:.2f}")
+        super().__init__(path or track.stream_url, codec="opus" if passthrough else None, executable=self.FFMPEG_OPTIONS["executable"], before_options=before_options, options=options,
+                         stderr=subprocess.PIPE)
+        threading.Thread(target=self._watch_log, args=(self._process.stderr,), daemon=True).start()
 
     def __str__(self):
-        return f"**{self.title}** by **{self.uploader}**"
+        return str(self.track)
+
+    def _watch_log(self, stderr) -> None:
+        # Counts FFmpeg's reconnections, passing its log through to the bot's
+        for line in iter(stderr.readline, b""):
+            if FFMPEG_RECONNECT_LOG in line:
+                self.reconnects += 1
+
+            sys.stderr.buffer.write(line)
+            sys.stderr.flush()
+
+    @property
+    def process(self) -> Optional[subprocess.Popen]:
+        return getattr(self, "_process", None)
+
+    @property
+    def position(self) -> float:
+        """
+        Seconds into the track of the last packet read
+        """
+
+        return self.start + self.frames * self.FRAME_LENGTH
+
+    def read(self) -> bytes:
+        started = time.perf_counter()
+        self.frames += 1
+        packet = super().read()
+
+        if self.stats:
+            self.stats.record_read(self, started, packet)
+
+        return packet
 
     @classmethod
-    async def create_source(cls, ctx: commands.Context, search: str, *, loop: asyncio.BaseEventLoop = None):
-        loop = loop or asyncio.get_event_loop()
+    async def extract_info(cls, search: str) -> dict:
+        # Links to a single video are resolved directly; searches and other links are first listed without
+        # resolving their formats, so only the first match is fully extracted
+        if DIRECT_URL.match(search):
+            info = await cls.pool.extract(search, max_entries=1)
+
+            if info is None:
+                raise YTDLError(f"Couldn't fetch `{search}`")
+
+            if "entries" not in info:
+                return info
+
+            info = next((entry for entry in info["entries"] if entry), None)
+
+            if info is None:
+                raise YTDLError(f"Couldn't retrieve any matches for `{search}`")
 
-        partial = functools.partial(cls.ytdl.extract_info, search, download=False, process=False)
-        data = await loop.run_in_executor(None, partial)
+            return info
+
+        data = await cls.pool.extract(search, process=False, max_entries=1)
 
         if data is None:
             raise YTDLError(f"Couldn't find anything that matches `{search}`")
@@ -106,8 +288,7 @@ class YTDLSource(discord.PCMVolumeTransformer):
                 raise YTDLError(f"Couldn't find anything that matches `{search}`")
 
         webpage_url = process_info["webpage_url"]
-        partial = functools.partial(cls.ytdl.extract_info, webpage_url, download=False)
-        processed_info = await loop.run_in_executor(None, partial)
+        processed_info = await cls.pool.extract(webpage_url, max_entries=1)
 
         if processed_info is None:
             raise YTDLError(f"Couldn't fetch `{webpage_url}`")
@@ -123,66 +304,181 @@ class YTDLSource(discord.PCMVolumeTransformer):
                 except IndexError:
                     raise YTDLError(f"Couldn't retrieve any matches for `{webpage_url}`")
 
-        return cls(ctx, discord.FFmpegPCMAudio(info["url"], **cls.FFMPEG_OPTIONS), data=info)
+        return info
 
-    @staticmethod
-    def parse_duration(duration: int):
-        minutes, seconds = divmod(duration, 60)
-        hours, minutes = divmod(minutes, 60)
-        days, hours = divmod(hours, 24)
+    @classmethod
+    async def resolve(cls, search: str, *, need_stream: bool = False) -> dict:
+        """
+        Returns youtube-dl's info for `search`, from the extraction cache if possible. If `need_stream` is set,
+        the info's stream URL must not have expired yet.
+        """
 
-        duration = []
+        try:
+            return await cls.cache.get(search, lambda: cls.extract_info(search), need_stream)
+        except asyncio.TimeoutError:
+            raise YTDLError(f"Timed out while fetching `{search}`")
+        except ExtractionError as e:
+            raise YTDLError(str(e))
 
-        if days > 0:
-            duration.append(f"{days} days")
-        if hours > 0:
-            duration.append(f"{hours} hours")
-        if minutes > 0:
-            duration.append(f"{minutes} minutes")
-        if seconds > 0:
-            duration.append(f"{seconds} seconds")
+    @classmethod
+    async def create_track(cls, search: str) -> Track:
+        # Only the metadata is needed until the song is played, so a cached entry with an expired stream URL does
+        return Track(await cls.resolve(search))
 
-        return ", ".join(duration)
+    @classmethod
+    async def create_playlist(cls, url: str) -> tuple[str, list[Track]]:
+        """
+        Returns the title of the playlist at `url` and its first MAX_PLAYLIST_SONGS songs, unresolved
+        """
 
+        try:
+            info = await cls.pool.extract_playlist(url, MAX_PLAYLIST_SONGS)
+        except asyncio.TimeoutError:
+            raise YTDLError(f"Timed out while fetching `{url}`")
+        except ExtractionError as e:
+            raise YTDLError(str(e))
 
-class Song:
-    __slots__ = ("source", "requester")
+        tracks = [track for track in map(Track.from_entry, (info or {}).get("entries") or []) if track]
 
-    def __init__(self, source: YTDLSource):
-        self.source = source
-        self.requester = source.requester
+        if not tracks:
+            raise YTDLError(f"Couldn't retrieve any songs from `{url}`")
 
-    def create_embed(self):
-        embed = discord.Embed(title="Now playing", description=f"```css\n{self.source.title}\n```", colour=random.randint(0, 0xFFFFFF))
-        embed.add_field(name="Duration", value=self.source.duration)
-        embed.add_field(name="Requested by", value=self.requester.mention)
-        embed.add_field(name="Uploader", value=f"[{self.source.uploader}]({self.source.uploader_url})")
-        embed.add_field(name="URL", value=f"[Click]({self.source.url})")
-        embed.set_thumbnail(url=self.source.thumbnail)
-        return embed
+        return info.get("title") or url, tracks
+
+    @classmethod
+    async def refresh(cls, track: Track) -> None:
+        """
+        Fetches a new stream URL for `track` if the old one is about to expire, resolving the rest of its
+        metadata too if it came from a playlist
+        """
 
+        if track.expired:
+            track.update(await cls.resolve(track.url, need_stream=True))
 
-class SongQueue(asyncio.Queue):
-    def __getitem__(self, item):
-        if isinstance(item, slice):
-            return list(itertools.islice(self._queue, item.start, item.stop, item.step))
-        else:
-            return self._queue[item]
+    @classmethod
+    async def open(cls, track: Track, *, volume: float = 0.5, start: float = 0.0):
+        """
+        Creates the FFmpeg pipeline for `track`, playing it from the audio cache if it's there. Otherwise, a new
+        stream URL is fetched first if the old one is about to expire.
+        """
+
+        path = cls.audio_cache.get(track.url)
+
+        if path:
+            if not track.resolved:
+                track.update(await cls.resolve(track.url))
+
+            return cls(track, volume=volume, start=start, path=path)
+
+        await cls.refresh(track)
+
+        # Live streams can't seek, and are shared by every guild playing them
+        if track.is_live:
+            return cls.open_live(track, volume=volume)
+
+        return cls(track, volume=volume, start=start)
+
+    @classmethod
+    def open_live(cls, track: Track, *, volume: float = 0.5) -> "LiveSource":
+        """
+        Subscribes to the broadcast of the live stream `track` at `volume`, starting one if there is none.
+
+        Opus frames can't be made louder or quieter without decoding and encoding them again, so only guilds
+        playing a stream at the same volume share a broadcast. A guild changing its volume moves to the
+        broadcast for its new volume.
+        """
+
+        key = (track.url, volume)
+
+        def close(broadcast: Broadcast) -> None:
+            if cls.broadcasts.get(key) is broadcast:
+                del cls.broadcasts[key]
 
-    def __iter__(self):
-        return self._queue.__iter__()
+        while True:
+            broadcast = cls.broadcasts.get(key)
+
+            if broadcast is None:
+                broadcast = cls.broadcasts[key] = Broadcast(cls(track, volume=volume), on_close=close)
+
+            source = LiveSource(broadcast, track, volume)
+
+            # The last subscriber may have detached from the broadcast in the meantime, closing it
+            if broadcast.attach(source):
+                return source
+
+    @classmethod
+    async def cache_audio(cls, track: Track) -> None:
+        """
+        Counts a play of `track`, and saves it to the audio cache in the background once it's played often
+        """
+
+        if not track.seconds or track.seconds > MAX_CACHED_SECONDS or not cls.audio_cache.record_play(track.url):
+            return
 
-    def __len__(self):
-        return self.qsize()
+        try:
+            await cls.refresh(track)
+            await cls.audio_cache.transcode(track.url, track.stream_url, cls.FFMPEG_OPTIONS["executable"], tuple(shlex.split(cls.FFMPEG_OPTIONS["before_options"])))
+        except Exception:
+            print(traceback.format_exc(), flush=True)
 
-    def clear(self):
-        self._queue.clear()
 
-    def shuffle(self):
-        random.shuffle(self._queue)
+class LiveSource(BroadcastSubscriber):
+    """
+    A guild's subscription to the broadcast of a live stream
+    """
 
-    def remove(self, index: int):
-        del self._queue[index]
+    def __init__(self, broadcast: Broadcast, track: Track, volume: float):
+        super().__init__(broadcast)
+        self.track = track
+        self.volume = volume
+        self.start = 0.0
+        self.path = None
+        self.stats: Optional[PlaybackStats] = None
+
+    def __str__(self):
+        return str(self.track)
+
+    @property
+    def reconnects(self) -> int:
+        return self.broadcast.source.reconnects
+
+    def read(self) -> bytes:
+        started = time.perf_counter()
+        packet = super().read()
+
+        if self.stats:
+            self.stats.record_read(self, started, packet)
+
+        return packet
+
+    @property
+    def process(self) -> Optional[subprocess.Popen]:
+        return self.broadcast.source.process
+
+    @property
+    def position(self) -> float:
+        return self.frames * YTDLSource.FRAME_LENGTH
+
+
+class Song:
+    __slots__ = ("track", "requester", "channel", "source", "requested_at")
+
+    def __init__(self, ctx: commands.Context, track: Track, requested_at: Optional[float] = None):
+        self.track = track
+        self.requester = ctx.author
+        self.channel = ctx.channel
+        self.source = None
+        # When `!play` was used, if the song was to be played right away
+        self.requested_at = requested_at
+
+    def create_embed(self):
+        embed = discord.Embed(title="Now playing", description=f"```css\n{self.track.title}\n```", colour=random.randint(0, 0xFFFFFF))
+        embed.add_field(name="Duration", value="Live" if self.track.is_live else self.track.duration or "Unknown")
+        embed.add_field(name="Requested by", value=self.requester.mention)
+        embed.add_field(name="Uploader", value=f"[{self.track.uploader}]({self.track.uploader_url})")
+        embed.add_field(name="URL", value=f"[Click]({self.track.url})")
+        embed.set_thumbnail(url=self.track.thumbnail)
+        return embed
 
 
 class VoiceState:
@@ -192,14 +488,45 @@ class VoiceState:
         self.current = None
         self.voice = None
         self.next = asyncio.Event()
-        self.songs = SongQueue()
+        # Songs take turns between requesters
+        self.songs: FairQueue[Song] = FairQueue(lambda song: song.requester.id)
         self._loop = False
         self._volume = 0.5
         self.skip_votes = set()
+        self.gaps = collections.deque(maxlen=GAP_SAMPLES)
+        self.prefetch_hits = 0
+        self._prefetched = None
+        self._prefetch = None
+        self._started_at = 0.0
+        self._ended_at = None
+        self.stats = PlaybackStats()
+        self.last_active = time.monotonic()
         self.audio_player = bot.loop.create_task(self.audio_player_task())
 
-    def __del__(self):
+    def close(self) -> None:
+        """
+        Stops the player task. The voice state can't be used afterwards.
+        """
+
         self.audio_player.cancel()
+        self.cancel_prefetch()
+
+    @property
+    def waiting(self) -> bool:
+        """
+        Whether the player is waiting for a song to be queued
+        """
+
+        return not self.songs and not self.loop and not (self.voice and (self.voice.is_playing() or self.voice.is_paused()))
+
+    @property
+    def idle(self) -> bool:
+        """
+        Whether the guild has been disconnected from voice with nothing queued for VOICE_STATE_IDLE seconds
+        """
+
+        connected = self.voice and self.voice.is_connected()
+        return not connected and not self.songs and time.monotonic() - self.last_active > VOICE_STATE_IDLE
 
     @property
     def loop(self):
@@ -208,19 +535,53 @@ class VoiceState:
     @loop.setter
     def loop(self, value: bool):
         self._loop = value
+        self.schedule_prefetch()
 
     @property
     def volume(self):
         return self._volume
 
-    @volume.setter
-    def volume(self, value: float):
+    async def set_volume(self, value: float) -> None:
+        """
+        Sets the volume. FFmpeg applies the volume, so the playing song's pipeline is restarted where it was.
+        """
+
         self._volume = value
+        song = self.current
+
+        # A prefetched pipeline has the old volume
+        self.cancel_prefetch()
+        self.schedule_prefetch()
+
+        if not song or not song.source or not self.voice or self.voice.source is not song.source:
+            return
+
+        # Live streams can't seek, so they restart from where they are now
+        source = await YTDLSource.open(song.track, volume=value, start=0.0 if song.track.is_live else song.source.position)
+
+        source.stats = self.stats
+
+        # The song may have ended while the stream URL was fetched
+        if self.current is song and song.source and self.voice and self.voice.source is song.source:
+            old, song.source = song.source, source
+            self.voice.source = source
+            old.cleanup()
+        else:
+            source.cleanup()
 
     @property
     def is_playing(self):
         return self.voice and self.current
 
+    @property
+    def processes(self) -> list[subprocess.Popen]:
+        """
+        FFmpeg processes started for this guild that are still running
+        """
+
+        songs = [song for song in (self.current, self._prefetched) if song]
+        return [song.source.process for song in songs if song.source and song.source.process and song.source.process.poll() is None]
+
     async def audio_player_task(self):
         while True:
             self.next.clear()
@@ -237,12 +598,91 @@ class VoiceState:
                     self.bot.loop.create_task(self.stop())
                     return
 
-            self.current.source.volume = self._volume
+            if self.current is self._prefetched and self.current.source:
+                self.prefetch_hits += 1
+            else:
+                self.cancel_prefetch()
+
+            # The song now owns the prefetched pipeline, if any
+            if self._prefetch:
+                self._prefetch.cancel()
+
+            self._prefetched = self._prefetch = None
+
+            # FFmpeg is only started now (or shortly before, by the prefetch), so queued songs hold no process
+            # or stream. Looped songs get a new one each time since the previous one has reached the end of its stream.
+            try:
+                if not self.current.source:
+                    self.current.source = await YTDLSource.open(self.current.track, volume=self._volume)
+            except YTDLError as e:
+                self.loop = False
+                await self.current.channel.send(f"An error occurred while playing {self.current.track}: {e}")
+                continue
+
+            self.current.source.stats = self.stats
+
+            if self.current.requested_at:
+                self.stats.expect_first_audio(self.current.requested_at)
+                self.current.requested_at = None
+
             self.voice.play(self.current.source, after=self.play_next_song)
-            await self.current.source.channel.send(embed=self.current.create_embed())
+            self._started_at = self.last_active = time.monotonic()
+            self.bot.loop.create_task(YTDLSource.cache_audio(self.current.track))
+
+            if self._ended_at is not None:
+                self.gaps.append(self._started_at - self._ended_at)
+
+            self.schedule_prefetch()
+            await self.current.channel.send(embed=self.current.create_embed())
             await self.next.wait()
+            self.current.source = None
+
+    def schedule_prefetch(self) -> None:
+        """
+        Makes sure the song at the front of the queue is being prefetched, cancelling the prefetch of any
+        other song. Call after anything that may change which song plays next.
+        """
+
+        upcoming = self.songs[0] if self.songs and not self.loop else None
+
+        if upcoming is self._prefetched:
+            return
+
+        self.cancel_prefetch()
+
+        # Live streams don't end and other songs without a duration don't say when they do, so there's nothing to prefetch for
+        if upcoming and self.current and self.current.track.seconds:
+            delay = self.current.track.seconds - PREFETCH_LEAD - (time.monotonic() - self._started_at)
+            self._prefetched = upcoming
+            self._prefetch = self.bot.loop.create_task(self.prefetch(upcoming, max(delay, 0)))
+
+    async def prefetch(self, song: Song, delay: float) -> None:
+        """
+        Fetches `song`'s stream URL now if needed, and starts its FFmpeg pipeline `delay` seconds from now
+        """
+
+        try:
+            await YTDLSource.refresh(song.track)
+            await asyncio.sleep(delay)
+            song.source = await YTDLSource.open(song.track, volume=self._volume)
+        except YTDLError:
+            # Tried again when the song is played, which reports the error
+            pass
+
+    def cancel_prefetch(self) -> None:
+        if self._prefetch:
+            self._prefetch.cancel()
+
+        if self._prefetched and self._prefetched.source:
+            self._prefetched.source.cleanup()
+            self._prefetched.source = None
+
+        self._prefetched = self._prefetch = None
 
     def play_next_song(self, error=None):
+        # Track changes are timed from here, unless the player has to wait for a song to be queued
+        self._ended_at = time.monotonic() if self.songs or self.loop else None
+
         if error:
             raise VoiceError(str(error))
 
@@ -256,6 +696,7 @@ class VoiceState:
 
     async def stop(self):
         self.songs.clear()
+        self.cancel_prefetch()
 
         if self.voice:
             await self.voice.disconnect()
@@ -267,6 +708,7 @@ class Music(commands.Cog):
         self.bot = bot
         self.voice_states = {}
         self.voice_state = None
+        self._evicting = False
 
     def get_voice_state(self, ctx: commands.Context):
         state = self.voice_states.get(ctx.guild.id)
@@ -279,10 +721,35 @@ class Music(commands.Cog):
 
     def cog_unload(self):
         for state in self.voice_states.values():
+            state.close()
             self.bot.loop.create_task(state.stop())
 
+        YTDLSource.pool.shutdown()
+
     async def cog_before_invoke(self, ctx: commands.Context):
         self.voice_state = self.get_voice_state(ctx)
+        self.voice_state.last_active = time.monotonic()
+
+    async def evict_voice_states(self) -> None:
+        """
+        Every x interval, we drop the voice states of guilds that have been disconnected and idle for a while,
+        stopping their player tasks, so they don't pile up across servers
+        """
+
+        # on_ready fires again after a reconnect, and one loop is enough
+        if self._evicting:
+            return
+
+        self._evicting = True
+        await self.bot.wait_until_ready()
+
+        while True:
+            for guild_id, state in list(self.voice_states.items()):
+                if state.idle:
+                    state.close()
+                    del self.voice_states[guild_id]
+
+            await asyncio.sleep(VOICE_STATE_EVICT_INTERVAL)
 
     @commands.command(aliases=["l"])
     @commands.cooldown(1, 5, commands.BucketType.user)
@@ -301,6 +768,7 @@ class Music(commands.Cog):
             return await ctx.send("Not connected to any voice channel.")
 
         await self.voice_state.stop()
+        self.voice_state.close()
         del self.voice_states[ctx.guild.id]
 
     @commands.command()
@@ -322,6 +790,85 @@ class Music(commands.Cog):
         self.voice_state.loop = not self.voice_state.loop
         await ctx.message.add_reaction("✅")
 
+    @commands.command(aliases=["mv"])
+    @commands.cooldown(1, 5, commands.BucketType.user)
+    async def move(self, ctx: commands.Context, index: int, to: int):
+        """
+        `!move` __`Move song`__
+        **Aliases:** mv
+
+        **Usage:** !move <index> <new index>
+
+        **Examples:**
+        `!move 5 1` moves fifth song to the front of the queue
+        """
+
+        songs = self.voice_state.songs
+
+        if not songs:
+            raise BadArgs("Empty queue.")
+
+        if not 1 <= index <= len(songs) or not 1 <= to <= len(songs):
+            raise BadArgs("Invalid index.")
+
+        songs.move(index - 1, to - 1)
+        self.voice_state.schedule_prefetch()
+        await ctx.message.add_reaction("✅")
+
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def mstats(self, ctx: commands.Context):
+        """
+        `!mstats`
+
+        **Usage:** !mstats
+
+        **Examples:**
+        `!mstats` shows each server's queue length, running FFmpeg processes, their memory use, the gap between songs and playback stats
+        """
+
+        cache = YTDLSource.cache.stats()
+        response = f"Bot RSS: {process_rss(os.getpid()) / 2 ** 20:.1f} MiB\n"
+        response += f"Extraction cache: {cache['entries']}/{cache['maxsize']} entries, {cache['hit_rate']:.1%} hit rate "
+        response += f"({cache['hits']} hits, {cache['coalesced']} coalesced, {cache['misses']} extracted)\n"
+        pool = YTDLSource.pool.stats()
+        response += f"Extractions: {pool['extractions']}, {pool['avg_time']:.2f}s avg, {pool['timeouts']} timed out\n"
+        listeners = sum(len(broadcast) for broadcast in YTDLSource.broadcasts.values())
+        response += f"Live broadcasts: {len(YTDLSource.broadcasts)}, {listeners} listening\n"
+        audio = YTDLSource.audio_cache.stats()
+        response += f"Audio cache: {audio['files']} files, {audio['size'] / 2 ** 20:.0f}/{audio['max_bytes'] / 2 ** 20:.0f} MiB, "
+        response += f"{audio['hits']} cached plays, {audio['transcodes']} transcoded, {audio['evictions']} evicted\n"
+
+        lines = []
+
+        for guild_id, state in self.voice_states.items():
+            guild = self.bot.get_guild(guild_id)
+            processes = state.processes
+            rss = sum(process_rss(process.pid) for process in processes)
+            line = f"**{guild.name if guild else guild_id}**: {len(state.songs)} queued, {len(processes)} FFmpeg processes, {rss / 2 ** 20:.1f} MiB"
+
+            if state.gaps:
+                line += f", track change gap {sum(state.gaps) / len(state.gaps) * 1000:.0f} ms avg / {max(state.gaps) * 1000:.0f} ms max over {len(state.gaps)}, {state.prefetch_hits} prefetched"
+
+            playback = state.stats.stats()
+
+            if playback["frames"]:
+                line += f", {playback['frames']} frames sent, jitter {playback['jitter_p50'] * 1000:.1f}/{playback['jitter_p95'] * 1000:.1f}/{playback['jitter_p99'] * 1000:.1f} ms (p50/p95/p99), "
+                line += f"{playback['underruns']} underruns, {playback['stalls']} stalls, {playback['reconnects']} reconnects"
+
+            if state.stats.first_audio:
+                line += f", first audio {playback['first_audio']:.2f}s avg after !play"
+
+            lines.append(line)
+
+        # One line per server doesn't fit in a single message across many servers, so they're paged
+        def render_page(items: list, i: int, pages: int) -> discord.Embed:
+            embed = discord.Embed(title="Music stats", description=response + "\n" + "\n".join(items), colour=random.randint(0, 0xFFFFFF))
+            embed.set_footer(text=f"{len(lines)} servers, viewing page {i + 1}/{pages}")
+            return embed
+
+        await Paginator.from_items(self.bot, lines, MSTATS_SERVERS_PER_PAGE, render_page).send(ctx)
+
     @commands.command()
     @commands.cooldown(1, 5, commands.BucketType.user)
     async def now(self, ctx: commands.Context):
@@ -363,11 +910,14 @@ class Music(commands.Cog):
 
         **Examples:**
         `!play https://www.youtube.com/watch?v=dQw4w9WgXcQ` plays Never Gonna Give You Up
+        `!play https://www.youtube.com/playlist?list=<id>` queues the whole playlist
         """
 
         if not re.match(r"https://(www\.youtube|soundcloud)\.com", search, flags=re.IGNORECASE):
             raise BadArgs("Only links allowed.")
 
+        requested_at = time.monotonic()
+
         if not ctx.voice_client:
             destination = ctx.author.voice.channel
 
@@ -378,15 +928,32 @@ class Music(commands.Cog):
             self.voice_state.voice = await destination.connect()
 
         async with ctx.typing():
+            if PLAYLIST_URL.match(search):
+                try:
+                    title, tracks = await YTDLSource.create_playlist(search)
+                except YTDLError as e:
+                    await ctx.send(f"An error occurred while processing this request: {e}", delete_after=5)
+                else:
+                    # Only a song that plays right away is timed to its first audio
+                    requested_at = requested_at if self.voice_state.waiting else None
+
+                    for track in tracks:
+                        self.voice_state.songs.put(Song(ctx, track, requested_at))
+                        requested_at = None
+
+                    self.voice_state.schedule_prefetch()
+                    await ctx.send(f"Enqueued {len(tracks)} songs from **{title}**")
+
+                return
+
             try:
-                source = await YTDLSource.create_source(ctx, search, loop=self.bot.loop)
+                track = await YTDLSource.create_track(search)
             except YTDLError as e:
                 await ctx.send(f"An error occurred while processing this request: {e}", delete_after=5)
             else:
-                song = Song(source)
-
-                await self.voice_state.songs.put(song)
-                await ctx.send(f"Enqueued {source}")
+                self.voice_state.songs.put(Song(ctx, track, requested_at if self.voice_state.waiting else None))
+                self.voice_state.schedule_prefetch()
+                await ctx.send(f"Enqueued {track}")
 
     @commands.command(aliases=["q"])
     @commands.cooldown(1, 5, commands.BucketType.user)
@@ -405,19 +972,25 @@ class Music(commands.Cog):
             raise BadArgs("Empty queue.")
 
         items_per_page = 10
-        pages = math.ceil(len(self.voice_state.songs) / items_per_page)
+        songs = self.voice_state.songs
+        total = len(songs)
+        pages = math.ceil(total / items_per_page)
+        colour = random.randint(0, 0xFFFFFF)
 
-        start = (page - 1) * items_per_page
-        end = start + items_per_page
+        def render_page(i: int) -> discord.Embed:
+            start = i * items_per_page
+            end = start + items_per_page
 
-        queue = ""
+            queue = ""
 
-        for i, song in enumerate(self.voice_state.songs[start:end], start=start):
-            queue += f"`{i + 1}.` [**{song.source.title}**]({song.source.url})\n"
+            for j, song in enumerate(songs[start:end], start=start):
+                queue += f"`{j + 1}.` [**{song.track.title}**]({song.track.url}) {song.requester.mention}\n"
 
-        embed = discord.Embed(description=f"**{len(self.voice_state.songs)} tracks:**\n\n{queue}", colour=random.randint(0, 0xFFFFFF))
-        embed.set_footer(text=f"Viewing page {page}/{pages}")
-        await ctx.send(embed=embed)
+            embed = discord.Embed(description=f"**{total} tracks:**\n\n{queue}", colour=colour)
+            embed.set_footer(text=f"Viewing page {i + 1}/{pages}")
+            return embed
+
+        await Paginator(self.bot, pages, render_page).send(ctx, start=page - 1)
 
     @commands.command(aliases=["r"])
     @commands.cooldown(1, 5, commands.BucketType.user)
@@ -435,7 +1008,11 @@ class Music(commands.Cog):
         if not self.voice_state.songs:
             raise BadArgs("Empty queue.")
 
+        if not 1 <= index <= len(self.voice_state.songs):
+            raise BadArgs("Invalid index.")
+
         self.voice_state.songs.remove(index - 1)
+        self.voice_state.schedule_prefetch()
         await ctx.message.add_reaction("✅")
 
     @commands.command()
@@ -470,6 +1047,7 @@ class Music(commands.Cog):
             raise BadArgs("Empty queue.")
 
         self.voice_state.songs.shuffle()
+        self.voice_state.schedule_prefetch()
         await ctx.message.add_reaction("✅")
 
     @commands.command(aliases=["s"])
@@ -520,6 +1098,7 @@ class Music(commands.Cog):
         """
 
         self.voice_state.songs.clear()
+        self.voice_state.cancel_prefetch()
 
         if not self.voice_state.is_playing:
             self.voice_state.voice.stop()
@@ -543,7 +1122,7 @@ class Music(commands.Cog):
         if 0 > volume > 200:
             return await ctx.send("Volume must be between 0 and 200")
 
-        self.voice_state.volume = volume / 100
+        await self.voice_state.set_volume(volume / 100)
         await ctx.send(f"Volume of the player set to {volume}%")
 
     @play.before_invoke
@@ -1,19 +1,43 @@
 import asyncio
 import os
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 from os.path import isfile
+from typing import Optional
 
 import discord
+from dateutil.parser import isoparse
 from discord.ext import commands
 from dotenv import load_dotenv
 
+from util.async_piazza_handler import PIAZZA_WORKERS, AsyncPiazzaHandler, get_piazza_executor
 from util.badargs import BadArgs
 from util.create_file import create_file_if_not_exists
 from util.json import read_json, write_json
-from util.piazza_handler import InvalidPostID, PiazzaHandler
+from util.paginator import Paginator
+from util.piazza_handler import PIAZZA_BURST, PIAZZA_RATE, InvalidPostID, PiazzaHandler
+from util.piazza_mirror import PiazzaMirror, html_to_text
+from util.piazza_session import PiazzaSession
+from util.rate_limiter import FairScheduler, TokenBucket
+from util.similarity_index import DuplicateDetector, MinHashLSH
 
 PIAZZA_THUMBNAIL_URL = "https://store-images.s-microsoft.com/image/apps.25584.554ac7a6-231b-46e2-9960-a059f3147dbe.727eba5c-763a-473f-981d-ffba9c91adab.4e76ea6a-bd74-487f-bf57-3612e43ca795.png"
 PIAZZA_FILE = "data/piazza.json"
+PINNED_PER_PAGE = 10
+SEARCH_RESULTS_PER_PAGE = 5
+MIRROR_SYNC_INTERVAL = 120
+
+# Used for live tracking of instructor's notes and pinned posts. Each poll costs a single feed request.
+LIVE_TRACK_INTERVAL = 60
+LIVE_TRACK_FEED_HEAD = 20
+LIVE_TRACK_MAX_AGE = timedelta(days=1)
+LIVE_TRACK_MAX_SEEN = 500
+
+# Used for suggesting Piazza posts similar to questions asked in help channels
+DUPLICATE_THRESHOLD = 0.5
+DUPLICATE_CHANNEL_COOLDOWN = 30
 
 load_dotenv()
 PIAZZA_EMAIL = os.getenv("PIAZZA_EMAIL")
@@ -29,13 +53,21 @@ class Piazza(commands.Cog):
             write_json({}, PIAZZA_FILE)
 
         self.piazza_dict = read_json(PIAZZA_FILE)
+        self.migrate_piazza_file()
+        # Every network is fetched through the same account, so they share its session and its rate limit
+        self.piazza_session = PiazzaSession(PIAZZA_EMAIL, PIAZZA_PASSWORD)
+        self.piazza_scheduler = FairScheduler(TokenBucket(PIAZZA_BURST, PIAZZA_RATE))
+        self.mirrors: dict[str, PiazzaMirror] = {}
+        self.detectors: dict[str, DuplicateDetector] = {}
+        self.last_suggestion: dict[int, float] = {}
+        self._syncing_mirrors = False
+        self._tracking_inotes = False
 
     # # start of Piazza functions # #
-    # didn't want to support multiple PiazzaHandler instances because it's associated with
-    # a single account (unsafe to send sensitive information through Discord, so there's
-    # no way to login to another account without also having access to prod env variables)
-    # and the API is also rate-limited, so it's probably not a good idea to spam Piazza's server
-    # with an unlimited # of POST requests per instance everyday. One instance should be safe
+    # All PiazzaHandler instances are associated with a single account (unsafe to send sensitive
+    # information through Discord, so there's no way to login to another account without also having
+    # access to prod env variables). The API is also rate-limited per account, so every network shares
+    # one rate budget, split fairly between them so one busy network can't starve the others.
     @commands.command()
     @commands.has_permissions(administrator=True)
     async def pinit(self, ctx: commands.Context, name: str, pid: str):
@@ -45,21 +77,28 @@ class Piazza(commands.Cog):
         **Usage:** !pinit <course name> <piazza id>
 
         **Examples:**
-        `!pinit CPSC221 abcdef1234` creates a CPSC221 Piazza instance for the server
+        `!pinit CPSC221 abcdef1234` creates a CPSC221 Piazza instance for the server, tracked in the current channel
+
+        A server can have several Piazza instances (e.g. a course and its lab). Commands use the instance
+        tracked in the channel they're called from, or the server's first instance if there is none.
 
         *Only usable by TAs and Profs
         """
 
-        self.bot.d_handler.piazza_handler = PiazzaHandler(name, pid, PIAZZA_EMAIL, PIAZZA_PASSWORD, ctx.guild)
+        handler = self._get_piazza_handler(ctx.channel, pid)
 
-        # dict.get default to empty list so KeyError is never thrown
-        for channel in self.piazza_dict.get("channels", []):
-            self.bot.d_handler.piazza_handler.add_channel(channel)
-
-        self.piazza_dict["channels"] = [ctx.channel.id]
-        self.piazza_dict["course_name"] = name
-        self.piazza_dict["piazza_id"] = pid
-        self.piazza_dict["guild_id"] = ctx.guild.id
+        if handler:
+            handler.handler.course_name = name
+            handler.handler.guild = ctx.guild
+        else:
+            handler = self._create_piazza_handler(name, pid, ctx.guild)
+            self.bot.d_handler.piazza_handlers.append(handler)
+
+        handler.add_channel(ctx.channel.id)
+        network = self.piazza_dict["networks"].setdefault(pid, {})
+        network["course_name"] = name
+        network["guild_id"] = ctx.guild.id
+        network["channels"] = handler.channels
         write_json(self.piazza_dict, "data/piazza.json")
         response = f"Piazza instance created!\nName: {name}\nPiazza ID: {pid}\n"
         response += "If the above doesn't look right, please use `!pinit` again with the correct arguments"
@@ -67,49 +106,57 @@ class Piazza(commands.Cog):
 
     @commands.command()
     @commands.has_permissions(administrator=True)
-    async def ptrack(self, ctx: commands.Context):
+    async def ptrack(self, ctx: commands.Context, pid: Optional[str] = None):
         """
         `!ptrack` __`Tracks Piazza posts in channel`__
 
-        **Usage:** !ptrack
+        **Usage:** !ptrack [piazza id]
 
         **Examples:**
-        `!ptrack` adds the current channel's id to the Piazza instance's list of channels
+        `!ptrack` adds the current channel's id to the server's Piazza instance's list of channels
+        `!ptrack abcdef1234` adds the current channel's id to the list of channels of the Piazza instance with ID abcdef1234
 
         The channels added through `!ptrack` are where send_pupdate and track_inotes send their responses.
 
         *Only usable by TAs and Profs
         """
 
-        cid = ctx.message.channel.id
+        handler = self._get_piazza_handler(ctx.channel, pid)
 
-        self.bot.d_handler.piazza_handler.add_channel(cid)
-        self.piazza_dict["channels"] = self.bot.d_handler.piazza_handler.channels
+        if not handler:
+            raise BadArgs("Piazza hasn't been instantiated yet!")
+
+        handler.add_channel(ctx.message.channel.id)
+        self.piazza_dict["networks"][handler.piazza_id]["channels"] = handler.channels
         write_json(self.piazza_dict, "data/piazza.json")
-        await ctx.send("Channel added to tracking!")
+        await ctx.send(f"Channel added to tracking for {handler.course_name}!")
 
     @commands.command()
     @commands.has_permissions(administrator=True)
-    async def puntrack(self, ctx: commands.Context):
+    async def puntrack(self, ctx: commands.Context, pid: Optional[str] = None):
         """
         `!puntrack` __`Untracks Piazza posts in channel`__
 
-        **Usage:** !puntrack
+        **Usage:** !puntrack [piazza id]
 
         **Examples:**
-        `!puntrack` removes the current channel's id to the Piazza instance's list of channels
+        `!puntrack` removes the current channel's id from the list of channels of the Piazza instance tracked in it
+        `!puntrack abcdef1234` removes the current channel's id from the list of channels of the Piazza instance with ID abcdef1234
 
         The channels removed through `!puntrack` are where send_pupdate and track_inotes send their responses.
 
         *Only usable by TAs and Profs
         """
 
-        cid = ctx.message.channel.id
+        handler = self._get_piazza_handler(ctx.channel, pid)
 
-        self.bot.d_handler.piazza_handler.remove_channel(cid)
-        self.piazza_dict["channels"] = self.bot.d_handler.piazza_handler.channels
+        if not handler:
+            raise BadArgs("Piazza hasn't been instantiated yet!")
+
+        handler.remove_channel(ctx.message.channel.id)
+        self.piazza_dict["networks"][handler.piazza_id]["channels"] = handler.channels
         write_json(self.piazza_dict, "data/piazza.json")
-        await ctx.send("Channel removed from tracking!")
+        await ctx.send(f"Channel removed from tracking for {handler.course_name}!")
 
     @commands.command()
     @commands.cooldown(1, 5, commands.BucketType.channel)
@@ -125,16 +172,21 @@ class Piazza(commands.Cog):
         *to prevent hitting the rate-limit, only usable once every 5 secs channel-wide*
         """
 
-        if self.bot.d_handler.piazza_handler:
-            posts = self.bot.d_handler.piazza_handler.get_pinned()
-            embed = discord.Embed(title=f"**Pinned posts for {self.bot.d_handler.piazza_handler.course_name}:**", colour=0x497aaa)
+        handler = self._get_piazza_handler(ctx.channel)
+
+        if handler:
+            posts = await handler.get_pinned()
 
-            for post in posts:
-                embed.add_field(name=f"@{post['num']}", value=f"[{post['subject']}]({post['url']})", inline=False)
+            def render_page(page_posts: list[dict], i: int, page_count: int) -> discord.Embed:
+                embed = discord.Embed(title=f"**Pinned posts for {handler.course_name}:**", colour=0x497aaa)
 
-            embed.set_footer(text=f"Requested by {ctx.author.display_name}", icon_url=str(ctx.author.avatar_url))
+                for post in page_posts:
+                    embed.add_field(name=f"@{post['num']}", value=f"[{post['subject']}]({post['url']})", inline=False)
 
-            await ctx.send(embed=embed)
+                embed.set_footer(text=f"Requested by {ctx.author.display_name} • Page {i + 1}/{page_count}", icon_url=str(ctx.author.avatar_url))
+                return embed
+
+            await Paginator.from_items(self.bot, posts, PINNED_PER_PAGE, render_page).send(ctx)
         else:
             raise BadArgs("Piazza hasn't been instantiated yet!")
 
@@ -151,11 +203,13 @@ class Piazza(commands.Cog):
         info (question, answer, answer type, tags)
         """
 
-        if not self.bot.d_handler.piazza_handler:
+        handler = self._get_piazza_handler(ctx.channel)
+
+        if not handler:
             raise BadArgs("Piazza hasn't been instantiated yet!")
 
         try:
-            post = self.bot.d_handler.piazza_handler.get_post(post_id)
+            post = await handler.get_post(post_id)
         except InvalidPostID:
             raise BadArgs("Post not found.")
 
@@ -163,6 +217,46 @@ class Piazza(commands.Cog):
             post_embed = self.create_post_embed(post)
             await ctx.send(embed=post_embed)
 
+    @commands.command()
+    @commands.cooldown(1, 5, commands.BucketType.user)
+    async def psearch(self, ctx: commands.Context, *, terms: str):
+        """
+        `!psearch` __`search terms`__
+
+        **Usage:** !psearch <search terms>
+
+        **Examples:**
+        `!psearch segfault destructor` returns the Piazza posts that best match "segfault destructor"
+
+        Searches a local copy of the Piazza, so posts from the last few minutes may not show up yet.
+        """
+
+        handler = self._get_piazza_handler(ctx.channel)
+
+        if not handler:
+            raise BadArgs("Piazza hasn't been instantiated yet!")
+
+        mirror = self._get_mirror(handler)
+
+        start = time.perf_counter()
+        results = mirror.search(terms)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        if not results:
+            raise BadArgs("No matching posts found." if len(mirror) else "The Piazza mirror is still being built, try again later.")
+
+        def render_page(page_results: list[dict], i: int, page_count: int) -> discord.Embed:
+            embed = discord.Embed(title=f"**Search results for \"{terms[:200]}\":**", colour=0x497aaa)
+
+            for result in page_results:
+                embed.add_field(name=f"@{result['num']}: {result['subject'][:200]}", value=f"{result['snippet'][:900]}\n[Open post]({handler.piazza_url}?cid={result['num']})", inline=False)
+
+            embed.set_thumbnail(url=PIAZZA_THUMBNAIL_URL)
+            embed.set_footer(text=f"{len(results)} results in {elapsed_ms:.1f} ms • Page {i + 1}/{page_count}")
+            return embed
+
+        await Paginator.from_items(self.bot, results, SEARCH_RESULTS_PER_PAGE, render_page).send(ctx)
+
     @commands.command(hidden=True)
     @commands.has_permissions(administrator=True)
     async def ptest(self, ctx: commands.Context):
@@ -172,11 +266,54 @@ class Piazza(commands.Cog):
         **Usage:** !ptest
 
         **Examples:**
-        `!ptest` simulates a single call of `send_pupdate` to ensure the set-up was done correctly.
+        `!ptest` simulates a single call of `send_pupdate` for every Piazza instance to ensure the set-up was done correctly.
         """
 
         await self.send_piazza_posts()
 
+    @commands.command(hidden=True)
+    @commands.is_owner()
+    async def pstats(self, ctx: commands.Context):
+        """
+        `!pstats`
+
+        **Usage:** !pstats
+
+        **Examples:**
+        `!pstats` shows each Piazza instance's request throughput, time spent waiting on the rate limit and post cache usage
+        """
+
+        if not self.bot.d_handler.piazza_handlers:
+            raise BadArgs("Piazza hasn't been instantiated yet!")
+
+        bucket = self.piazza_scheduler.bucket
+        response = f"Shared rate budget: {bucket.acquired} requests, {bucket.time_blocked:.1f}s rate limited, {self.piazza_session.logins} logins\n"
+
+        for handler in self.bot.d_handler.piazza_handlers:
+            response += f"\n{self._format_stats(handler)}\n"
+
+        await ctx.send(response)
+
+    def _format_stats(self, handler: AsyncPiazzaHandler) -> str:
+        stats = handler.stats()
+        response = f"**{handler.course_name}** ({handler.piazza_id})\n"
+        response += f"Calls: {stats['calls']}\n"
+        response += f"Requests: {stats['requests']} ({stats['requests_per_min']:.2f}/min)\n"
+        response += f"Time rate limited: {stats['time_rate_limited']:.1f}s\n"
+        response += f"Time queued for a worker: {stats['time_queued']:.1f}s\n"
+        response += f"Time running: {stats['time_running']:.1f}s\n"
+        response += f"Post cache: {stats['post_cache_entries']}/{stats['post_cache_maxsize']} posts, "
+        response += f"{stats['post_cache_hit_rate']:.1%} hit rate, {stats['post_cache_invalidations']} invalidated"
+
+        detector = self.detectors.get(handler.piazza_id)
+
+        if detector:
+            d_stats = detector.stats()
+            response += f"\nDuplicate detection: {d_stats['indexed']} posts indexed, {d_stats['checked']} messages checked "
+            response += f"({d_stats['matched']} matched, {d_stats['skipped']} skipped), {d_stats['avg_ms']:.2f} ms avg, {d_stats['max_ms']:.2f} ms max"
+
+        return response
+
     def create_post_embed(self, post: dict) -> discord.Embed:
         if post:
             post_embed = discord.Embed(title=post["subject"], url=post["url"], description=post["num"])
@@ -194,6 +331,187 @@ class Piazza(commands.Cog):
             post_embed.set_footer(text=f"tags: {post['tags']}")
             return post_embed
 
+    @commands.command(hidden=True)
+    @commands.has_permissions(administrator=True)
+    async def phelpwatch(self, ctx: commands.Context):
+        """
+        `!phelpwatch`
+
+        **Usage:** !phelpwatch
+
+        **Examples:**
+        `!phelpwatch` toggles whether questions asked in the current channel are checked against Piazza posts,
+        replying with any post that looks like the same question
+
+        *Only usable by TAs and Profs
+        """
+
+        help_channels = self.piazza_dict.setdefault("help_channels", [])
+
+        if ctx.channel.id in help_channels:
+            help_channels.remove(ctx.channel.id)
+            await ctx.send("Stopped suggesting Piazza posts in this channel.")
+        else:
+            help_channels.append(ctx.channel.id)
+            await ctx.send("Now suggesting Piazza posts for questions asked in this channel.")
+
+        write_json(self.piazza_dict, "data/piazza.json")
+
+    @commands.Cog.listener()
+    async def on_message(self, message: discord.Message) -> None:
+        """
+        Replies to questions asked in help channels with Piazza posts that look like the same question.
+        """
+
+        if message.author.bot or message.channel.id not in self.piazza_dict.get("help_channels", []) or "?" not in message.content:
+            return
+
+        handler = self._get_piazza_handler(message.channel)
+
+        if not handler or message.content.startswith(self.bot.command_prefix) or handler.piazza_id not in self.detectors:
+            return
+
+        if time.monotonic() - self.last_suggestion.get(message.channel.id, 0) < DUPLICATE_CHANNEL_COOLDOWN:
+            return
+
+        matches = self.detectors[handler.piazza_id].check(message.content)
+
+        if matches:
+            self.last_suggestion[message.channel.id] = time.monotonic()
+            response = "This might already be answered on Piazza:\n"
+
+            for nr, similarity in matches:
+                response += f"@{nr} ({similarity:.0%} similar): <{handler.piazza_url}?cid={nr}>\n"
+
+            await message.reply(response, mention_author=False)
+
+    def _get_mirror(self, handler: AsyncPiazzaHandler) -> PiazzaMirror:
+        if handler.piazza_id not in self.mirrors:
+            self.mirrors[handler.piazza_id] = PiazzaMirror(handler.piazza_id)
+
+        return self.mirrors[handler.piazza_id]
+
+    async def _build_detector(self, handler: AsyncPiazzaHandler) -> DuplicateDetector:
+        """
+        Indexes every mirrored post of handler's Piazza, building the index off the event loop.
+        """
+
+        posts = list(self._get_mirror(handler).iter_posts())
+
+        def build() -> MinHashLSH:
+            index = MinHashLSH(DUPLICATE_THRESHOLD)
+
+            for nr, subject, body in posts:
+                # Mirrored subjects and bodies are already plain text
+                index.add(nr, f"{subject} {body}")
+
+            return index
+
+        return DuplicateDetector(await self.bot.loop.run_in_executor(None, build))
+
+    def _index_post(self, handler: AsyncPiazzaHandler, nr: int, post: Optional[dict]) -> None:
+        detector = self.detectors.get(handler.piazza_id)
+
+        if not detector:
+            return
+
+        if post is None:
+            detector.index.remove(nr)
+        else:
+            # Indexed as the same plain text that the mirror stores, so it gets the same shingles as in _build_detector
+            detector.index.add(nr, f"{html_to_text(handler.get_subject(post))} {html_to_text(handler.get_body(post))}")
+
+    async def mirror_sync(self) -> None:
+        """
+        Every x interval, we bring the local copy of the Piazza used by `!psearch` up to date. Each sync
+        fetches a few posts at most, so building the copy of a large Piazza is spread over several hours.
+        Posts are also added to the similarity index used to suggest posts in help channels.
+        """
+
+        # on_ready fires again after a reconnect, and one loop is enough
+        if self._syncing_mirrors:
+            return
+
+        self._syncing_mirrors = True
+        await self.bot.wait_until_ready()
+
+        while True:
+            await asyncio.gather(*(self._sync_mirror(handler) for handler in self.bot.d_handler.piazza_handlers))
+            await asyncio.sleep(MIRROR_SYNC_INTERVAL)
+
+    async def _sync_mirror(self, handler: AsyncPiazzaHandler) -> None:
+        try:
+            if handler.piazza_id not in self.detectors:
+                self.detectors[handler.piazza_id] = await self._build_detector(handler)
+
+            await self._get_mirror(handler).sync(handler, on_update=lambda nr, post: self._index_post(handler, nr, post))
+        except Exception:
+            print(traceback.format_exc(), flush=True)
+
+    async def track_inotes(self) -> None:
+        """
+        Every x interval, we check the head of the Piazza feed and send new instructor's notes and newly pinned
+        posts to the channels added through `!ptrack`. The post numbers already seen are stored in the Piazza
+        file so nothing is sent twice across restarts, and the first poll after `!pinit` only records them.
+        """
+
+        # on_ready fires again after a reconnect, and one loop is enough
+        if self._tracking_inotes:
+            return
+
+        self._tracking_inotes = True
+        await self.bot.wait_until_ready()
+
+        while True:
+            await asyncio.gather(*(self._track_network(handler) for handler in self.bot.d_handler.piazza_handlers))
+            await asyncio.sleep(LIVE_TRACK_INTERVAL)
+
+    async def _track_network(self, handler: AsyncPiazzaHandler) -> None:
+        try:
+            await self._send_live_updates(handler)
+        except Exception:
+            print(traceback.format_exc(), flush=True)
+
+    async def _send_live_updates(self, handler: AsyncPiazzaHandler) -> None:
+        posts = await handler.get_feed_head(LIVE_TRACK_FEED_HEAD)
+        network = self.piazza_dict["networks"][handler.piazza_id]
+        seen = network.get("live_seen")
+
+        if not seen or seen.get("piazza_id") != handler.piazza_id:
+            seen = {"piazza_id": handler.piazza_id, "notes": [], "pins": [post["num"] for post in posts if post["pinned"]]}
+            seeding = True
+        else:
+            seen = {**seen, "notes": list(seen["notes"])}
+            seeding = False
+
+        notes, pins = set(seen["notes"]), set(seen["pins"])
+        cutoff = datetime.now(timezone.utc) - LIVE_TRACK_MAX_AGE
+        response = ""
+
+        for post in posts:
+            if post["instructor_note"] and post["num"] not in notes:
+                seen["notes"].append(post["num"])
+
+                if not seeding and isoparse(post["created"]) >= cutoff:
+                    response += f"**New instructor's note** @{post['num']}: {post['subject']} <{post['url']}>\n"
+            elif post["pinned"] and post["num"] not in pins and not seeding:
+                response += f"**Newly pinned** @{post['num']}: {post['subject']} <{post['url']}>\n"
+
+        # Pinned posts always sit at the head of the feed, so unpinned posts are the ones missing from it
+        seen["pins"] = [post["num"] for post in posts if post["pinned"]]
+        seen["notes"] = seen["notes"][-LIVE_TRACK_MAX_SEEN:]
+
+        if seen != network.get("live_seen"):
+            network["live_seen"] = seen
+            write_json(self.piazza_dict, "data/piazza.json")
+
+        if response:
+            for ch in handler.channels:
+                channel = self.bot.get_channel(ch)
+
+                if channel:
+                    await channel.send(f"**{handler.course_name}** Piazza update:\n{response}")
+
     async def send_at_time(self) -> None:
         # default set to midnight UTC (4/5 PM PT)
         now = datetime.now(timezone.utc)
@@ -210,13 +528,19 @@ class Piazza(commands.Cog):
             await self.send_piazza_posts()
 
     async def send_piazza_posts(self) -> None:
-        if not self.bot.d_handler.piazza_handler:
-            return
+        await asyncio.gather(*(self._send_digest(handler) for handler in self.bot.d_handler.piazza_handlers))
+
+    async def _send_digest(self, handler: AsyncPiazzaHandler) -> None:
+        try:
+            await self._send_posts(handler)
+        except Exception:
+            print(traceback.format_exc(), flush=True)
 
-        posts = await self.bot.d_handler.piazza_handler.get_posts_in_range()
+    async def _send_posts(self, handler: AsyncPiazzaHandler) -> None:
+        posts = await handler.get_posts_in_range()
 
         if posts:
-            response = f"**{self.bot.d_handler.piazza_handler.course_name}'s posts for {datetime.today().strftime('%a. %B %d, %Y')}**\n"
+            response = f"**{handler.course_name}'s posts for {datetime.today().strftime('%a. %B %d, %Y')}**\n"
 
             response += "Instructor's Notes:\n"
 
@@ -234,19 +558,76 @@ class Piazza(commands.Cog):
             for post in posts[1]:
                 response += f"@{post['num']}: {post['subject']} <{post['url']}>\n"
 
-            for ch in self.bot.d_handler.piazza_handler.channels:
+            for ch in handler.channels:
                 channel = self.bot.get_channel(ch)
-                await channel.send(response)
+
+                if channel:
+                    await channel.send(response)
+
+    def _create_piazza_handler(self, name: str, pid: str, guild: Optional[discord.Guild]) -> AsyncPiazzaHandler:
+        # Each network gets its own worker threads, so a network stuck waiting on the rate limit doesn't hold up the others
+        executor = ThreadPoolExecutor(max_workers=PIAZZA_WORKERS, thread_name_prefix=f"piazza-{pid}")
+        return AsyncPiazzaHandler(PiazzaHandler(name, pid, self.piazza_session, guild, limiter=self.piazza_scheduler.share(pid)), executor)
+
+    def _get_piazza_handler(self, channel: discord.abc.GuildChannel, pid: Optional[str] = None) -> Optional[AsyncPiazzaHandler]:
+        """
+        Returns the handler of the Piazza network with ID `pid` if given, otherwise the one tracked in `channel`,
+        falling back to the first one of `channel`'s guild
+        """
+
+        handlers = self.bot.d_handler.piazza_handlers
+
+        if pid:
+            return next((handler for handler in handlers if handler.piazza_id == pid), None)
+
+        return next((handler for handler in handlers if channel.id in handler.channels), None) or \
+            next((handler for handler in handlers if handler.guild and handler.guild.id == channel.guild.id), None)
+
+    def migrate_piazza_file(self) -> None:
+        """
+        Moves the single Piazza network stored at the top level of the Piazza file (before multiple networks
+        were supported) into the "networks" entry.
+        """
+
+        networks = self.piazza_dict.setdefault("networks", {})
+
+        if "piazza_id" in self.piazza_dict:
+            networks[self.piazza_dict.pop("piazza_id")] = {
+                "course_name": self.piazza_dict.pop("course_name", None),
+                "guild_id": self.piazza_dict.pop("guild_id", None),
+                "channels": self.piazza_dict.pop("channels", []),
+                "live_seen": self.piazza_dict.pop("live_seen", None)
+            }
+
+            write_json(self.piazza_dict, PIAZZA_FILE)
 
     def piazza_start(self) -> None:
-        if all(field in self.piazza_dict for field in ("course_name", "piazza_id", "guild_id")):
-            self.bot.d_handler.piazza_handler = PiazzaHandler(self.piazza_dict["course_name"], self.piazza_dict["piazza_id"], PIAZZA_EMAIL, PIAZZA_PASSWORD, self.piazza_dict["guild_id"])
-
-        # dict.get will default to an empty tuple so a key error is never raised
-        # We need to have the empty tuple because if the default value is None, an error is raised (NoneType object
-        # is not iterable).
-        for ch in self.piazza_dict.get("channels", tuple()):
-            self.bot.d_handler.piazza_handler.add_channel(int(ch))
+        # on_ready fires again after a reconnect, when the handlers already exist
+        started = {handler.piazza_id for handler in self.bot.d_handler.piazza_handlers}
+
+        for pid, network in self.piazza_dict["networks"].items():
+            if pid in started:
+                continue
+
+            handler = self._create_piazza_handler(network["course_name"], pid, self.bot.get_guild(network["guild_id"]))
+
+            for ch in network.get("channels", []):
+                handler.add_channel(int(ch))
+
+            self.bot.d_handler.piazza_handlers.append(handler)
+
+        if len(self.bot.d_handler.piazza_handlers) > len(started):
+            # Creating the handlers doesn't touch the network, so restore or log in to the session in the background
+            self.bot.loop.create_task(self.piazza_login())
+
+    async def piazza_login(self) -> None:
+        start = time.monotonic()
+
+        try:
+            await self.bot.loop.run_in_executor(get_piazza_executor(), self.piazza_session.ensure_authenticated)
+            print(f"Piazza session ready in {time.monotonic() - start:.2f}s", flush=True)
+        except Exception:
+            print(traceback.format_exc(), flush=True)
 
 
 def setup(bot: commands.Bot) -> None:
@@ -2,6 +2,7 @@ import argparse
 import asyncio
 import os
 import random
+import time
 import traceback
 from io import BytesIO
 from os.path import isfile, join
@@ -16,6 +17,9 @@ CANVAS_COLOR = 0xe13f2b
 CANVAS_THUMBNAIL_URL = "https://lh3.googleusercontent.com/2_M-EEPXb2xTMQSTZpSUefHR3TjgOCsawM3pjVG47jI-BrHoXGhKBpdEHeLElT95060B=s180"
 POLL_FILE = "data/poll.json"
 GUILD_ID = 974449980947464214
+# Startup time is measured from here to the first on_ready, so it includes loading the cogs and logging in
+# to Discord but not the Piazza login, which runs in the background
+START_TIME = time.monotonic()
 
 load_dotenv()
 CS221BOT_KEY = os.getenv("CS221BOT_KEY")
@@ -61,12 +65,17 @@ def startup() -> None:
 @bot.event
 async def on_ready() -> None:
     startup()
-    print("Logged in successfully")
+    print(f"Logged in successfully in {time.monotonic() - START_TIME:.2f}s")
     bot.loop.create_task(status_task())
     bot.loop.create_task(bot.get_cog("Piazza").send_pupdate())
+    bot.loop.create_task(bot.get_cog("Piazza").mirror_sync())
+    bot.loop.create_task(bot.get_cog("Piazza").track_inotes())
     bot.loop.create_task(bot.get_cog("Canvas").stream_tracking())
     bot.loop.create_task(bot.get_cog("Canvas").assignment_reminder())
     bot.loop.create_task(bot.get_cog("Canvas").update_modules())
+    bot.loop.create_task(bot.get_cog("Canvas").discussion_tracking())
+    bot.loop.create_task(bot.get_cog("Canvas").roster_sync())
+    bot.loop.create_task(bot.get_cog("Music").evict_voice_states())
 
 
 @bot.event
@@ -88,22 +97,6 @@ async def on_message(message: discord.Message) -> None:
         await bot.process_commands(message)
 
 
-if __name__ == "__main__":
-    # True if the bot should send notifications about new *unpublished* modules on Canvas; False otherwise.
-    # This only matters if the host of the bot has access to unpublished modules. If the host does
-    # not have access, then the bot won't know about any unpublished modules and won't send any info
-    # about them anyway.
-    bot.notify_unpublished = args.notify_unpublished
-    bot.guild_id = GUILD_ID
-
-    if bot.notify_unpublished:
-        print("Warning: bot will send notifications about unpublished modules (if you have access).")
-
-    for extension in filter(lambda f: isfile(join("cogs", f)) and f != "__init__.py", os.listdir("cogs")):
-        bot.load_extension(f"cogs.{extension[:-3]}")
-        print(f"{extension} module loaded")
-
-
 @bot.event
 async def on_command_error(ctx: commands.Context, error: commands.CommandError):
     if isinstance(error, commands.CommandNotFound) or isinstance(error, discord.HTTPException):
@@ -121,4 +114,19 @@ async def on_command_error(ctx: commands.Context, error: commands.CommandError):
         await ctx.send(file=discord.File(BytesIO(bytes("".join(traceback.format_exception(etype, error, trace)), "utf-8")), filename="error.txt"))
 
 
-bot.run(CS221BOT_KEY)
+if __name__ == "__main__":
+    # True if the bot should send notifications about new *unpublished* modules on Canvas; False otherwise.
+    # This only matters if the host of the bot has access to unpublished modules. If the host does
+    # not have access, then the bot won't know about any unpublished modules and won't send any info
+    # about them anyway.
+    bot.notify_unpublished = args.notify_unpublished
+    bot.guild_id = GUILD_ID
+
+    if bot.notify_unpublished:
+        print("Warning: bot will send notifications about unpublished modules (if you have access).")
+
+    for extension in filter(lambda f: isfile(join("cogs", f)) and f != "__init__.py", os.listdir("cogs")):
+        bot.load_extension(f"cogs.{extension[:-3]}")
+        print(f"{extension} module loaded")
+
+    bot.run(CS221BOT_KEY)
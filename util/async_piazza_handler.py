@@ -0,0 +1,124 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional
+
+from util.piazza_handler import PiazzaHandler
+
+# Piazza requests are throttled by the handler's rate limiter anyway, so a couple of threads is enough
+# to overlap a slow request with a cache hit without letting blocked calls pile up threads.
+PIAZZA_WORKERS = 2
+
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def get_piazza_executor() -> ThreadPoolExecutor:
+    """
+    Returns the thread pool shared by all `AsyncPiazzaHandler` instances, creating it on first use.
+    """
+
+    global _executor
+
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=PIAZZA_WORKERS, thread_name_prefix="piazza")
+
+    return _executor
+
+
+class AsyncPiazzaHandler:
+    """
+    Async facade for `PiazzaHandler`. The handler's blocking methods are run in a bounded thread pool so
+    that requests to Piazza (and waiting on its rate limiter) never block the event loop.
+
+    Attributes that aren't overridden here (`course_name`, `channels`, `add_channel`, ...) are read from
+    the wrapped handler.
+
+    Attributes
+    ----------
+    handler : `PiazzaHandler`
+        Wrapped handler
+
+    calls : `int`
+        Number of handler calls run through this facade
+
+    time_queued : `float`
+        Total time in seconds calls have waited for a free worker thread
+
+    time_running : `float`
+        Total time in seconds calls have spent running, including time blocked on the rate limiter
+    """
+
+    def __init__(self, handler: PiazzaHandler, executor: Optional[ThreadPoolExecutor] = None):
+        self.handler = handler
+        self.calls = 0
+        self.time_queued = 0.0
+        self.time_running = 0.0
+        self._executor = executor or get_piazza_executor()
+        self._started = time.monotonic()
+
+    def __getattr__(self, name: str):
+        # Only called for attributes not found on the facade itself
+        if name == "handler":
+            raise AttributeError(name)
+
+        return getattr(self.handler, name)
+
+    async def _run(self, func: Callable, *args):
+        submitted = time.monotonic()
+
+        def timed():
+            started = time.monotonic()
+
+            try:
+                return func(*args)
+            finally:
+                self.time_queued += started - submitted
+                self.time_running += time.monotonic() - started
+
+        self.calls += 1
+        return await asyncio.get_event_loop().run_in_executor(self._executor, timed)
+
+    async def fetch_feed(self, lim: int, offset: int = 0, include_private: bool = False) -> List[dict]:
+        return await self._run(self.handler.fetch_feed, lim, offset, include_private)
+
+    async def fetch_post_instance(self, post_id: int) -> dict:
+        return await self._run(self.handler.fetch_post_instance, post_id)
+
+    async def get_post(self, post_id: int) -> Optional[dict]:
+        return await self._run(self.handler.get_post, post_id)
+
+    async def get_pinned(self) -> List[dict]:
+        return await self._run(self.handler.get_pinned)
+
+    async def get_posts_in_range(self, show_limit: int = 10, days: int = 1, seconds: int = 0) -> List[List[dict]]:
+        return await self._run(self.handler.get_posts_in_range, show_limit, days, seconds)
+
+    async def get_feed_head(self, lim: int = 20) -> List[dict]:
+        return await self._run(self.handler.get_feed_head, lim)
+
+    async def get_recent_notes(self) -> List[dict]:
+        return await self._run(self.handler.get_recent_notes)
+
+    def stats(self) -> dict[str, float]:
+        """
+        Returns request throughput, post cache usage and the time calls have spent blocked on the rate limiter
+        and the thread pool.
+        """
+
+        limiter = self.handler.limiter
+        elapsed_min = max(time.monotonic() - self._started, 1) / 60
+
+        cache = self.handler.post_cache.stats()
+
+        return {
+            "post_cache_entries": cache["entries"],
+            "post_cache_maxsize": cache["maxsize"],
+            "post_cache_hit_rate": cache["hit_rate"],
+            "post_cache_invalidations": cache["invalidations"],
+            "calls": self.calls,
+            "requests": limiter.acquired,
+            "requests_per_min": limiter.acquired / elapsed_min,
+            "time_rate_limited": limiter.time_blocked,
+            "time_queued": self.time_queued,
+            "time_running": self.time_running
+        }
@@ -0,0 +1,183 @@
+import asyncio
+import hashlib
+import os
+import time
+from typing import Optional
+
+from util.create_file import create_file_if_not_exists
+from util.json import read_json, write_json
+
+AUDIO_CACHE_DIRECTORY = "data/audio_cache"
+AUDIO_CACHE_SIZE = 2 * 2 ** 30
+
+# Tracks are transcoded once they've been played TRANSCODE_AFTER_PLAYS times. Play counts are kept for the
+# PLAY_COUNT_SIZE most recently played tracks.
+TRANSCODE_AFTER_PLAYS = 3
+PLAY_COUNT_SIZE = 5000
+
+
+class AudioCache:
+    """
+    LRU disk cache of tracks transcoded to Ogg Opus files, so that frequently played tracks start instantly
+    and play without streaming from the network. Tracks are transcoded in the background by FFmpeg once
+    they've been played often enough, and the least recently played files are deleted when the cache grows
+    past its size limit.
+
+    Attributes
+    ----------
+    directory : `str`
+        Directory holding the cached files and their index
+
+    max_bytes : `int`
+        Size limit of the cached files
+
+    transcode_after : `int`
+        Number of plays after which a track is cached
+
+    hits : `int`
+        Number of plays served from the cache
+
+    transcodes : `int`
+        Number of tracks transcoded into the cache
+
+    evictions : `int`
+        Number of files deleted to stay under the size limit
+    """
+
+    def __init__(self, directory: str = AUDIO_CACHE_DIRECTORY, max_bytes: int = AUDIO_CACHE_SIZE, transcode_after: int = TRANSCODE_AFTER_PLAYS):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.transcode_after = transcode_after
+        self.hits = 0
+        self.transcodes = 0
+        self.evictions = 0
+        self._index_file = f"{directory}/index.json"
+        self._index: Optional[dict[str, dict]] = None
+        self._transcoding: set[str] = set()
+        # One transcode at a time, so caching never competes much with playback for CPU and bandwidth
+        self._lock = asyncio.Lock()
+
+    @property
+    def size(self) -> int:
+        return sum(entry.get("size", 0) for entry in self._load().values())
+
+    def _load(self) -> dict[str, dict]:
+        if self._index is None:
+            self._index = read_json(self._index_file) if os.path.isfile(self._index_file) else {}
+
+        return self._index
+
+    def _save(self) -> None:
+        create_file_if_not_exists(self._index_file)
+        write_json(self._index, self._index_file)
+
+    def _file(self, key: str) -> str:
+        return f"{self.directory}/{hashlib.sha1(key.encode()).hexdigest()}.opus"
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Returns the path of the cached file for `key`, or None if it isn't cached
+        """
+
+        entry = self._load().get(key)
+
+        if entry and entry.get("size") and os.path.isfile(entry["file"]):
+            self.hits += 1
+            return entry["file"]
+
+        return None
+
+    def record_play(self, key: str) -> bool:
+        """
+        Counts a play of `key`, and returns whether it should now be transcoded into the cache
+        """
+
+        index = self._load()
+        entry = index.pop(key, {"plays": 0})
+        entry["plays"] += 1
+        entry["last_played"] = time.time()
+        # Kept in order of last play, so the least recently played entries come first
+        index[key] = entry
+
+        uncached = [k for k, e in index.items() if not e.get("size")]
+
+        for k in uncached[:max(len(uncached) - PLAY_COUNT_SIZE, 0)]:
+            del index[k]
+
+        self._save()
+        return not entry.get("size") and entry["plays"] >= self.transcode_after and key not in self._transcoding
+
+    async def transcode(self, key: str, source: str, executable: str = "ffmpeg", before_options: tuple[str, ...] = ()) -> None:
+        """
+        Transcodes `source` (a file or stream URL) to an Opus file cached under `key`, then evicts the least
+        recently played files until the cache is back under its size limit
+        """
+
+        self._transcoding.add(key)
+
+        try:
+            async with self._lock:
+                path = self._file(key)
+                partial = f"{path}.part"
+                create_file_if_not_exists(partial)
+                process = await asyncio.create_subprocess_exec(executable, "-y", *before_options, "-i", source, "-vn", "-map_metadata", "-1", "-c:a", "libopus",
+                                                               "-b:a", "128k", "-f", "opus", "-loglevel", "error", partial,
+                                                               stdin=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE)
+
+                try:
+                    _, stderr = await process.communicate()
+
+                    if process.returncode:
+                        raise RuntimeError(f"FFmpeg couldn't transcode {key}: {stderr.decode(errors='replace').strip()}")
+
+                    os.replace(partial, path)
+                except BaseException:
+                    if process.returncode is None:
+                        process.kill()
+
+                    # Partial files aren't in the index, so nothing else would ever delete them
+                    if os.path.exists(partial):
+                        os.remove(partial)
+
+                    raise
+                entry = self._load().setdefault(key, {"plays": 0, "last_played": time.time()})
+                entry.update({"file": path, "size": os.path.getsize(path)})
+                self.transcodes += 1
+                self._evict()
+                self._save()
+        finally:
+            self._transcoding.discard(key)
+
+    def _evict(self) -> None:
+        index = self._load()
+        size = self.size
+
+        for key in [k for k, e in index.items() if e.get("size")]:
+            if size <= self.max_bytes:
+                break
+
+            entry = index[key]
+            size -= entry["size"]
+
+            try:
+                os.remove(entry["file"])
+            except FileNotFoundError:
+                pass
+
+            # Keep the play count, so an evicted track that becomes popular again is cached again
+            del entry["file"], entry["size"]
+            self.evictions += 1
+
+    def stats(self) -> dict[str, float]:
+        """
+        Returns the number and total size of cached files, and the cache's counters.
+        """
+
+        return {
+            "files": sum(1 for entry in self._load().values() if entry.get("size")),
+            "size": self.size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "transcodes": self.transcodes,
+            "evictions": self.evictions
+        }
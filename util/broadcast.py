@@ -0,0 +1,163 @@
+import threading
+import time
+from collections import deque
+from typing import Callable, Optional
+
+import discord
+
+# Frames (of FRAME_LENGTH seconds) buffered for each subscriber. A subscriber that falls further behind, e.g.
+# because it's paused, skips its oldest frames so it stays live.
+FRAME_LENGTH = 0.02
+BROADCAST_BUFFER = 50
+
+
+class Broadcast:
+    """
+    Reads a single Opus audio source on its own thread and fans its frames out to any number of subscribers,
+    so voice clients playing the same stream share one FFmpeg process instead of decoding and encoding it
+    once each.
+
+    The source is read from when the first subscriber attaches. Subscribers can attach and detach at any
+    time, starting from the live frame when they attach. When the last one detaches, the source is cleaned
+    up, the broadcast is closed and `on_close` is called with it; later subscribers need a new broadcast.
+
+    Attributes
+    ----------
+    source : `discord.AudioSource`
+        Source whose frames are broadcast, which must return Opus. It's read once every FRAME_LENGTH seconds.
+
+    buffer : `int`
+        Frames buffered for each subscriber
+
+    frames : `int`
+        Number of frames read from the source
+
+    closed : `bool`
+        Whether the last subscriber has detached
+    """
+
+    def __init__(self, source: discord.AudioSource, on_close: Optional[Callable[["Broadcast"], None]] = None, buffer: int = BROADCAST_BUFFER):
+        self.source = source
+        self.buffer = buffer
+        self.frames = 0
+        self.closed = False
+        self._on_close = on_close
+        self._subscribers: list[BroadcastSubscriber] = []
+        self._ended = False
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+
+    def __len__(self) -> int:
+        return len(self._subscribers)
+
+    def attach(self, subscriber: "BroadcastSubscriber") -> bool:
+        """
+        Starts sending frames to `subscriber`, and returns whether it was attached (i.e. the broadcast
+        hasn't closed)
+        """
+
+        with self._condition:
+            if self.closed:
+                return False
+
+            self._subscribers.append(subscriber)
+
+            if not self._thread:
+                self._thread = threading.Thread(target=self._run, name=f"broadcast-{id(self):x}", daemon=True)
+                self._thread.start()
+
+        return True
+
+    def _detach(self, subscriber: "BroadcastSubscriber") -> None:
+        with self._condition:
+            if subscriber not in self._subscribers:
+                return
+
+            self._subscribers.remove(subscriber)
+            subscriber.closed = True
+            self._condition.notify_all()
+
+            if self._subscribers:
+                return
+
+            self.closed = True
+
+            if self._on_close:
+                self._on_close(self)
+
+        # Ends the source's stream, which stops the reader thread
+        self.source.cleanup()
+
+    def _run(self) -> None:
+        # The source is read in real time, like discord.py's player does, since FFmpeg sends what it has buffered
+        # of the stream at once when it starts and the subscribers would have to drop most of it
+        start = time.perf_counter()
+
+        while not self.closed:
+            packet = self.source.read()
+
+            with self._condition:
+                if not packet:
+                    self._ended = True
+                    self._condition.notify_all()
+                    return
+
+                self.frames += 1
+
+                for subscriber in self._subscribers:
+                    if len(subscriber.pending) == self.buffer:
+                        subscriber.dropped += 1
+
+                    subscriber.pending.append(packet)
+
+                self._condition.notify_all()
+
+            time.sleep(max(0.0, start + FRAME_LENGTH * self.frames - time.perf_counter()))
+
+
+class BroadcastSubscriber(discord.AudioSource):
+    """
+    One voice client's view of a `Broadcast`, played like any other Opus source once attached to it.
+    Cleaning it up (which discord.py does when it stops playing) detaches it.
+
+    Attributes
+    ----------
+    broadcast : `Broadcast`
+        Broadcast the frames come from
+
+    pending : `deque[bytes]`
+        Frames received but not played yet
+
+    frames : `int`
+        Number of frames played
+
+    dropped : `int`
+        Number of frames skipped because the subscriber fell behind
+
+    closed : `bool`
+        Whether the subscriber has detached
+    """
+
+    def __init__(self, broadcast: Broadcast):
+        self.broadcast = broadcast
+        self.pending: deque[bytes] = deque(maxlen=broadcast.buffer)
+        self.frames = 0
+        self.dropped = 0
+        self.closed = False
+
+    def read(self) -> bytes:
+        with self.broadcast._condition:
+            # Waits as long as the source does, like reading from FFmpeg directly would
+            self.broadcast._condition.wait_for(lambda: self.pending or self.closed or self.broadcast._ended)
+
+            if not self.pending or self.closed:
+                return b""
+
+            self.frames += 1
+            return self.pending.popleft()
+
+    def is_opus(self) -> bool:
+        return True
+
+    def cleanup(self) -> None:
+        self.broadcast._detach(self)
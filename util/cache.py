@@ -0,0 +1,206 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable, Optional
+
+
+class ResultCache:
+    """
+    Short-lived cache for the results of expensive queries, with single-flight de-duplication: while a
+    query is being fetched, identical queries wait for that fetch instead of starting their own.
+
+    Attributes
+    ----------
+    ttl : `float`
+        Seconds a result is served for after it was fetched
+
+    hits : `int`
+        Number of queries served from the cache
+
+    misses : `int`
+        Number of queries that started a fetch
+
+    coalesced : `int`
+        Number of queries that waited for a fetch started by an identical query
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._entries: dict[Hashable, tuple[float, Any]] = {}
+        self._in_flight: dict[Hashable, asyncio.Future] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def get(self, key: Hashable, fetch: Callable[[], Awaitable]) -> Any:
+        """
+        Returns the cached result for `key` if it is fresh. Otherwise, awaits `fetch()` (or the fetch already
+        in flight for `key`) and caches its result. Exceptions are not cached.
+
+        If the query that started a fetch is cancelled, the queries waiting for it aren't: one of them starts
+        the fetch again and the others wait for that one.
+        """
+
+        while True:
+            entry = self._entries.get(key)
+
+            if entry and time.monotonic() < entry[0]:
+                self.hits += 1
+                return entry[1]
+
+            if key not in self._in_flight:
+                break
+
+            in_flight = self._in_flight[key]
+            self.coalesced += 1
+
+            try:
+                return await asyncio.shield(in_flight)
+            except asyncio.CancelledError:
+                # Only the fetch was cancelled, not this query
+                if not in_flight.cancelled():
+                    raise
+
+                self.coalesced -= 1
+
+        self.misses += 1
+        future = asyncio.get_event_loop().create_future()
+        self._in_flight[key] = future
+
+        try:
+            result = await fetch()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as exc:
+            future.set_exception(exc)
+            # Mark the exception as retrieved in case no identical query was waiting for it
+            future.exception()
+            raise
+        else:
+            now = time.monotonic()
+
+            for expired in [k for k, (expires, _) in self._entries.items() if expires <= now]:
+                del self._entries[expired]
+
+            self._entries[key] = (now + self.ttl, result)
+            future.set_result(result)
+            return result
+        finally:
+            del self._in_flight[key]
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def stats(self) -> dict[str, float]:
+        """
+        Returns the cache's hit/miss counters and hit rate.
+        """
+
+        total = self.hits + self.misses + self.coalesced
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": (self.hits + self.coalesced) / total if total else 0.0
+        }
+
+
+class LRUCache:
+    """
+    Thread-safe bounded cache that evicts the least recently used entry when full, and expires entries
+    `ttl` seconds after they were stored.
+
+    Each entry can carry a version stamp (e.g. a modification time) so that it can be invalidated as soon as
+    a newer version is known to exist, without waiting for it to expire.
+
+    Attributes
+    ----------
+    maxsize : `int`
+        Maximum number of entries
+
+    ttl : `float`
+        Seconds an entry is served for after it was stored
+
+    hits : `int`
+        Number of lookups served from the cache
+
+    misses : `int`
+        Number of lookups that found no fresh entry
+
+    invalidations : `int`
+        Number of entries dropped because a newer version was reported
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self._entries: OrderedDict[Hashable, tuple[float, Any, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        Returns the value stored for `key`, or None if there is no fresh entry.
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None or time.monotonic() >= entry[0]:
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, key: Hashable, value: Any, stamp: Any = None) -> None:
+        """
+        Stores `value` for `key` with version `stamp`, evicting the least recently used entry if the cache is full.
+        """
+
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, stamp, value)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate_if_newer(self, key: Hashable, stamp: Any) -> None:
+        """
+        Drops the entry for `key` if `stamp` is newer than the entry's version stamp, or if the entry has none.
+        """
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry and (entry[1] is None or stamp > entry[1]):
+                del self._entries[key]
+                self.invalidations += 1
+
+    def stats(self) -> dict[str, float]:
+        """
+        Returns the cache's size, hit/miss counters and hit rate.
+        """
+
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "hit_rate": self.hits / total if total else 0.0
+        }
@@ -70,3 +70,27 @@ def get_staff_ids(course: Course) -> list[int]:
     staff_ids = list(map(lambda user: user.id, staff))
 
     return staff_ids
+
+
+def get_first_page(course: Course, endpoint: str, **kwargs: dict) -> tuple[list[dict], dict]:
+    """
+    Parameters
+    ----------
+    course : `Course`
+        Course whose endpoint to request
+
+    endpoint : `str`
+        Path of a paginated list under the course, e.g. "enrollments"
+
+    Returns
+    -------
+    `tuple[list[dict], dict]`
+        JSON of the first page of the list, and the pagination links of the response (see `requests.Response.links`)
+    """
+
+    response = course._requester.request(
+        "GET",
+        f"courses/{course.id}/{endpoint}",
+        _kwargs=combine_kwargs(**kwargs)
+    )
+    return response.json(), response.links
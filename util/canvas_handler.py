@@ -1,25 +1,40 @@
+import hashlib
 import os
 import re
 import shutil
 import time
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from typing import Optional
 
 import discord
 from bs4 import BeautifulSoup
+from canvasapi.assignment import Assignment
 from canvasapi.canvas import Canvas
 from canvasapi.course import Course
+from canvasapi.enrollment import Enrollment
+from canvasapi.exceptions import ResourceDoesNotExist
 from canvasapi.module import Module, ModuleItem
-from canvasapi.paginated_list import PaginatedList
 from dateutil.parser import isoparse
 
 from util import create_file
-from util.canvas_api_extension import get_course_stream, get_course_url, get_staff_ids
+from util.canvas_api_extension import get_course_stream, get_course_url, get_first_page, get_staff_ids
+from util.grade_stats import compute_grade_stats
+from util.json import read_json, write_json
 
 # Stores course modules and channels that are live tracking courses
 # Do *not* put a slash at the end of this path
 COURSES_DIRECTORY = "./data/courses"
 
+# Number of topics/entries requested per page when sweeping course discussions
+DISCUSSION_PAGE_SIZE = 100
+
+# A roster whose first page, page count and student count are unchanged is reused, but fetched in full at least
+# every ROSTER_MAX_AGE seconds. Changes past the first page that leave both counts as they are (e.g. one student
+# dropping as another enrolls, or a TA being replaced) can therefore take up to ROSTER_MAX_AGE seconds to show up.
+ROSTER_PAGE_SIZE = 100
+ROSTER_MAX_AGE = 60 * 60 * 24
+ROSTER_ENROLLMENT_TYPES = ["StudentEnrollment", "TaEnrollment", "TeacherEnrollment"]
+
 
 class CanvasHandler(Canvas):
     """
@@ -64,6 +79,10 @@ class CanvasHandler(Canvas):
         self._timings: dict[str, str] = {}
         self._due_week: dict[str, list[int]] = {}
         self._due_day: dict[str, list[int]] = {}
+        self._grade_stats_cache: dict[tuple[int, int], dict] = {}
+        self._assignment_snapshots: dict[int, tuple[float, list]] = {}
+        self._stream_snapshots: dict[int, tuple[float, dict]] = {}
+        self._roster_snapshots: dict[int, tuple[str, float, list]] = {}
 
     @property
     def courses(self) -> list[Course]:
@@ -295,7 +314,23 @@ class CanvasHandler(Canvas):
                 if channel_id not in ids_to_remove:
                     f.write(channel_id)
 
-    def get_course_stream_ch(self, since: Optional[str], course_ids_str: tuple[str, ...], base_url: str, access_token: str) -> list[list[str]]:
+    @staticmethod
+    def _get_snapshot(snapshots: dict[int, tuple[float, object]], course_id: int, max_age: Optional[float], fetch):
+        """
+        Returns the snapshot of a course's data if it is at most `max_age` seconds old. Otherwise, calls `fetch()`
+        and stores its result as the course's new snapshot. If `max_age` is None, the data is always fetched.
+        """
+
+        snapshot = snapshots.get(course_id)
+
+        if max_age is not None and snapshot and time.monotonic() - snapshot[0] <= max_age:
+            return snapshot[1]
+
+        data = fetch()
+        snapshots[course_id] = (time.monotonic(), data)
+        return data
+
+    def get_course_stream_ch(self, since: Optional[str], course_ids_str: tuple[str, ...], base_url: str, access_token: str, max_age: Optional[float] = None) -> list[list[str]]:
         """
         Gets announcements for course(s)
 
@@ -315,6 +350,10 @@ class CanvasHandler(Canvas):
         access_token : `str`
             API key to authenticate requests with
 
+        max_age : `None or float`
+            If given, a course's activity stream fetched at most this many seconds ago (e.g. by the
+            announcement poller) is reused instead of being fetched again
+
         Returns
         -------
         `list[list[str]]`
@@ -322,7 +361,8 @@ class CanvasHandler(Canvas):
         """
 
         course_ids = self._ids_converter(course_ids_str)
-        course_streams = tuple(get_course_stream(c.id, base_url, access_token) for c in self.courses if (not course_ids) or c.id in course_ids)
+        course_streams = tuple(self._get_snapshot(self._stream_snapshots, c.id, max_age, lambda c=c: get_course_stream(c.id, base_url, access_token))
+                               for c in self.courses if (not course_ids) or c.id in course_ids)
         data_list = []
 
         for stream in course_streams:
@@ -368,7 +408,7 @@ class CanvasHandler(Canvas):
 
         return data_list
 
-    def get_assignments(self, due: Optional[str], course_ids_str: tuple[str, ...], base_url: str) -> list[list[str]]:
+    def get_assignments(self, due: Optional[str], course_ids_str: tuple[str, ...], base_url: str, max_age: Optional[float] = None) -> list[list[str]]:
         """
         Gets assignments for course(s)
 
@@ -383,6 +423,10 @@ class CanvasHandler(Canvas):
         base_url : `str`
             Base URL of the Canvas instance's API
 
+        max_age : `None or float`
+            If given, a course's assignments fetched at most this many seconds ago (e.g. by the
+            assignment reminder) are reused instead of being fetched again
+
         Returns
         -------
         `list[list[str]]`
@@ -390,11 +434,12 @@ class CanvasHandler(Canvas):
         """
 
         course_ids = self._ids_converter(course_ids_str)
-        courses_assignments = {c: c.get_assignments() for c in self.courses if not course_ids or c.id in course_ids}
+        courses_assignments = {c: self._get_snapshot(self._assignment_snapshots, c.id, max_age, lambda c=c: list(c.get_assignments(per_page=100)))
+                               for c in self.courses if not course_ids or c.id in course_ids}
 
         return self._get_assignment_data(due, courses_assignments, base_url)
 
-    def _get_assignment_data(self, due: Optional[str], courses_assignments: dict[Course, PaginatedList], base_url: str) -> list[list[str]]:
+    def _get_assignment_data(self, due: Optional[str], courses_assignments: dict[Course, list[Assignment]], base_url: str) -> list[list[str]]:
         """
         Formats all courses assignments as separate assignments
 
@@ -403,7 +448,7 @@ class CanvasHandler(Canvas):
         due : `None or str`
             Date/Time from due date of assignments
 
-        courses_assignments : `dict[Course, PaginatedList of Assignments]`
+        courses_assignments : `dict[Course, list of Assignments]`
             List of courses and their assignments
 
         base_url : `str`
@@ -504,3 +549,298 @@ class CanvasHandler(Canvas):
         """
 
         return [[c.name, get_course_url(c.id, url)] for c in self.courses]
+
+    @staticmethod
+    def load_discussion_state(course_id: int) -> Optional[dict]:
+        """
+        Returns the stored discussion mirroring state for the course with given ID, or None if the
+        course's discussions have never been swept.
+
+        The state maps each topic ID (as a string) to a dict containing the topic's fingerprint,
+        the `since` cursor (creation time of the newest entry already mirrored) and the IDs of the
+        root messages posted for the topic in each live channel.
+        """
+
+        discussions_file = f"{COURSES_DIRECTORY}/{course_id}/discussions.json"
+
+        if not os.path.isfile(discussions_file) or os.stat(discussions_file).st_size == 0:
+            return None
+
+        return read_json(discussions_file)
+
+    @staticmethod
+    def save_discussion_state(course_id: int, state: dict) -> None:
+        """
+        Stores the discussion mirroring state for the course with given ID in
+        `{COURSES_DIRECTORY}/{course_id}/discussions.json`.
+        """
+
+        discussions_file = f"{COURSES_DIRECTORY}/{course_id}/discussions.json"
+        create_file.create_file_if_not_exists(discussions_file)
+        write_json(state, discussions_file)
+
+    def get_discussion_updates(self, course: Course, state: Optional[dict], incl_unpublished: bool) -> tuple[list[dict], dict]:
+        """
+        Gets discussion topics and entries posted in a course since the last sweep.
+
+        Topics are listed in a single paginated request. A topic whose fingerprint (last reply time,
+        entry count and last edit time) matches the stored one is skipped without fetching its entries.
+        Only changed topics have their entries fetched, and only entries and replies newer than the
+        topic's `since` cursor are returned.
+
+        Unpublished topics and topics whose delayed post date hasn't passed are skipped unless
+        `incl_unpublished` is `True`, and are reported as new topics once they are posted.
+
+        If `state` is None, the course has never been swept. In that case the returned state is seeded
+        with every current topic and no updates are returned, so old discussions are not reposted.
+
+        Parameters
+        ----------
+        course : `Course`
+            Course to sweep
+
+        state : `None or dict`
+            State returned by a previous call to this function (see `load_discussion_state`)
+
+        incl_unpublished : `bool`
+            Whether to include topics that students can't see yet
+
+        Returns
+        -------
+        `tuple[list[dict], dict]`
+            List of topic updates to be formatted and sent as embeds, and the new state. The root message
+            IDs in the new state are carried over from `state` and must be filled in by the caller.
+        """
+
+        seeding = state is None
+        old_state = state or {}
+        new_state = {}
+        updates = []
+        now = datetime.now(timezone.utc)
+
+        for topic in course.get_discussion_topics(per_page=DISCUSSION_PAGE_SIZE):
+            topic_id = str(topic.id)
+            delayed_post_at = getattr(topic, "delayed_post_at", None)
+
+            if not incl_unpublished and (not getattr(topic, "published", True) or delayed_post_at and isoparse(delayed_post_at) > now):
+                # Keep the threads of a topic that was already sent, in case it's published again
+                if topic_id in old_state:
+                    new_state[topic_id] = old_state[topic_id]
+
+                continue
+
+            fingerprint = self._topic_fingerprint(topic)
+            topic_state = old_state.get(topic_id)
+
+            if topic_state and topic_state["fingerprint"] == fingerprint:
+                new_state[topic_id] = topic_state
+                continue
+
+            if topic_state:
+                since = topic_state["since"]
+                threads = topic_state["threads"]
+            else:
+                since = None
+                threads = {}
+
+            entries = [] if seeding else self._get_entries_since(topic, since)
+            newest = max((e["created_at"] for e in entries), key=isoparse, default=None)
+
+            if seeding:
+                newest = getattr(topic, "last_reply_at", None)
+
+            new_state[topic_id] = {
+                "fingerprint": fingerprint,
+                "since": newest or since or getattr(topic, "posted_at", None),
+                "threads": threads
+            }
+
+            if not seeding and (entries or not topic_state):
+                updates.append({
+                    "topic_id": topic_id,
+                    "title": topic.title,
+                    "url": topic.html_url,
+                    "author": getattr(topic, "user_name", None) or "Unknown",
+                    "message": self._short_text(getattr(topic, "message", None)),
+                    "posted_at": self._format_canvas_time(getattr(topic, "posted_at", None)),
+                    "new": not topic_state,
+                    "entries": entries
+                })
+
+        return updates, new_state
+
+    @staticmethod
+    def _topic_fingerprint(topic) -> str:
+        """
+        Returns a fingerprint of the fields that change whenever a topic is edited or receives a reply.
+        """
+
+        fields = (getattr(topic, "last_reply_at", None), getattr(topic, "discussion_subentry_count", None), getattr(topic, "updated_at", None), topic.title)
+        return hashlib.sha1(repr(fields).encode()).hexdigest()
+
+    def _get_entries_since(self, topic, since: Optional[str]) -> list[dict]:
+        """
+        Returns the entries and recent replies of a topic created after `since`, oldest first.
+
+        Canvas orders top-level entries by when they were created, not by when they were last replied to,
+        so every entry is checked for new replies. This only runs for topics whose fingerprint changed.
+        """
+
+        since_parsed = isoparse(since) if since else None
+        entries = []
+
+        def is_new(created_at: Optional[str]) -> bool:
+            return bool(created_at) and (since_parsed is None or isoparse(created_at) > since_parsed)
+
+        for entry in topic.get_topic_entries(per_page=DISCUSSION_PAGE_SIZE):
+            new_replies = [r for r in getattr(entry, "recent_replies", None) or [] if is_new(r.get("created_at"))]
+            entry_is_new = is_new(getattr(entry, "created_at", None))
+
+            for reply in new_replies:
+                entries.append({
+                    "author": reply.get("user_name") or "Unknown",
+                    "message": self._short_text(reply.get("message")),
+                    "created_at": reply["created_at"],
+                    "reply": True
+                })
+
+            if entry_is_new:
+                entries.append({
+                    "author": getattr(entry, "user_name", None) or "Unknown",
+                    "message": self._short_text(getattr(entry, "message", None)),
+                    "created_at": entry.created_at,
+                    "reply": False
+                })
+
+        entries.sort(key=lambda e: isoparse(e["created_at"]))
+        return entries
+
+    @staticmethod
+    def _short_text(message_html: Optional[str]) -> str:
+        """
+        Returns the first 4 lines of the text in an HTML message.
+        """
+
+        if not message_html:
+            return "No description"
+
+        return "\n".join(BeautifulSoup(message_html, "html.parser").get_text().split("\n")[:4])
+
+    @staticmethod
+    def _format_canvas_time(time_iso: Optional[str]) -> str:
+        """
+        Converts an ISO 8601 time from Canvas to local time formatted as `%Y-%m-%d %H:%M:%S`.
+        """
+
+        if time_iso is None:
+            return "No info"
+
+        time_shift = timedelta(seconds=-time.timezone)
+        return (isoparse(time_iso) + time_shift).strftime("%Y-%m-%d %H:%M:%S")
+
+    def find_assignments(self, query: str, course_ids_str: tuple[str, ...]) -> list[tuple[Course, Assignment]]:
+        """
+        Finds assignments in tracked courses whose ID is `query` or whose name contains `query`.
+
+        Parameters
+        ----------
+        query : `str`
+            Assignment ID or part of an assignment's name
+
+        course_ids_str : `tuple[str, ...]`
+            Tuple of course ids. If this parameter is an empty tuple, all tracked courses are searched.
+
+        Returns
+        -------
+        `list[tuple[Course, Assignment]]`
+            Matching assignments and the courses they belong to
+        """
+
+        course_ids = self._ids_converter(course_ids_str)
+        courses = [c for c in self.courses if not course_ids or c.id in course_ids]
+
+        if query.isdigit():
+            for course in courses:
+                try:
+                    return [(course, course.get_assignment(int(query)))]
+                except ResourceDoesNotExist:
+                    pass
+
+        return [(c, a) for c in courses for a in c.get_assignments(search_term=query, per_page=100)]
+
+    def get_grade_stats(self, course: Course, assignment: Assignment) -> dict:
+        """
+        Gets the grade distribution of an assignment (see `grade_stats.compute_grade_stats`).
+
+        Results are cached by the latest `graded_at` of the assignment's submissions. A repeated call
+        only asks Canvas for submissions graded since the cached time, and serves the cached result if
+        none were graded after it.
+
+        Parameters
+        ----------
+        course : `Course`
+            Course that the assignment belongs to
+
+        assignment : `Assignment`
+            Assignment to compute the distribution of
+
+        Returns
+        -------
+        `dict`
+            Grade distribution, with the assignment's `latest_graded_at` and a `cached` flag added
+        """
+
+        key = (course.id, assignment.id)
+        cached = self._grade_stats_cache.get(key)
+
+        if cached and cached["latest_graded_at"]:
+            latest = isoparse(cached["latest_graded_at"])
+            regraded = course.get_multiple_submissions(assignment_ids=[assignment.id], student_ids="all", graded_since=cached["latest_graded_at"], per_page=100)
+
+            if not any(s.graded_at and isoparse(s.graded_at) > latest for s in regraded):
+                return {**cached, "cached": True}
+
+        scores, late, missing, excused, graded_at = [], [], [], [], []
+
+        for submission in assignment.get_submissions(per_page=100):
+            scores.append(getattr(submission, "score", None))
+            late.append(bool(getattr(submission, "late", False)))
+            missing.append(bool(getattr(submission, "missing", False)))
+            excused.append(bool(getattr(submission, "excused", False)))
+
+            if getattr(submission, "graded_at", None):
+                graded_at.append(submission.graded_at)
+
+        stats = compute_grade_stats(scores, late, missing, excused, getattr(assignment, "points_possible", None))
+        stats["latest_graded_at"] = max(graded_at, key=isoparse, default=None)
+        self._grade_stats_cache[key] = stats
+
+        return {**stats, "cached": False}
+
+    def get_roster(self, course: Course) -> list:
+        """
+        Returns the active student, TA and teacher enrollments of a course, with each enrolled user's
+        login and SIS IDs. 100 enrollments are requested per page.
+
+        Only the first page and the course's student count are requested if the roster looks unchanged since
+        the last call, i.e. the first page's enrollments, the number of pages and the number of students are
+        the same; the previous roster is returned then, for up to ROSTER_MAX_AGE seconds.
+        """
+
+        kwargs = {"type": ROSTER_ENROLLMENT_TYPES, "state": ["active"], "per_page": ROSTER_PAGE_SIZE}
+        first_page, links = get_first_page(course, "enrollments", **kwargs)
+        total_students = getattr(self.get_course(course.id, include=["total_students"]), "total_students", None)
+        fields = (links.get("last", {}).get("url"), total_students, [(e.get("id"), e.get("updated_at"), e.get("enrollment_state")) for e in first_page])
+        fingerprint = hashlib.sha1(repr(fields).encode()).hexdigest()
+        snapshot = self._roster_snapshots.get(course.id)
+
+        if snapshot and snapshot[0] == fingerprint and time.time() - snapshot[1] < ROSTER_MAX_AGE:
+            return snapshot[2]
+
+        if "next" in links:
+            roster = list(course.get_enrollments(**kwargs))
+        else:
+            roster = [Enrollment(course._requester, e) for e in first_page]
+
+        self._roster_snapshots[course.id] = (fingerprint, time.time(), roster)
+        return roster
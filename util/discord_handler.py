@@ -1,5 +1,5 @@
+from util.async_piazza_handler import AsyncPiazzaHandler
 from util.canvas_handler import CanvasHandler
-from util.piazza_handler import PiazzaHandler
 
 
 class DiscordHandler:
@@ -10,13 +10,13 @@ class DiscordHandler:
     ----------
     canvas_handlers : `List[CanvasHandlers]`
         List for CanvasHandler for guilds
-    piazza_handler : `PiazzaHandler`
-        PiazzaHandler for guild.
+    piazza_handlers : `List[AsyncPiazzaHandler]`
+        PiazzaHandler for each Piazza network, wrapped in its async facade.
     """
 
     def __init__(self):
         self._canvas_handlers = []  # [c_handler1, ... ]
-        self._piazza_handler = None
+        self._piazza_handlers = []  # [p_handler1, ... ]
 
     @property
     def canvas_handlers(self) -> list[CanvasHandler]:
@@ -27,9 +27,9 @@ class DiscordHandler:
         self._canvas_handlers = handlers
 
     @property
-    def piazza_handler(self) -> PiazzaHandler:
-        return self._piazza_handler
+    def piazza_handlers(self) -> list[AsyncPiazzaHandler]:
+        return self._piazza_handlers
 
-    @piazza_handler.setter
-    def piazza_handler(self, piazza: PiazzaHandler) -> None:
-        self._piazza_handler = piazza
+    @piazza_handlers.setter
+    def piazza_handlers(self, handlers: list[AsyncPiazzaHandler]) -> None:
+        self._piazza_handlers = handlers
@@ -0,0 +1,293 @@
+import asyncio
+import random
+from collections import deque
+from typing import Callable, Generic, Hashable, Iterator, List, Optional, TypeVar, Union
+
+T = TypeVar("T")
+
+
+class _Node:
+    __slots__ = ("item", "round", "priority", "size", "max_round", "left", "right")
+
+    def __init__(self, item, round_: int):
+        self.item = item
+        self.round = round_
+        self.priority = random.random()
+        self.size = 1
+        self.max_round = round_
+        self.left: Optional[_Node] = None
+        self.right: Optional[_Node] = None
+
+    def update(self) -> "_Node":
+        self.size = 1
+        self.max_round = self.round
+
+        for child in (self.left, self.right):
+            if child:
+                self.size += child.size
+                self.max_round = max(self.max_round, child.max_round)
+
+        return self
+
+
+def _size(node: Optional[_Node]) -> int:
+    return node.size if node else 0
+
+
+def _merge(left: Optional[_Node], right: Optional[_Node]) -> Optional[_Node]:
+    if not left or not right:
+        return left or right
+
+    if left.priority > right.priority:
+        left.right = _merge(left.right, right)
+        return left.update()
+
+    right.left = _merge(left, right.left)
+    return right.update()
+
+
+def _split(node: Optional[_Node], index: int) -> tuple[Optional[_Node], Optional[_Node]]:
+    """
+    Splits `node` into its first `index` nodes and the rest
+    """
+
+    if not node:
+        return None, None
+
+    if _size(node.left) >= index:
+        left, node.left = _split(node.left, index)
+        return left, node.update()
+
+    node.right, right = _split(node.right, index - _size(node.left) - 1)
+    return node.update(), right
+
+
+class FairQueue(Generic[T]):
+    """
+    Unbounded queue that takes turns between the keys (e.g. requesters) of its items, so one key queueing
+    many items doesn't hold up the others: each key's first item comes before anyone's second, and so on.
+
+    Items are kept in an implicit treap (a randomly balanced binary tree ordered by position) with subtree
+    sizes, so indexing, slicing, inserting, removing and moving items take O(log n) time whatever the
+    queue's length.
+
+    Each item belongs to a round: a key's items are in consecutive rounds, starting from the round of the
+    item last taken from the queue, and a new item goes before the first item of any later round.
+
+    Attributes
+    ----------
+    key : `Callable[[T], Hashable]`
+        Returns the key an item takes turns under
+    """
+
+    def __init__(self, key: Callable[[T], Hashable]):
+        self.key = key
+        self._root: Optional[_Node] = None
+        self._round = 0
+        # Last round and number of queued items of each key with items in the queue
+        self._rounds: dict[Hashable, int] = {}
+        self._counts: dict[Hashable, int] = {}
+        self._getters: deque[asyncio.Future] = deque()
+
+    def __len__(self) -> int:
+        return _size(self._root)
+
+    def __iter__(self) -> Iterator[T]:
+        stack = []
+        node = self._root
+
+        while stack or node:
+            while node:
+                stack.append(node)
+                node = node.left
+
+            node = stack.pop()
+            yield node.item
+            node = node.right
+
+    def __getitem__(self, item: Union[int, slice]) -> Union[T, List[T]]:
+        if isinstance(item, slice):
+            start, stop, step = item.indices(len(self))
+
+            if step != 1:
+                return list(self)[item]
+
+            return self._range(start, stop)
+
+        return self._node(self._index(item)).item
+
+    def _index(self, index: int) -> int:
+        if index < 0:
+            index += len(self)
+
+        if not 0 <= index < len(self):
+            raise IndexError("queue index out of range")
+
+        return index
+
+    def _node(self, index: int) -> _Node:
+        node = self._root
+
+        while True:
+            left = _size(node.left)
+
+            if index < left:
+                node = node.left
+            elif index == left:
+                return node
+            else:
+                index -= left + 1
+                node = node.right
+
+    def _range(self, start: int, stop: int) -> List[T]:
+        """
+        Returns the items from `start` to `stop` in O(log n + stop - start) time
+        """
+
+        items = []
+        stack = []
+        node = self._root
+        count = stop - start
+
+        # Walk down to `start`, keeping the ancestors it's left of, then carry on in order from there
+        while node and count > 0:
+            left = _size(node.left)
+
+            if start < left:
+                stack.append(node)
+                node = node.left
+            elif start == left:
+                stack.append(node)
+                break
+            else:
+                start -= left + 1
+                node = node.right
+
+        while stack and len(items) < count:
+            node = stack.pop()
+            items.append(node.item)
+            node = node.right
+
+            while node:
+                stack.append(node)
+                node = node.left
+
+        return items
+
+    def _insert(self, node: _Node, index: int) -> None:
+        left, right = _split(self._root, index)
+        self._root = _merge(_merge(left, node), right)
+
+    def _pop(self, index: int) -> _Node:
+        left, rest = _split(self._root, index)
+        node, right = _split(rest, 1)
+        self._root = _merge(left, right)
+        return node
+
+    def _fair_index(self, round_: int) -> int:
+        """
+        Returns the position of the first item in a later round than `round_`
+        """
+
+        index = 0
+        node = self._root
+
+        while node:
+            if node.left and node.left.max_round > round_:
+                node = node.left
+            elif node.round > round_:
+                return index + _size(node.left)
+            else:
+                index += _size(node.left) + 1
+                node = node.right
+
+        return index
+
+    def put(self, item: T) -> None:
+        """
+        Adds `item` after the queued items of its key, in the next round that key has no item in
+        """
+
+        key = self.key(item)
+        round_ = max(self._round, self._rounds.get(key, self._round - 1) + 1)
+        self._rounds[key] = round_
+        self._counts[key] = self._counts.get(key, 0) + 1
+        self._insert(_Node(item, round_), self._fair_index(round_))
+
+        while self._getters:
+            getter = self._getters.popleft()
+
+            if not getter.done():
+                getter.set_result(None)
+                break
+
+    async def get(self) -> T:
+        """
+        Removes and returns the first item, waiting until there is one
+        """
+
+        while not self._root:
+            getter = asyncio.get_event_loop().create_future()
+            self._getters.append(getter)
+
+            try:
+                await getter
+            except asyncio.CancelledError:
+                getter.cancel()
+
+                # Hand the wakeup to the next waiter if this one had already been woken
+                if self._root and self._getters:
+                    self._getters.popleft().set_result(None)
+
+                raise
+
+        node = self._pop(0)
+        self._round = node.round
+        self._discard(node)
+        return node.item
+
+    def _discard(self, node: _Node) -> None:
+        key = self.key(node.item)
+        self._counts[key] -= 1
+
+        # Keys that have no more queued items start again from the current round
+        if not self._counts[key]:
+            del self._counts[key], self._rounds[key]
+
+    def remove(self, index: int) -> T:
+        """
+        Removes and returns the item at `index`
+        """
+
+        node = self._pop(self._index(index))
+        self._discard(node)
+        return node.item
+
+    def move(self, index: int, to: int) -> None:
+        """
+        Moves the item at `index` to position `to`. It joins the round of the item it's moved behind, so items
+        queued later still go after it.
+        """
+
+        node = self._pop(self._index(index))
+        to = min(max(to if to >= 0 else to + len(self) + 1, 0), len(self))
+        node.left = node.right = None
+        node.round = self._node(to - 1).round if to else self._round
+        self._insert(node.update(), to)
+
+    def clear(self) -> None:
+        self._root = None
+        self._rounds.clear()
+        self._counts.clear()
+
+    def shuffle(self) -> None:
+        """
+        Shuffles the queue while still taking turns between keys
+        """
+
+        items = list(self)
+        random.shuffle(items)
+        self.clear()
+
+        for item in items:
+            self.put(item)
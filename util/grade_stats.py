@@ -0,0 +1,109 @@
+from io import BytesIO
+from typing import Optional
+
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+HISTOGRAM_BINS = 10
+
+
+def compute_grade_stats(scores: list[Optional[float]], late: list[bool], missing: list[bool], excused: list[bool], points_possible: Optional[float]) -> dict:
+    """
+    Computes the grade distribution of an assignment's submissions.
+
+    Parameters
+    ----------
+    scores : `list[None or float]`
+        Score of each submission, or None if the submission is ungraded
+
+    late : `list[bool]`
+        Whether each submission is late
+
+    missing : `list[bool]`
+        Whether each submission is missing
+
+    excused : `list[bool]`
+        Whether each submission is excused. Excused submissions are left out of the distribution.
+
+    points_possible : `None or float`
+        Maximum score of the assignment. If None, the histogram spans the observed scores.
+
+    Returns
+    -------
+    `dict`
+        Submission counts, summary statistics and the histogram's counts and bin edges
+    """
+
+    score_arr = np.array([np.nan if s is None else s for s in scores], dtype=np.float64)
+    late_arr = np.array(late, dtype=bool)
+    missing_arr = np.array(missing, dtype=bool)
+    excused_arr = np.array(excused, dtype=bool)
+
+    graded = score_arr[~np.isnan(score_arr) & ~excused_arr]
+    stats = {
+        "submissions": int(score_arr.size),
+        "graded": int(graded.size),
+        "late": int(np.count_nonzero(late_arr)),
+        "missing": int(np.count_nonzero(missing_arr)),
+        "excused": int(np.count_nonzero(excused_arr)),
+        "points_possible": points_possible,
+        "mean": None,
+        "std": None,
+        "min": None,
+        "q1": None,
+        "median": None,
+        "q3": None,
+        "max": None,
+        "hist_counts": [],
+        "hist_edges": []
+    }
+
+    if graded.size:
+        q1, median, q3 = np.percentile(graded, (25, 50, 75))
+        upper = points_possible if points_possible else max(float(graded.max()), 1.0)
+        counts, edges = np.histogram(graded, bins=HISTOGRAM_BINS, range=(0, max(upper, float(graded.max()))))
+
+        stats.update({
+            "mean": float(graded.mean()),
+            "std": float(graded.std()),
+            "min": float(graded.min()),
+            "q1": float(q1),
+            "median": float(median),
+            "q3": float(q3),
+            "max": float(graded.max()),
+            "hist_counts": counts.tolist(),
+            "hist_edges": edges.tolist()
+        })
+
+    return stats
+
+
+def render_histogram(stats: dict, title: str) -> BytesIO:
+    """
+    Renders the histogram in `stats` (as returned by `compute_grade_stats`) to a PNG image.
+
+    This is CPU-bound, so it should be run in an executor rather than on the event loop. The figure is
+    built without pyplot, whose global figure manager isn't thread-safe, so concurrent calls don't mix.
+    """
+
+    fig = Figure(figsize=(8, 4.5))
+    FigureCanvasAgg(fig)
+    ax = fig.subplots()
+    edges = stats["hist_edges"]
+    widths = np.diff(edges)
+    ax.bar(edges[:-1], stats["hist_counts"], width=widths, align="edge", color="#e13f2b", edgecolor="white")
+
+    if stats["median"] is not None:
+        ax.axvline(stats["median"], color="black", linestyle="--", linewidth=1, label=f"Median {stats['median']:.2f}")
+        ax.axvline(stats["mean"], color="grey", linestyle=":", linewidth=1, label=f"Mean {stats['mean']:.2f}")
+        ax.legend()
+
+    ax.set_title(title)
+    ax.set_xlabel("Score")
+    ax.set_ylabel("Submissions")
+
+    res = BytesIO()
+    fig.savefig(res, format="png", bbox_inches="tight")
+    res.seek(0)
+    return res
@@ -0,0 +1,264 @@
+import re
+from html.parser import HTMLParser
+from typing import List, Optional
+
+# Discord's limit on the length of an embed field's value
+EMBED_FIELD_LIMIT = 1024
+READ_MORE = "...\n\n *(Read more)*"
+
+# Markdown characters that need escaping in plain text, and LaTeX spans which are shown as inline code
+# so Discord doesn't treat their underscores and asterisks as formatting
+MARKDOWN_SPECIAL = re.compile(r"([\\*_`~|>])")
+LATEX = re.compile(r"(\$\$.+?\$\$|\\\(.+?\\\)|\\\[.+?\\\])", re.DOTALL)
+WHITESPACE = re.compile(r"\s+")
+
+INLINE_MARKERS = {"b": "**", "strong": "**", "i": "*", "em": "*", "u": "__", "s": "~~", "strike": "~~", "del": "~~", "code": "`"}
+BLOCK_TAGS = {"p", "div", "ul", "ol", "table", "tr", "h1", "h2", "h3", "h4", "h5", "h6", "blockquote", "pre", "hr"}
+
+
+class HTMLToMarkdown(HTMLParser):
+    """
+    Converts HTML (e.g. a Piazza post body) to Discord markdown in a single pass, collecting the URLs of its
+    images along the way.
+
+    Bold, italics, links, lists, code and code blocks are kept. Text past `limit` characters is dropped, but
+    the rest of the HTML is still scanned for images. Any formatting open at the cut is closed so the
+    truncated text renders the same as the start of the full text.
+
+    Attributes
+    ----------
+    limit : `int`
+        Maximum length of the converted text, including the "Read more" suffix
+
+    base_url : `str`
+        Prefix for relative links and image sources
+
+    images : `List[str]`
+        Image URLs, in the order they appear
+
+    truncated : `bool`
+        Whether the text was cut at `limit`
+    """
+
+    def __init__(self, limit: int = EMBED_FIELD_LIMIT, base_url: str = ""):
+        super().__init__(convert_charrefs=True)
+        self.limit = limit
+        self.base_url = base_url
+        self.images: List[str] = []
+        self.truncated = False
+        self._parts: List[str] = []
+        self._length = 0
+        self._open: List[str] = []
+        self._pre = 0
+        self._href: Optional[str] = None
+        self._link_start = 0
+        self._lists: List[int] = []
+        self._newlines = 2  # no leading blank lines
+        self._space = False
+
+    def _url(self, url: str) -> str:
+        return f"{self.base_url}{url}" if url.startswith("/") else url
+
+    def _budget(self) -> int:
+        # Leave room for the suffix and for closing everything still open
+        return self.limit - len(READ_MORE) - sum(len(marker) for marker in self._open) - (4 if self._pre else 0)
+
+    def _write(self, text: str, split: bool = True, reserve: int = 0) -> bool:
+        """
+        Appends `text` to the output, and returns whether it all fit. Text that can't be `split` (i.e. markup)
+        is written whole or not at all, and `reserve` leaves room for the markup that will close it.
+        """
+
+        if self.truncated or not text:
+            return False
+
+        budget = self._budget() - self._length - reserve
+
+        if len(text) > budget:
+            self.truncated = True
+
+            if not split:
+                return False
+
+            text = text[:max(budget, 0)]
+
+        self._parts.append(text)
+        self._length += len(text)
+        trailing = len(text) - len(text.rstrip("\n"))
+        self._newlines = self._newlines + trailing if trailing == len(text) else trailing
+        self._space = False
+        return not self.truncated
+
+    def _newline(self, count: int = 1) -> None:
+        if self._newlines < count:
+            self._write("\n" * (count - self._newlines))
+
+    def handle_starttag(self, tag: str, attrs: list) -> None:
+        attrs = dict(attrs)
+
+        if tag == "img":
+            if attrs.get("src"):
+                self.images.append(self._url(attrs["src"]))
+        elif self.truncated:
+            return
+        elif tag == "br":
+            self._write("\n")
+        elif tag == "pre":
+            self._newline()
+
+            if self._write("```\n", split=False, reserve=4):
+                self._pre += 1
+        elif self._pre:
+            return
+        elif tag in INLINE_MARKERS:
+            self._flush_space()
+            self._open_marker(INLINE_MARKERS[tag])
+        elif tag == "a":
+            self._flush_space()
+            self._href = self._url(attrs.get("href") or "")
+            self._link_start = len(self._parts)
+        elif tag in ("ul", "ol"):
+            self._newline()
+            self._lists.append(0 if tag == "ol" else -1)
+        elif tag == "li":
+            self._newline()
+
+            if self._lists and self._lists[-1] >= 0:
+                self._lists[-1] += 1
+                self._write(f"{'  ' * (len(self._lists) - 1)}{self._lists[-1]}. ", split=False)
+            else:
+                self._write(f"{'  ' * max(len(self._lists) - 1, 0)}- ", split=False)
+        elif tag in ("h1", "h2", "h3", "h4", "h5", "h6"):
+            self._newline(2)
+            self._open_marker("**")
+        elif tag == "blockquote":
+            self._newline()
+            self._write("> ", split=False)
+        elif tag in BLOCK_TAGS:
+            self._newline(2 if tag == "p" else 1)
+
+    def handle_endtag(self, tag: str) -> None:
+        # Once truncated, whatever is still open is closed by get_markdown
+        if self.truncated:
+            return
+
+        if tag == "pre" and self._pre:
+            self._pre -= 1
+            self._newline()
+            self._write("```")
+            self._newline()
+        elif self._pre:
+            return
+        elif tag in INLINE_MARKERS or tag in ("h1", "h2", "h3", "h4", "h5", "h6"):
+            marker = INLINE_MARKERS.get(tag, "**")
+
+            if self._open and self._open[-1] == marker:
+                self._open.pop()
+                self._write(marker)
+
+            if tag.startswith("h") and tag != "hr":
+                self._newline(2)
+        elif tag == "a" and self._href is not None:
+            written = "".join(self._parts[self._link_start:])
+            text = written.strip()
+
+            if self._href and text and not self.truncated:
+                del self._parts[self._link_start:]
+                self._length -= len(written)
+
+                # Links whose text is their URL are shown as the bare URL, which Discord links by itself
+                if text.replace("\\", "") == self._href:
+                    self._write(self._href, split=False)
+                elif not self._write(f"[{text}]({self._href})", split=False):
+                    # Keep as much of the link's text as fits instead
+                    self.truncated = False
+                    self._write(text)
+
+            self._href = None
+        elif tag in ("ul", "ol"):
+            if self._lists:
+                self._lists.pop()
+
+            self._newline()
+        elif tag in BLOCK_TAGS:
+            self._newline(2 if tag == "p" else 1)
+
+    def _open_marker(self, marker: str) -> None:
+        if self._write(marker, split=False, reserve=len(marker)):
+            self._open.append(marker)
+
+    def handle_startendtag(self, tag: str, attrs: list) -> None:
+        self.handle_starttag(tag, attrs)
+
+    def _flush_space(self) -> None:
+        if self._space:
+            self._space = False
+            self._write(" ")
+
+    def handle_data(self, data: str) -> None:
+        if self.truncated:
+            return
+
+        if self._pre:
+            # Code is shown verbatim; only a closing fence inside it needs breaking up
+            self._write(data.replace("```", "`\u200b``"))
+            return
+
+        if not data.strip():
+            self._space = self._space or (bool(data) and not self._newlines)
+            return
+
+        if data[0].isspace() and not self._newlines:
+            self._space = True
+
+        self._flush_space()
+        text = WHITESPACE.sub(" ", data).strip()
+
+        if self._open and self._open[-1] == "`":
+            self._write(text)
+        else:
+            self._write("".join(f"`{part}`" if i % 2 else MARKDOWN_SPECIAL.sub(r"\\\1", part) for i, part in enumerate(LATEX.split(text))))
+
+        self._space = data[-1].isspace()
+
+    def get_markdown(self) -> str:
+        """
+        Returns the converted text, closing whatever formatting is still open.
+        """
+
+        text = "".join(self._parts).strip()
+
+        if self._pre:
+            text += "\n```"
+
+        text += "".join(reversed(self._open))
+
+        if self.truncated:
+            text += READ_MORE
+
+        return text
+
+
+def html_to_markdown(res: Optional[str], limit: int = EMBED_FIELD_LIMIT, base_url: str = "") -> tuple[str, List[str]]:
+    """
+    Returns `res` converted to Discord markdown of at most `limit` characters, and the URLs of its images
+
+    Parameters
+    ----------
+    res : `str`
+        HTML to convert
+
+    limit : `int`
+        Maximum length of the returned text
+
+    base_url : `str`
+        Prefix for relative links and image sources
+    """
+
+    if not res:
+        return "", []
+
+    converter = HTMLToMarkdown(limit, base_url)
+    converter.feed(res)
+    converter.close()
+    return converter.get_markdown(), converter.images
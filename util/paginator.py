@@ -0,0 +1,107 @@
+import asyncio
+from typing import Callable, Optional
+
+import discord
+from discord.ext import commands
+
+FIRST, PREVIOUS, NEXT, LAST, STOP = "⏮", "◀", "▶", "⏭", "⏹"
+
+
+class Paginator:
+    """
+    Shows a long result set as a single message whose embed can be paged through with reactions.
+
+    Pages are only rendered when they are first shown, then kept for when they are shown again.
+    Navigation is read from raw reaction events so it keeps working for messages that have fallen
+    out of the message cache, and both adding and removing a reaction turn the page, so the bot
+    does not need permission to remove other users' reactions.
+
+    Attributes
+    ----------
+    page_count : `int`
+        Number of pages
+
+    render_page : `Callable[[int], discord.Embed]`
+        Function that returns the embed for the page with given (0-based) index
+
+    timeout : `float`
+        Seconds of inactivity after which navigation stops
+    """
+
+    def __init__(self, bot: commands.Bot, page_count: int, render_page: Callable[[int], discord.Embed], timeout: float = 120):
+        self.bot = bot
+        self.page_count = page_count
+        self.render_page = render_page
+        self.timeout = timeout
+        self._pages: dict[int, discord.Embed] = {}
+
+    @classmethod
+    def from_items(cls, bot: commands.Bot, items: list, per_page: int, render_items: Callable[[list, int, int], discord.Embed], timeout: float = 120) -> "Paginator":
+        """
+        Creates a paginator that shows `per_page` items per page. `render_items` is called with the page's
+        items, the page index and the page count.
+        """
+
+        page_count = max(1, -(-len(items) // per_page))
+        return cls(bot, page_count, lambda i: render_items(items[i * per_page:(i + 1) * per_page], i, page_count), timeout)
+
+    def get_page(self, index: int) -> discord.Embed:
+        if index not in self._pages:
+            self._pages[index] = self.render_page(index)
+
+        return self._pages[index]
+
+    async def send(self, ctx: commands.Context, start: int = 0) -> discord.Message:
+        """
+        Sends the page with index `start` to ctx, then lets the command's author page through the results
+        until `timeout` seconds pass without navigation.
+        """
+
+        page = min(max(start, 0), self.page_count - 1)
+        message = await ctx.send(embed=self.get_page(page))
+
+        if self.page_count == 1:
+            return message
+
+        controls = (FIRST, PREVIOUS, NEXT, LAST, STOP) if self.page_count > 2 else (PREVIOUS, NEXT, STOP)
+
+        for emoji in controls:
+            await message.add_reaction(emoji)
+
+        def check(payload: discord.RawReactionActionEvent) -> bool:
+            return payload.message_id == message.id and payload.user_id == ctx.author.id and str(payload.emoji) in controls
+
+        while True:
+            action = await self._wait_for_reaction(check)
+
+            if action is None or action == STOP:
+                break
+
+            new_page = {FIRST: 0, PREVIOUS: page - 1, NEXT: page + 1, LAST: self.page_count - 1}[action] % self.page_count
+
+            if new_page != page:
+                page = new_page
+                await message.edit(embed=self.get_page(page))
+
+        try:
+            await message.clear_reactions()
+        except discord.HTTPException:
+            pass
+
+        return message
+
+    async def _wait_for_reaction(self, check: Callable[[discord.RawReactionActionEvent], bool]) -> Optional[str]:
+        """
+        Waits for a reaction to be added or removed, returning its emoji, or None on timeout.
+        """
+
+        waiters = [asyncio.ensure_future(self.bot.wait_for(event, check=check)) for event in ("raw_reaction_add", "raw_reaction_remove")]
+        done, pending = await asyncio.wait(waiters, timeout=self.timeout, return_when=asyncio.FIRST_COMPLETED)
+
+        for waiter in pending:
+            waiter.cancel()
+
+        if not done:
+            return None
+
+        return str(done.pop().result().emoji)
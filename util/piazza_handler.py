@@ -1,14 +1,30 @@
-import asyncio
 import datetime
-import html
-import re
-from operator import itemgetter
 from typing import List, Optional
 
 import discord
 import piazza_api.exceptions
-from bs4 import BeautifulSoup
-from piazza_api import Piazza
+from dateutil.parser import isoparse
+from piazza_api.network import Network
+
+from util.cache import LRUCache
+from util.html_markdown import EMBED_FIELD_LIMIT, html_to_markdown
+from util.piazza_session import PiazzaSession
+from util.rate_limiter import TokenBucket
+
+# Piazza allows about 55 post fetches per 2 minutes. A burst of BURST requests plus RATE requests per second
+# sustained over 2 minutes must stay under that budget.
+PIAZZA_BURST = 10
+PIAZZA_RATE = (55 - PIAZZA_BURST) / 120
+
+# Parsed posts served by get_post. Entries are also dropped early when the feed shows a newer modification.
+POST_CACHE_SIZE = 256
+POST_CACHE_TTL = 60 * 30
+
+# Largest page requested when paging through the feed
+FEED_PAGE_MAX = 100
+
+# Prefix for the relative links and image sources in post bodies
+PIAZZA_BASE_URL = "https://piazza.com"
 
 
 # Exception for when a post ID is invalid or the post is private etc.
@@ -19,10 +35,55 @@ class InvalidPostID(Exception):
     pass
 
 
+class ThrottledNetwork:
+    """
+    Wraps a `piazza_api.network.Network` so that every call to it first takes a token from a rate limiter.
+
+    If Piazza still answers that we are going too fast, the limiter is drained by a full burst before the
+    call is retried, so every user of the limiter backs off together instead of each retrying on its own.
+    If Piazza answers that the session has expired, the session logs in again and the call is retried.
+    """
+
+    def __init__(self, network: Network, limiter: TokenBucket, session: PiazzaSession, retries: int = 3):
+        self._network = network
+        self._limiter = limiter
+        self._session = session
+        self._retries = retries
+
+    def __getattr__(self, name: str):
+        attr = getattr(self._network, name)
+
+        if not callable(attr):
+            return attr
+
+        def throttled(*args, **kwargs):
+            relogged = False
+
+            for _ in range(self._retries):
+                self._session.ensure_authenticated()
+                cookies_used = self._session.cookies()
+                self._limiter.acquire_blocking()
+
+                try:
+                    return attr(*args, **kwargs)
+                except (piazza_api.exceptions.RequestError, piazza_api.exceptions.NotAuthenticatedError) as ex:
+                    if PiazzaSession.is_auth_error(ex) and not relogged:
+                        self._session.relogin(cookies_used)
+                        relogged = True
+                    elif "foo fast" in str(ex):
+                        self._limiter.acquire_blocking(self._limiter.capacity)
+                    else:
+                        raise
+
+            self._limiter.acquire_blocking()
+            return attr(*args, **kwargs)
+
+        return throttled
+
+
 class PiazzaHandler:
     """
-    Handles requests to a specific Piazza network. Requires an e-mail and password, but if none are
-    provided, then they will be asked for in the console (doesn't work for Heroku deploys). API is rate-limited
+    Handles requests to a specific Piazza network through a shared `PiazzaSession`. API is rate-limited
     (max is 55 posts in about 2 minutes?) so it's recommended to be conservative with fetch_max, fetch_min and only change them if necessary.
 
     All `fetch_*` functions return JSON directly from Piazza's API and all `get_*` functions parse that JSON.
@@ -36,11 +97,8 @@ class PiazzaHandler:
     nid : `str`
         ID of Piazza forum (usually found at the end of a Piazza's home url)
 
-    email : `str (optional)`
-        Piazza log-in email
-
-    password : `str (optional)`
-        Piazza password
+    session : `PiazzaSession`
+        Logged-in Piazza session. Creating the handler makes no requests; the session logs in on first use.
 
     guild : `discord.Guild`
         Guild assigned to the handler
@@ -50,17 +108,25 @@ class PiazzaHandler:
 
     fetch_min: `int (optional)`
         Lower limit on posts fetched from Piazza. Used as the default value for functions that don't need to fetch a lot of posts
+
+    limiter : `TokenBucket (optional)`
+        Rate limiter that every request to Piazza goes through. Requests block the calling thread while waiting,
+        so this class's methods should be called through `AsyncPiazzaHandler` rather than on the event loop.
+
+    post_cache : `LRUCache`
+        Parsed posts returned by `get_post`, keyed by post number
     """
 
-    def __init__(self, name: str, nid: str, email: str, password: str, guild: discord.Guild, fetch_max: int = 55, fetch_min: int = 30):
+    def __init__(self, name: str, nid: str, session: PiazzaSession, guild: discord.Guild, fetch_max: int = 55, fetch_min: int = 30, limiter: Optional[TokenBucket] = None):
         self._name = name
         self.nid = nid
         self._guild = guild
         self._channels = []
-        self.url = f"https://piazza.com/class/{self.nid}"
-        self.p = Piazza()
-        self.p.user_login(email=email, password=password)
-        self.network = self.p.network(self.nid)
+        self.url = f"{PIAZZA_BASE_URL}/class/{self.nid}"
+        self.session = session
+        self.limiter = limiter or TokenBucket(PIAZZA_BURST, PIAZZA_RATE)
+        self.network = ThrottledNetwork(session.network(self.nid), self.limiter, session)
+        self.post_cache = LRUCache(POST_CACHE_SIZE, POST_CACHE_TTL)
         self.fetch_max = fetch_max
         self.fetch_min = fetch_min
 
@@ -132,9 +198,9 @@ class PiazzaHandler:
 
         return post
 
-    async def fetch_recent_notes(self, lim: int = 55) -> List[dict]:
+    def fetch_recent_notes(self, lim: int = 55) -> List[dict]:
         """
-        Returns up to `lim` JSON objects representing instructor's notes that were posted today
+        Returns up to `lim` feed items representing instructor's notes and pinned posts that were posted today
 
         Parameters
         ----------
@@ -142,18 +208,33 @@ class PiazzaHandler:
             Upper limit on posts fetched. Must be in range [fetch_min, fetch_max] (inclusive)
         """
 
-        posts = await self.fetch_posts_in_range(days=0, seconds=60 * 60 * 5, lim=lim)
+        posts = self.fetch_posts_in_range(days=0, seconds=60 * 60 * 5, page_size=lim)
         response = []
 
         for post in posts:
-            if post["tags"][0] == "instructor-note" or post["bucket_name"] == "Pinned":
+            if "instructor-note" in post["tags"] or self.check_if_pinned(post):
                 response.append(post)
 
         return response
 
+    def fetch_feed(self, lim: int, offset: int = 0, include_private: bool = False) -> List[dict]:
+        """
+        Returns up to `lim` feed items, most recently updated first, starting `offset` items into the feed.
+        Feed items hold a post's metadata (`nr`, `subject`, `tags`, `bucket_name`, `status`, `modified`, ...)
+        but not its content, and a whole page of them costs a single request.
+
+        Private posts are left out unless `include_private` is True, and cached posts that the feed shows
+        were modified are invalidated.
+        """
+
+        feed = self.network.get_feed(limit=lim, offset=offset)["feed"]
+        self.invalidate_cached_posts(feed)
+
+        return [item for item in feed if include_private or not self.check_if_private(item)]
+
     def fetch_pinned(self, lim: int = 0) -> List[dict]:
         """
-        Returns up to `lim` JSON objects representing pinned posts\n
+        Returns up to `lim` feed items representing pinned posts\n
         Since pinned posts are always the first notes shown in a Piazza, lim can be a small value.
 
         Parameters
@@ -162,59 +243,47 @@ class PiazzaHandler:
             Upper limit on posts fetched. Must be in range [fetch_min, fetch_max] (inclusive)
         """
 
-        posts = self.network.iter_all_posts(limit=lim or self.fetch_min)
-        response = []
+        return [post for post in self.fetch_feed(lim or self.fetch_min) if self.check_if_pinned(post)]
 
-        for post in posts:
-            if self.check_if_private(post):
-                continue
-
-            if post.get("bucket_name", "") == "Pinned":
-                response.append(post)
-
-        return response
-
-    async def fetch_posts_in_range(self, days: int = 1, seconds: int = 0, lim: int = 55) -> List[dict]:
+    def fetch_posts_in_range(self, days: int = 1, seconds: int = 0, page_size: int = 20) -> List[dict]:
         """
-        Returns up to `lim` JSON objects that represent a Piazza post posted today
-        """
-
-        if lim < 0:
-            raise ValueError(f"Invalid lim for fetch_posts_in_days(): {lim}")
+        Returns feed items for all posts created in the last `days` days and `seconds` seconds. Only the feed is
+        requested; use `fetch_post_instance` for posts whose content is needed.
 
-        posts = []
-
-        feed = self.network.get_feed(limit=lim, offset=0)
+        The feed is ordered by last update, and a post can't be updated before it was created, so the feed is
+        paged backwards only until it reaches an item last updated before the start of the window. Pages start
+        at `page_size` items and double in size, so quiet days take a single request and busy days a few.
+        """
 
-        for cid in map(itemgetter("id"), feed["feed"]):
-            post = None
-            retries = 5
+        if page_size < 1:
+            raise ValueError(f"Invalid page_size for fetch_posts_in_range(): {page_size}")
 
-            while not post and retries:
-                try:
-                    post = self.network.get_post(cid)
-                except piazza_api.exceptions.RequestError as ex:
-                    retries -= 1
-
-                    if "foo fast" in str(ex):
-                        await asyncio.sleep(1)
-                    else:
-                        break
-            if post:
-                posts.append(post)
-
-        date = datetime.date.today()
+        window_start = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=days, seconds=seconds)
         result = []
+        offset = 0
+        requests = 0
+
+        while True:
+            page = self.fetch_feed(page_size, offset, include_private=True)
+            requests += 1
+            reached_start = False
+
+            for post in page:
+                # Pinned posts stay at the top of the feed no matter when they were last updated
+                if not self.check_if_pinned(post) and isoparse(self.get_feed_modified(post) or self.get_created(post)) < window_start:
+                    reached_start = True
+                    break
 
-        for post in posts:
-            # [2020,9,19] from 2020-09-19T22:41:52Z
-            created_at = datetime.date(*[int(x) for x in post["created"][:10].split("-")])
+                if not self.check_if_private(post) and isoparse(self.get_created(post)) >= window_start:
+                    result.append(post)
 
-            if self.check_if_private(post):
-                continue
-            elif (date - created_at).days <= days and (date - created_at).seconds <= seconds:
-                result.append(post)
+            if reached_start or len(page) < page_size:
+                break
 
+            offset += page_size
+            page_size = min(page_size * 2, FEED_PAGE_MAX)
+
+        print(f"Fetched {len(result)} Piazza posts from {self.course_name} since {window_start:%Y-%m-%d %H:%M} UTC in {requests} feed requests", flush=True)
         return result
 
     def get_pinned(self) -> List[dict]:
@@ -228,7 +297,7 @@ class PiazzaHandler:
         for post in posts:
             post_details = {
                 "num": post["nr"],
-                "subject": post["history"][0]["subject"],
+                "subject": self.clean_response(self.get_subject(post)),
                 "url": f"{self.url}?cid={post['nr']}",
             }
             response.append(post_details)
@@ -245,20 +314,26 @@ class PiazzaHandler:
             int associated with a Piazza post ID
         """
 
+        cached = self.post_cache.get(int(post_id))
+
+        if cached:
+            return cached
+
         post = self.fetch_post_instance(post_id)
 
         if post:
             post_type = "Note" if post["type"] == "note" else "Question"
+            body, images = html_to_markdown(self.get_body(post), base_url=PIAZZA_BASE_URL)
             response = {
                 "subject": self.clean_response(post["history"][0]["subject"]),
                 "num": f"@{post_id}",
                 "url": f"{self.url}?cid={post_id}",
                 "post_type": post_type,
-                "post_body": self.clean_response(self.get_body(post)),
+                "post_body": body,
                 "i_answer": None,
                 "s_answer": None,
                 "num_followups": 0,
-                "first_image": self.get_first_image_url(self.get_body(post))
+                "first_image": images[0] if images else ""
             }
 
             answers = post["children"]
@@ -277,6 +352,7 @@ class PiazzaHandler:
                 response.update({"num_followups": num_followups})
 
             response.update({"tags": ", ".join(post["tags"] or "None")})
+            self.post_cache.put(int(post_id), response, self.get_modified(post))
             return response
         else:
             return None
@@ -284,11 +360,11 @@ class PiazzaHandler:
     def get_num_follow_ups(self, answer: dict) -> int:
         return 1 + sum(self.get_num_follow_ups(i) for i in answer["children"])
 
-    async def get_posts_in_range(self, show_limit: int = 10, days: int = 1, seconds: int = 0) -> List[List[dict]]:
+    def get_posts_in_range(self, show_limit: int = 10, days: int = 1, seconds: int = 0) -> List[List[dict]]:
         if show_limit < 1:
             raise ValueError(f"Invalid show_limit for get_posts_in_range(): {show_limit}")
 
-        posts = await self.fetch_posts_in_range(days=days, seconds=seconds, lim=self.fetch_max)
+        posts = self.fetch_posts_in_range(days=days, seconds=seconds)
         instr, stud = [], []
         response = []
 
@@ -296,7 +372,7 @@ class PiazzaHandler:
             return {
                 "type": tag,
                 "num": post["nr"],
-                "subject": self.clean_response(post["history"][0]["subject"]),
+                "subject": self.clean_response(self.get_subject(post)),
                 "url": f"{self.url}?cid={post['nr']}"
             }
 
@@ -324,50 +400,104 @@ class PiazzaHandler:
         response.append(stud)
         return response
 
-    async def get_recent_notes(self) -> List[dict]:
+    def get_recent_notes(self) -> List[dict]:
         """
         Fetches `fetch_min` posts, filters out non-important (not instructor notes or pinned) posts and
         returns an array of corresponding post details
         """
 
-        posts = await self.fetch_recent_notes(lim=self.fetch_min)
+        posts = self.fetch_recent_notes(lim=self.fetch_min)
         response = []
 
         for post in posts:
             post_details = {
                 "num": post["nr"],
-                "subject": self.clean_response(post["history"][0]["subject"]),
+                "subject": self.clean_response(self.get_subject(post)),
                 "url": f"{self.url}?cid={post['nr']}"
             }
             response.append(post_details)
 
         return response
 
+    def get_feed_head(self, lim: int = 20) -> List[dict]:
+        """
+        Fetches the `lim` most recently updated posts in a single feed request and returns an array of their
+        details, with flags telling whether each post is an instructor's note and whether it is pinned
+        """
+
+        response = []
+
+        for post in self.fetch_feed(lim):
+            response.append({
+                "num": post["nr"],
+                "subject": self.clean_response(self.get_subject(post)),
+                "url": f"{self.url}?cid={post['nr']}",
+                "created": self.get_created(post),
+                "instructor_note": "instructor-note" in (post.get("tags") or []),
+                "pinned": self.check_if_pinned(post)
+            })
+
+        return response
+
+    def invalidate_cached_posts(self, feed: List[dict]) -> None:
+        """
+        Drops cached posts that the given feed items show were modified after they were cached.
+        """
+
+        for item in feed:
+            modified = self.get_feed_modified(item)
+
+            if modified and "nr" in item:
+                self.post_cache.invalidate_if_newer(item["nr"], modified)
+
+    @staticmethod
+    def get_feed_modified(item: dict) -> Optional[str]:
+        """
+        Returns the time of the latest change to the post of a feed item as an ISO 8601 string.
+        """
+
+        return item.get("modified") or item.get("updated")
+
+    @staticmethod
+    def get_modified(post: dict) -> Optional[str]:
+        """
+        Returns the time of the latest change to a post (including answers and followups) as an ISO 8601 string.
+        """
+
+        return max((c["when"] for c in post.get("change_log", []) if "when" in c), default=post.get("created"))
+
     def check_if_private(self, post: dict) -> bool:
-        return post["status"] == "private"
+        return post.get("status") == "private"
 
-    def clean_response(self, res: Optional[str]) -> str:
-        if not res:
-            return ""
+    def check_if_pinned(self, post: dict) -> bool:
+        return bool(post.get("pin")) or post.get("bucket_name") == "Pinned"
 
-        if len(res) > 1024:
-            res = res[:1000]
-            res += "...\n\n *(Read more)*"
+    @staticmethod
+    def get_subject(post: dict) -> str:
+        """
+        Returns the subject of a full post or of a feed item.
+        """
 
-        tag_regex = re.compile("<.*?>")
-        res = html.unescape(re.sub(tag_regex, "", res))
+        return post["history"][0]["subject"] if "history" in post else post.get("subject", "")
 
-        return res
+    @staticmethod
+    def get_created(post: dict) -> str:
+        """
+        Returns the creation time of a full post or of a feed item as an ISO 8601 string. Feed items only
+        carry it in their change log, so fall back to the last modification time if the log is missing.
+        """
 
-    def get_body(self, res: dict) -> str:
-        return res["history"][0]["content"]
+        if "created" in post:
+            return post["created"]
 
-    def get_first_image_url(self, res: str) -> str:
-        if res:
-            soup = BeautifulSoup(res, "html.parser")
-            img = soup.find('img')
+        return next((entry["t"] for entry in post.get("log", []) if entry.get("n") == "create"), None) or post.get("modified") or post["updated"]
 
-            if img:
-                return f"https://piazza.com{img['src']}" if img["src"].startswith("/") else img["src"]
+    def clean_response(self, res: Optional[str], limit: int = EMBED_FIELD_LIMIT) -> str:
+        """
+        Returns the HTML `res` converted to Discord markdown, cut to fit in `limit` characters
+        """
+
+        return html_to_markdown(res, limit, PIAZZA_BASE_URL)[0]
 
-        return ""
+    def get_body(self, res: dict) -> str:
+        return res["history"][0]["content"]
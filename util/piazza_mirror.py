@@ -0,0 +1,265 @@
+import re
+import sqlite3
+from typing import Callable, List, Optional
+
+from bs4 import BeautifulSoup
+
+from util.async_piazza_handler import AsyncPiazzaHandler
+from util.create_file import create_file_if_not_exists
+from util.piazza_handler import InvalidPostID, PiazzaHandler
+
+# Stores a local copy of each Piazza network's posts
+# Do *not* put a slash at the end of this path
+MIRROR_DIRECTORY = "./data/piazza"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS posts (
+    nr INTEGER PRIMARY KEY,
+    subject TEXT NOT NULL,
+    body TEXT NOT NULL,
+    body_html TEXT NOT NULL,
+    answers TEXT NOT NULL,
+    tags TEXT NOT NULL,
+    type TEXT NOT NULL,
+    created TEXT,
+    modified TEXT
+);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS posts_fts USING fts5(
+    subject, body, answers, content='posts', content_rowid='nr', tokenize='porter unicode61'
+);
+
+CREATE TRIGGER IF NOT EXISTS posts_ai AFTER INSERT ON posts BEGIN
+    INSERT INTO posts_fts(rowid, subject, body, answers) VALUES (new.nr, new.subject, new.body, new.answers);
+END;
+
+CREATE TRIGGER IF NOT EXISTS posts_ad AFTER DELETE ON posts BEGIN
+    INSERT INTO posts_fts(posts_fts, rowid, subject, body, answers) VALUES ('delete', old.nr, old.subject, old.body, old.answers);
+END;
+
+CREATE TRIGGER IF NOT EXISTS posts_au AFTER UPDATE ON posts BEGIN
+    INSERT INTO posts_fts(posts_fts, rowid, subject, body, answers) VALUES ('delete', old.nr, old.subject, old.body, old.answers);
+    INSERT INTO posts_fts(rowid, subject, body, answers) VALUES (new.nr, new.subject, new.body, new.answers);
+END;
+
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Feed items requested per page, and full posts fetched per sync so that syncing leaves most of the
+# rate budget to commands and the digest
+MIRROR_FEED_PAGE = 100
+MIRROR_POSTS_PER_SYNC = 10
+
+# Relative weights of the subject, body and answers columns when ranking search results
+RANK_WEIGHTS = (5.0, 1.0, 0.5)
+
+
+def html_to_text(res: Optional[str]) -> str:
+    """
+    Returns the text of an HTML post body with whitespace collapsed.
+    """
+
+    if not res:
+        return ""
+
+    return " ".join(BeautifulSoup(res, "html.parser").get_text(" ").split())
+
+
+class PiazzaMirror:
+    """
+    Local SQLite copy of a Piazza network's posts with an FTS5 full-text index over their subjects,
+    bodies and answers. The mirror is kept up to date by `Piazza.mirror_sync`, so searching it costs no
+    requests to Piazza.
+
+    The connection is not shared between threads; use the mirror from the event loop only. Queries take
+    milliseconds even for thousands of posts.
+
+    Attributes
+    ----------
+    nid : `str`
+        ID of the mirrored Piazza network
+
+    path : `str`
+        Path of the SQLite database
+    """
+
+    def __init__(self, nid: str):
+        self.nid = nid
+        self.path = f"{MIRROR_DIRECTORY}/{nid}.db"
+        create_file_if_not_exists(self.path)
+        self._db = sqlite3.connect(self.path)
+        self._db.executescript(SCHEMA)
+
+    def __len__(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM posts").fetchone()[0]
+
+    def get_meta(self, key: str) -> Optional[str]:
+        row = self._db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: Optional[str]) -> None:
+        with self._db:
+            self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def get_modified(self, nr: int) -> Optional[str]:
+        """
+        Returns the modification time stored for post `nr`, or None if the post isn't mirrored.
+        """
+
+        row = self._db.execute("SELECT modified FROM posts WHERE nr = ?", (nr,)).fetchone()
+        return row[0] if row else None
+
+    def upsert(self, post: dict, modified: Optional[str]) -> None:
+        """
+        Stores a full post (as returned by `PiazzaHandler.fetch_post_instance`) with the modification time
+        reported for it by the feed.
+        """
+
+        body_html = post["history"][0]["content"] or ""
+        answers = " ".join(html_to_text(child["history"][0]["content"]) for child in post.get("children", []) if child.get("type") in ("i_answer", "s_answer") and child.get("history"))
+
+        with self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO posts (nr, subject, body, body_html, answers, tags, type, created, modified) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (post["nr"], html_to_text(post["history"][0]["subject"]), html_to_text(body_html), body_html, answers, ",".join(post.get("tags") or []), post.get("type", ""), post.get("created"), modified)
+            )
+
+    def delete(self, nr: int) -> None:
+        with self._db:
+            self._db.execute("DELETE FROM posts WHERE nr = ?", (nr,))
+
+    def _remove(self, nr: int, on_update: Optional[Callable[[int, Optional[dict]], None]]) -> None:
+        self.delete(nr)
+
+        if on_update:
+            on_update(nr, None)
+
+    def iter_posts(self):
+        """
+        Yields the number, subject and plain-text body of every mirrored post.
+        """
+
+        yield from self._db.execute("SELECT nr, subject, body FROM posts")
+
+    def search(self, terms: str, limit: int = 25) -> List[dict]:
+        """
+        Returns up to `limit` posts matching all of the words in `terms` (or, if none match all of them, any
+        of them), best match first, each with a snippet of the text around the matching words.
+        """
+
+        words = re.findall(r"\w+", terms.lower())
+
+        if not words:
+            return []
+
+        for operator in (" AND ", " OR "):
+            query = operator.join(f'"{word}"' for word in words)
+            rows = self._db.execute(
+                f"SELECT posts.nr, posts.subject, snippet(posts_fts, -1, '**', '**', '…', 16), posts.tags "
+                f"FROM posts_fts JOIN posts ON posts.nr = posts_fts.rowid "
+                f"WHERE posts_fts MATCH ? ORDER BY bm25(posts_fts, {', '.join(map(str, RANK_WEIGHTS))}) LIMIT ?",
+                (query, limit)
+            ).fetchall()
+
+            if rows or len(words) == 1:
+                break
+
+        return [{"num": nr, "subject": subject, "snippet": snippet, "tags": tags} for nr, subject, snippet, tags in rows]
+
+    async def sync(self, handler: AsyncPiazzaHandler, max_posts: int = MIRROR_POSTS_PER_SYNC, on_update: Optional[Callable[[int, Optional[dict]], None]] = None) -> int:
+        """
+        Brings the mirror up to date with the feed, fetching at most `max_posts` full posts, and returns the
+        number of posts fetched. Posts whose stored modification time matches the feed are not fetched again.
+        `on_update` is called with the number and full post of each post stored, or with None as the post
+        if the post was removed because it is no longer visible. Private posts are listed in the feed walk so
+        that posts made private after they were mirrored are removed, but are never stored.
+
+        Once the mirror is complete, a sync walks the feed (most recently updated first) only until it reaches
+        the `cursor` left by the previous complete sync (skipping pinned posts, which always head the feed), which
+        usually takes a single feed request. Until then,
+        each sync resumes the initial backfill from the feed offset where the previous one stopped. A backfill
+        that walks the whole feed in a single sync also removes the posts that are no longer in the feed.
+        """
+
+        cursor = self.get_meta("cursor")
+
+        # Mirrors synced before private feed items were walked can hold posts made private since, so they're
+        # backfilled once more to remove them (posts that haven't changed aren't fetched again)
+        if cursor and not self.get_meta("private_checked"):
+            cursor = None
+            self.set_meta("cursor", None)
+            self.set_meta("backfill_offset", None)
+
+        self.set_meta("private_checked", "1")
+        offset = 0 if cursor else int(self.get_meta("backfill_offset") or 0)
+        whole_feed = not cursor and offset == 0
+        seen = set()
+        newest = None
+        fetched = 0
+
+        while True:
+            # Private items are requested too, so a page is only empty at the end of the feed
+            feed = await handler.fetch_feed(MIRROR_FEED_PAGE, offset, include_private=True)
+
+            if not feed:
+                break
+
+            for item in feed:
+                modified = PiazzaHandler.get_feed_modified(item)
+                # Pinned posts stay at the head of the feed however old they are, so they don't mark where the
+                # previous sync left off
+                pinned = handler.check_if_pinned(item)
+
+                if not pinned:
+                    newest = newest or modified
+
+                if cursor and modified and modified <= cursor and not pinned:
+                    self.set_meta("cursor", max(newest, cursor))
+                    return fetched
+
+                seen.add(item["nr"])
+
+                if handler.check_if_private(item):
+                    if self.get_modified(item["nr"]) is not None:
+                        self._remove(item["nr"], on_update)
+
+                    continue
+
+                if self.get_modified(item["nr"]) != modified:
+                    if fetched == max_posts:
+                        if not cursor:
+                            self.set_meta("backfill_offset", str(offset))
+
+                        return fetched
+
+                    try:
+                        post = await handler.fetch_post_instance(item["nr"])
+                        self.upsert(post, modified)
+                    except InvalidPostID:
+                        post = None
+                        self.delete(item["nr"])
+
+                    if on_update:
+                        on_update(item["nr"], post)
+
+                    fetched += 1
+
+            if not cursor and offset == 0:
+                self.set_meta("backfill_newest", newest)
+
+            offset += MIRROR_FEED_PAGE
+
+        if whole_feed:
+            for nr in [nr for nr, in self._db.execute("SELECT nr FROM posts") if nr not in seen]:
+                self._remove(nr, on_update)
+
+        # Reached the end of the feed, so everything older than the newest post seen is mirrored
+        self.set_meta("cursor", cursor or self.get_meta("backfill_newest") or newest)
+        self.set_meta("backfill_offset", None)
+        return fetched
+
+    def close(self) -> None:
+        self._db.close()
@@ -0,0 +1,117 @@
+import os
+import threading
+import time
+
+import piazza_api.exceptions
+import requests.utils
+from piazza_api import Piazza
+from piazza_api.network import Network
+from piazza_api.rpc import PiazzaRPC
+
+from util.create_file import create_file_if_not_exists
+from util.json import read_json, write_json
+
+SESSION_FILE = "data/piazza_session.json"
+
+# Parts of Piazza's error messages that mean the session is no longer logged in
+AUTH_ERROR_MESSAGES = ("not logged in", "log in", "login", "not authenticated")
+
+
+class PiazzaSession:
+    """
+    Authenticated Piazza session that can be shared by any number of `PiazzaHandler` instances.
+
+    The session's cookies are saved to disk after logging in and restored on startup, so restarting the bot
+    doesn't log in again. Logging in only happens when a request is made without a session, or when Piazza
+    reports that the session expired. Both happen on the thread making the request, never on the event loop.
+
+    Attributes
+    ----------
+    email : `str`
+        Piazza log-in email
+
+    password : `str`
+        Piazza password
+
+    logins : `int`
+        Number of times this session has logged in
+    """
+
+    def __init__(self, email: str, password: str, session_file: str = SESSION_FILE):
+        self.email = email
+        self.password = password
+        self.logins = 0
+        self._session_file = session_file
+        self._rpc = PiazzaRPC()
+        self._piazza = Piazza(self._rpc)
+        self._lock = threading.Lock()
+        self._restored = False
+
+    @property
+    def piazza(self) -> Piazza:
+        return self._piazza
+
+    def network(self, nid: str) -> Network:
+        """
+        Returns a `Network` for the Piazza with ID `nid` that makes its requests through this session.
+        No request is made (and nothing is logged in) until the network is used.
+        """
+
+        return Network(nid, self._rpc.session)
+
+    def ensure_authenticated(self) -> None:
+        """
+        Restores the saved session if this session has no cookies yet, and logs in if there was none to restore.
+        """
+
+        if self._rpc.session.cookies:
+            return
+
+        with self._lock:
+            if not self._rpc.session.cookies and not self._restore():
+                self._login()
+
+    def relogin(self, cookies_used: dict) -> None:
+        """
+        Logs in again after a request made with `cookies_used` failed to authenticate. If another thread has
+        already logged in since, its session is used instead of logging in twice.
+        """
+
+        with self._lock:
+            if self._rpc.session.cookies.get_dict() == cookies_used:
+                self._login()
+
+    def cookies(self) -> dict:
+        return self._rpc.session.cookies.get_dict()
+
+    @staticmethod
+    def is_auth_error(ex: Exception) -> bool:
+        if isinstance(ex, (piazza_api.exceptions.AuthenticationError, piazza_api.exceptions.NotAuthenticatedError)):
+            return True
+
+        return isinstance(ex, piazza_api.exceptions.RequestError) and any(msg in str(ex).lower() for msg in AUTH_ERROR_MESSAGES)
+
+    def _restore(self) -> bool:
+        if self._restored or not os.path.isfile(self._session_file):
+            return False
+
+        # Only restore once; if the restored session has expired, we log in instead
+        self._restored = True
+        cookies = read_json(self._session_file)
+
+        if not cookies:
+            return False
+
+        self._rpc.session.cookies.update(requests.utils.cookiejar_from_dict(cookies))
+        print("Restored saved Piazza session", flush=True)
+        return True
+
+    def _login(self) -> None:
+        start = time.monotonic()
+        self._rpc.session.cookies.clear()
+        self._rpc.user_login(email=self.email, password=self.password)
+        self.logins += 1
+
+        create_file_if_not_exists(self._session_file)
+        write_json(self._rpc.session.cookies.get_dict(), self._session_file)
+        print(f"Logged in to Piazza in {time.monotonic() - start:.2f}s", flush=True)
@@ -0,0 +1,117 @@
+import time
+from collections import deque
+from typing import Optional
+
+# Discord expects an Opus frame every FRAME_LENGTH seconds. JITTER_SAMPLES intervals between frames (a minute
+# of audio) are kept for the percentiles, and FIRST_AUDIO_SAMPLES times to first audio.
+FRAME_LENGTH = 0.02
+JITTER_SAMPLES = 3000
+FIRST_AUDIO_SAMPLES = 100
+
+# A read that takes longer than a frame means the frame is sent late (an underrun); one that takes longer
+# than STALL_THRESHOLD seconds is a stall. Intervals longer than MAX_INTERVAL are pauses, not jitter.
+STALL_THRESHOLD = 0.5
+MAX_INTERVAL = 1.0
+
+
+def percentile(samples: list[float], fraction: float) -> float:
+    """
+    Returns the nearest-rank percentile of the sorted `samples`
+    """
+
+    if not samples:
+        return 0.0
+
+    return samples[min(int(fraction * len(samples)), len(samples) - 1)]
+
+
+class PlaybackStats:
+    """
+    Playback telemetry of a guild's voice client, recorded by its audio sources as discord.py's player thread
+    reads each frame from them.
+
+    Attributes
+    ----------
+    frames : `int`
+        Number of frames sent
+
+    underruns : `int`
+        Number of frames that took longer than a frame to read, and so were sent late
+
+    stalls : `int`
+        Number of reads that blocked for longer than STALL_THRESHOLD seconds
+
+    reconnects : `int`
+        Number of times FFmpeg reconnected to a stream while it was being played
+
+    first_audio : `deque[float]`
+        Seconds between `!play` and the first frame of the song, for songs that were played right away
+    """
+
+    def __init__(self):
+        self.frames = 0
+        self.underruns = 0
+        self.stalls = 0
+        self.reconnects = 0
+        self.first_audio: deque[float] = deque(maxlen=FIRST_AUDIO_SAMPLES)
+        self._intervals: deque[float] = deque(maxlen=JITTER_SAMPLES)
+        self._source = None
+        self._source_reconnects = 0
+        self._last_read: Optional[float] = None
+        self._requested_at: Optional[float] = None
+
+    def expect_first_audio(self, requested_at: float) -> None:
+        """
+        Times the next source played from `requested_at` (a `time.monotonic()` time) until its first frame
+        """
+
+        self._requested_at = requested_at
+
+    def record_read(self, source, started: float, packet: bytes) -> None:
+        """
+        Records a frame read from `source` (which counts FFmpeg's reconnections in `reconnects`), where the
+        read started at `started` (a `time.perf_counter()` time)
+        """
+
+        now = time.perf_counter()
+
+        if source is not self._source:
+            # A new song or pipeline: the wait for its first frame isn't jitter
+            self._source = source
+            self._source_reconnects = source.reconnects
+            self._last_read = None
+
+            if self._requested_at is not None:
+                self.first_audio.append(time.monotonic() - self._requested_at)
+                self._requested_at = None
+        else:
+            if now - started > FRAME_LENGTH:
+                self.underruns += 1
+
+            if now - started > STALL_THRESHOLD:
+                self.stalls += 1
+
+        if self._last_read is not None and started - self._last_read < MAX_INTERVAL:
+            self._intervals.append(abs(started - self._last_read - FRAME_LENGTH))
+
+        self._last_read = started
+        self.frames += bool(packet)
+        self.reconnects += source.reconnects - self._source_reconnects
+        self._source_reconnects = source.reconnects
+
+    def stats(self) -> dict[str, float]:
+        """
+        Returns the counters, the send loop's jitter percentiles in seconds and the average time to first audio.
+        """
+
+        jitter = sorted(self._intervals)
+        return {
+            "frames": self.frames,
+            "underruns": self.underruns,
+            "stalls": self.stalls,
+            "reconnects": self.reconnects,
+            "jitter_p50": percentile(jitter, 0.5),
+            "jitter_p95": percentile(jitter, 0.95),
+            "jitter_p99": percentile(jitter, 0.99),
+            "first_audio": sum(self.first_audio) / len(self.first_audio) if self.first_audio else 0.0
+        }
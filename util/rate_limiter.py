@@ -0,0 +1,181 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Hashable
+
+
+class TokenBucket:
+    """
+    Token bucket rate limiter that can be shared between coroutines and threads.
+
+    The bucket holds up to `capacity` tokens and refills at `refill_rate` tokens per second. Acquiring a
+    token when the bucket is empty reserves a future token, so callers are served in the order they
+    arrived and a burst of callers is spread out evenly instead of retrying.
+
+    Attributes
+    ----------
+    capacity : `float`
+        Maximum number of tokens (i.e. the largest burst allowed)
+
+    refill_rate : `float`
+        Number of tokens added per second
+
+    acquired : `int`
+        Total number of tokens handed out
+
+    time_blocked : `float`
+        Total time in seconds callers have spent waiting for tokens
+    """
+
+    def __init__(self, capacity: float, refill_rate: float):
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.acquired = 0
+        self.time_blocked = 0.0
+        self._tokens = capacity
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self, tokens: float) -> float:
+        """
+        Takes `tokens` tokens from the bucket, and returns how long in seconds the caller must wait
+        before using them.
+        """
+
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * self.refill_rate)
+            self._last_refill = now
+            self._tokens -= tokens
+            wait = max(0.0, -self._tokens / self.refill_rate)
+            self.acquired += tokens
+            self.time_blocked += wait
+
+        return wait
+
+    async def acquire(self, tokens: float = 1) -> float:
+        """
+        Waits without blocking the event loop until `tokens` tokens are available, and returns the time waited.
+        """
+
+        wait = self._reserve(tokens)
+
+        if wait:
+            await asyncio.sleep(wait)
+
+        return wait
+
+    def acquire_blocking(self, tokens: float = 1) -> float:
+        """
+        Blocks the calling thread until `tokens` tokens are available, and returns the time waited.
+        Must not be called from the event loop.
+        """
+
+        wait = self._reserve(tokens)
+
+        if wait:
+            time.sleep(wait)
+
+        return wait
+
+
+class FairScheduler:
+    """
+    Splits one `TokenBucket` fairly between several keys (e.g. one per Piazza network).
+
+    Callers waiting for tokens are queued per key, and the keys with waiting callers take turns round-robin,
+    so a key with a long backlog can only take every other token while another key is also waiting.
+
+    Attributes
+    ----------
+    bucket : `TokenBucket`
+        Shared rate budget
+    """
+
+    def __init__(self, bucket: TokenBucket):
+        self.bucket = bucket
+        self._queues: OrderedDict[Hashable, deque] = OrderedDict()
+        self._shares: dict[Hashable, FairShare] = {}
+        self._busy = False
+        self._cond = threading.Condition()
+
+    def share(self, key: Hashable) -> "FairShare":
+        """
+        Returns the limiter for `key`, which can be used anywhere a `TokenBucket` is used from a thread.
+        """
+
+        with self._cond:
+            if key not in self._shares:
+                self._shares[key] = FairShare(self, key)
+
+            return self._shares[key]
+
+    def _next_ticket(self) -> object:
+        # Keys are moved to the end of the queue after their turn, so the first key is the one whose turn it is
+        return self._queues[next(iter(self._queues))][0]
+
+    def acquire_blocking(self, key: Hashable, tokens: float = 1) -> float:
+        """
+        Blocks the calling thread until it's `key`'s turn and `tokens` tokens are available, and returns the
+        time waited. Must not be called from the event loop.
+        """
+
+        start = time.monotonic()
+        ticket = object()
+
+        with self._cond:
+            self._queues.setdefault(key, deque()).append(ticket)
+
+            while self._busy or self._next_ticket() is not ticket:
+                self._cond.wait()
+
+            self._busy = True
+            queue = self._queues.pop(key)
+            queue.popleft()
+
+            if queue:
+                self._queues[key] = queue
+
+        try:
+            # The turn is held while sleeping, since the bucket can't hand out another token before then anyway
+            self.bucket.acquire_blocking(tokens)
+        finally:
+            with self._cond:
+                self._busy = False
+                self._cond.notify_all()
+
+        return time.monotonic() - start
+
+
+class FairShare:
+    """
+    One key's view of a `FairScheduler`, with the same interface as `TokenBucket.acquire_blocking`.
+
+    Attributes
+    ----------
+    key : `Hashable`
+        Key the tokens are acquired for
+
+    acquired : `int`
+        Total number of tokens handed out for this key
+
+    time_blocked : `float`
+        Total time in seconds this key's callers have spent waiting for their turn and for tokens
+    """
+
+    def __init__(self, scheduler: FairScheduler, key: Hashable):
+        self.key = key
+        self.acquired = 0
+        self.time_blocked = 0.0
+        self._scheduler = scheduler
+
+    @property
+    def capacity(self) -> float:
+        return self._scheduler.bucket.capacity
+
+    def acquire_blocking(self, tokens: float = 1) -> float:
+        wait = self._scheduler.acquire_blocking(self.key, tokens)
+        self.acquired += tokens
+        self.time_blocked += wait
+        return wait
@@ -0,0 +1,158 @@
+import asyncio
+from typing import Optional
+
+import discord
+
+from util.rate_limiter import TokenBucket
+
+# Discord allows roughly 10 member edits per 10 seconds per guild
+MEMBER_EDIT_BURST = 5
+MEMBER_EDITS_PER_SECOND = 1
+
+# Keys of the role mapping for each Canvas enrollment type
+ENROLLMENT_TYPES = {
+    "StudentEnrollment": "student",
+    "TaEnrollment": "ta",
+    "TeacherEnrollment": "teacher"
+}
+
+
+def get_desired_roles(enrollments: list, mapping: dict) -> dict[str, set[int]]:
+    """
+    Maps each enrolled Canvas identity to the IDs of the Discord roles it should have.
+
+    Parameters
+    ----------
+    enrollments : `list[canvasapi.Enrollment]`
+        Active enrollments of a course, fetched with the `user` field included
+
+    mapping : `dict`
+        Role mapping for the course. Maps "student", "ta" and "teacher" to role IDs, and "sections" to a
+        dict of section IDs (as strings) to role IDs.
+
+    Returns
+    -------
+    `dict[str, set[int]]`
+        Lowercase login IDs and SIS IDs mapped to role IDs
+    """
+
+    desired = {}
+
+    for enrollment in enrollments:
+        user = getattr(enrollment, "user", None) or {}
+        roles = set()
+
+        type_role = mapping.get(ENROLLMENT_TYPES.get(enrollment.type, ""))
+
+        if type_role:
+            roles.add(type_role)
+
+        section_role = mapping.get("sections", {}).get(str(getattr(enrollment, "course_section_id", "")))
+
+        if section_role:
+            roles.add(section_role)
+
+        for identity in (user.get("login_id"), user.get("sis_user_id")):
+            if identity:
+                desired.setdefault(str(identity).lower(), set()).update(roles)
+
+    return desired
+
+
+def get_managed_roles(mapping: dict) -> set[int]:
+    """
+    Returns the IDs of all roles in a course's role mapping. Only these roles are ever added or removed by a sync.
+    """
+
+    managed = {mapping[key] for key in ENROLLMENT_TYPES.values() if mapping.get(key)}
+    managed.update(mapping.get("sections", {}).values())
+    return managed
+
+
+def compute_role_diff(guild: discord.Guild, links: dict[str, str], desired: dict[str, set[int]], managed: set[int]) -> list[tuple[discord.Member, set[int], set[int]]]:
+    """
+    Computes the role changes needed to bring linked members in line with the Canvas roster.
+
+    Members that are linked but no longer enrolled lose their managed roles. Unlinked members are left alone.
+
+    Parameters
+    ----------
+    guild : `discord.Guild`
+        Guild to sync
+
+    links : `dict[str, str]`
+        Discord member IDs (as strings) mapped to the Canvas identity they linked
+
+    desired : `dict[str, set[int]]`
+        Output of `get_desired_roles`
+
+    managed : `set[int]`
+        Output of `get_managed_roles`
+
+    Returns
+    -------
+    `list[tuple[discord.Member, set[int], set[int]]]`
+        Members with the role IDs to add and to remove. Members that need no change are left out.
+    """
+
+    changes = []
+
+    for member_id, identity in links.items():
+        member = guild.get_member(int(member_id))
+
+        if not member:
+            continue
+
+        current = {r.id for r in member.roles} & managed
+        wanted = desired.get(identity.lower(), set()) & managed
+        to_add, to_remove = wanted - current, current - wanted
+
+        if to_add or to_remove:
+            changes.append((member, to_add, to_remove))
+
+    return changes
+
+
+class RoleSyncWorker:
+    """
+    Applies role changes to guild members one edit at a time, throttled so that large syncs
+    never trip Discord's rate limits.
+
+    Attributes
+    ----------
+    limiter : `TokenBucket`
+        Rate limiter shared by all syncs run by this worker
+    """
+
+    def __init__(self, limiter: Optional[TokenBucket] = None):
+        self.limiter = limiter or TokenBucket(MEMBER_EDIT_BURST, MEMBER_EDITS_PER_SECOND)
+        self._lock = asyncio.Lock()
+
+    async def apply(self, guild: discord.Guild, changes: list[tuple[discord.Member, set[int], set[int]]]) -> dict[str, int]:
+        """
+        Applies the changes returned by `compute_role_diff`, using a single member edit per member.
+        Syncs are run one after another so that two syncs never compete for the same budget.
+
+        Returns
+        -------
+        `dict[str, int]`
+            Number of members updated and number of failed updates
+        """
+
+        updated = failed = 0
+
+        async with self._lock:
+            for member, to_add, to_remove in changes:
+                await self.limiter.acquire()
+
+                # Recompute from the cached member in case roles changed while we were waiting
+                roles = [r for r in member.roles if r.id not in to_remove and not r.is_default()]
+                roles.extend(r for r in map(guild.get_role, to_add) if r and r not in roles)
+
+                try:
+                    await member.edit(roles=roles, reason="Canvas roster sync")
+                    updated += 1
+                except discord.HTTPException:
+                    failed += 1
+
+        return {"updated": updated, "failed": failed}
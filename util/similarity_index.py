@@ -0,0 +1,215 @@
+import re
+import time
+import zlib
+from collections import defaultdict
+from typing import Hashable, Optional
+
+import numpy as np
+
+# MinHash signatures have BANDS * ROWS values. With 16 bands of 4 rows, two texts become candidates
+# with probability 1 - (1 - s^4)^16, i.e. about 50% at a Jaccard similarity of 0.5 and 98% at 0.7.
+BANDS = 16
+ROWS = 4
+PRIME = 4294967291  # Largest prime below 2^32
+
+STOP_WORDS = frozenset("""
+a an and are as at be but by can could do does for from has have how i if in is it its me my no not of on or
+so that the this to was we what when where which who why will with would you your
+""".split())
+
+
+def shingles(text: str) -> set[str]:
+    """
+    Returns the words of `text` (lowercased, without stop words) and its pairs of consecutive words.
+    """
+
+    words = [w for w in re.findall(r"[a-z0-9_+#]+", text.lower()) if w not in STOP_WORDS]
+    return set(words) | {f"{a} {b}" for a, b in zip(words, words[1:])}
+
+
+class MinHashLSH:
+    """
+    Similarity index that finds texts sharing most of their words with a query in sublinear time.
+
+    Each text is reduced to a MinHash signature whose values agree with another text's signature with
+    probability equal to the Jaccard similarity of their shingles. Signatures are split into bands and
+    indexed by band, so a query only compares itself against texts that share at least one whole band.
+
+    Attributes
+    ----------
+    threshold : `float`
+        Minimum estimated similarity of a returned match
+    """
+
+    def __init__(self, threshold: float = 0.5, seed: int = 221):
+        self.threshold = threshold
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, PRIME, size=(BANDS * ROWS, 1), dtype=np.uint64)
+        self._b = rng.integers(0, PRIME, size=(BANDS * ROWS, 1), dtype=np.uint64)
+        self._buckets: defaultdict[tuple[int, bytes], set[Hashable]] = defaultdict(set)
+        self._signatures: dict[Hashable, np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return len(self._signatures)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._signatures
+
+    def signature(self, text: str) -> Optional[np.ndarray]:
+        """
+        Returns the MinHash signature of `text`, or None if it has no words to compare.
+        """
+
+        tokens = shingles(text)
+
+        if not tokens:
+            return None
+
+        hashes = np.fromiter((zlib.crc32(t.encode()) for t in tokens), dtype=np.uint64, count=len(tokens))
+        # a, b and the hashes are all below 2^32, so a * h + b can't overflow 64 bits
+        return ((self._a * hashes + self._b) % PRIME).min(axis=1).astype(np.uint32)
+
+    def _bands(self, sig: np.ndarray):
+        for i in range(BANDS):
+            yield i, sig[i * ROWS:(i + 1) * ROWS].tobytes()
+
+    def add(self, key: Hashable, text: str) -> None:
+        """
+        Indexes `text` under `key`, replacing whatever was indexed under `key` before.
+        """
+
+        self.remove(key)
+        sig = self.signature(text)
+
+        if sig is None:
+            return
+
+        self._signatures[key] = sig
+
+        for band in self._bands(sig):
+            self._buckets[band].add(key)
+
+    def remove(self, key: Hashable) -> None:
+        sig = self._signatures.pop(key, None)
+
+        if sig is None:
+            return
+
+        for band in self._bands(sig):
+            bucket = self._buckets[band]
+            bucket.discard(key)
+
+            if not bucket:
+                del self._buckets[band]
+
+    def query(self, text: str, limit: int = 3, max_candidates: int = 50) -> list[tuple[Hashable, float]]:
+        """
+        Returns up to `limit` keys whose texts have an estimated similarity to `text` of at least `threshold`,
+        most similar first. At most `max_candidates` candidates are compared, which bounds the cost of a query.
+        """
+
+        sig = self.signature(text)
+
+        if sig is None:
+            return []
+
+        candidates = set()
+
+        for band in self._bands(sig):
+            candidates.update(self._buckets.get(band, ()))
+
+            if len(candidates) >= max_candidates:
+                break
+
+        if not candidates:
+            return []
+
+        keys = list(candidates)[:max_candidates]
+        similarity = (np.stack([self._signatures[k] for k in keys]) == sig).mean(axis=1)
+        order = np.argsort(-similarity)
+
+        return [(keys[i], float(similarity[i])) for i in order[:limit] if similarity[i] >= self.threshold]
+
+
+class DuplicateDetector:
+    """
+    Checks chat messages against a `MinHashLSH` index under strict per-message and per-minute budgets,
+    so that it is cheap enough to run on every message in a busy channel.
+
+    A message is only checked if it has at least `min_words` words. Only its first `max_chars` characters
+    are used, and once checks have used `cpu_budget` seconds within the current minute, further messages
+    are skipped until the next minute.
+
+    Attributes
+    ----------
+    index : `MinHashLSH`
+        Index of the texts to match messages against
+
+    checked : `int`
+        Number of messages checked
+
+    skipped : `int`
+        Number of messages skipped because the per-minute budget was used up
+
+    matched : `int`
+        Number of messages that matched an indexed text
+
+    time_total : `float`
+        Total time in seconds spent checking messages
+
+    time_max : `float`
+        Longest time in seconds spent checking a single message
+    """
+
+    def __init__(self, index: MinHashLSH, min_words: int = 6, max_chars: int = 1000, cpu_budget: float = 0.5):
+        self.index = index
+        self.min_words = min_words
+        self.max_chars = max_chars
+        self.cpu_budget = cpu_budget
+        self.checked = 0
+        self.skipped = 0
+        self.matched = 0
+        self.time_total = 0.0
+        self.time_max = 0.0
+        self._window_start = 0.0
+        self._window_used = 0.0
+
+    def check(self, text: str) -> list[tuple[Hashable, float]]:
+        """
+        Returns the indexed keys similar to `text` (see `MinHashLSH.query`), or an empty list if the message
+        is too short or the budget is used up.
+        """
+
+        if len(text.split(maxsplit=self.min_words)) < self.min_words:
+            return []
+
+        now = time.monotonic()
+
+        if now - self._window_start >= 60:
+            self._window_start = now
+            self._window_used = 0.0
+        elif self._window_used >= self.cpu_budget:
+            self.skipped += 1
+            return []
+
+        start = time.perf_counter()
+        matches = self.index.query(text[:self.max_chars])
+        elapsed = time.perf_counter() - start
+
+        self._window_used += elapsed
+        self.time_total += elapsed
+        self.time_max = max(self.time_max, elapsed)
+        self.checked += 1
+        self.matched += bool(matches)
+
+        return matches
+
+    def stats(self) -> dict[str, float]:
+        return {
+            "indexed": len(self.index),
+            "checked": self.checked,
+            "skipped": self.skipped,
+            "matched": self.matched,
+            "avg_ms": self.time_total / self.checked * 1000 if self.checked else 0.0,
+            "max_ms": self.time_max * 1000
+        }
@@ -0,0 +1,173 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Optional
+from urllib.parse import parse_qs, urlparse
+
+from util.create_file import create_file_if_not_exists
+from util.json import read_json, write_json
+
+CACHE_FILE = "data/ytdl_cache.json"
+CACHE_SIZE = 1000
+
+# A video's title, uploader, etc. rarely change, so they're kept for a week. Stream URLs are only served until
+# they expire, less STREAM_URL_MARGIN seconds so they don't expire while FFmpeg opens them. URLs that don't say
+# when they expire are assumed to last STREAM_URL_TTL seconds.
+METADATA_TTL = 60 * 60 * 24 * 7
+STREAM_URL_TTL = 60 * 60
+STREAM_URL_MARGIN = 60
+
+# Fields of youtube-dl's info kept in the cache; everything else (formats, thumbnails, subtitles...) is dropped
+INFO_FIELDS = ("title", "webpage_url", "uploader", "uploader_url", "thumbnail", "duration", "is_live", "url", "acodec")
+
+
+def stream_url_expiry(stream_url: Optional[str]) -> float:
+    """
+    Returns the Unix time at which `stream_url` expires. YouTube's stream URLs carry it in their `expire` parameter.
+    """
+
+    if not stream_url:
+        return 0.0
+
+    expire = parse_qs(urlparse(stream_url).query).get("expire")
+    return float(expire[0]) if expire else time.time() + STREAM_URL_TTL
+
+
+class ExtractionCache:
+    """
+    Cache of youtube-dl results, keyed by the searched query or URL, kept in memory and saved to disk so it
+    survives restarts. Results are stored under both the query and the video's URL, so a stream URL fetched
+    again at play time is also used by the next `!play` of the same video.
+
+    Entries expire `ttl` seconds after they were extracted, and their stream URL is only served until it
+    expires. While a query is being extracted, identical queries wait for it instead of starting their own.
+
+    Attributes
+    ----------
+    path : `str`
+        Path of the JSON file the cache is saved to
+
+    maxsize : `int`
+        Maximum number of entries, after which the least recently used are evicted
+
+    ttl : `float`
+        Seconds an entry is served for after it was extracted
+
+    hits : `int`
+        Number of lookups served from the cache
+
+    misses : `int`
+        Number of lookups that started an extraction
+
+    coalesced : `int`
+        Number of lookups that waited for an extraction started by an identical lookup
+    """
+
+    def __init__(self, path: str = CACHE_FILE, maxsize: int = CACHE_SIZE, ttl: float = METADATA_TTL):
+        self.path = path
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._entries: Optional[OrderedDict[str, dict]] = None
+        self._in_flight: dict[str, asyncio.Future] = {}
+
+    def __len__(self) -> int:
+        return len(self._load())
+
+    def _load(self) -> OrderedDict:
+        if self._entries is None:
+            self._entries = OrderedDict(read_json(self.path) if os.path.isfile(self.path) and os.path.getsize(self.path) else {})
+
+        return self._entries
+
+    def lookup(self, key: str, need_stream: bool = False) -> Optional[dict]:
+        """
+        Returns the cached info for `key`, or None if there is no fresh entry. The info's `url` is None if its
+        stream URL has expired, and if `need_stream` is set, such entries aren't returned at all.
+        """
+
+        entries = self._load()
+        entry = entries.get(key)
+        now = time.time()
+
+        if entry is None or now >= entry["extracted"] + self.ttl:
+            return None
+
+        stream_valid = now < entry["stream_expires"] - STREAM_URL_MARGIN
+
+        if need_stream and not stream_valid:
+            return None
+
+        entries.move_to_end(key)
+        return {**entry["info"], "url": entry["info"]["url"] if stream_valid else None, "stream_expires": entry["stream_expires"]}
+
+    def store(self, key: str, info: dict) -> dict:
+        """
+        Caches the relevant fields of `info` under `key` and the video's URL, and returns them.
+        """
+
+        entries = self._load()
+        info = {field: info.get(field) for field in INFO_FIELDS}
+        entry = {"info": info, "extracted": time.time(), "stream_expires": stream_url_expiry(info["url"])}
+
+        for k in {key, info["webpage_url"]} - {None}:
+            entries[k] = entry
+            entries.move_to_end(k)
+
+        while len(entries) > self.maxsize:
+            entries.popitem(last=False)
+
+        create_file_if_not_exists(self.path)
+        write_json(entries, self.path)
+        return {**info, "stream_expires": entry["stream_expires"]}
+
+    async def get(self, key: str, extract: Callable[[], Awaitable[dict]], need_stream: bool = False) -> dict:
+        """
+        Returns the cached info for `key` if it's fresh (with an unexpired stream URL if `need_stream` is set).
+        Otherwise, awaits `extract()` (or the extraction already in flight for `key`) and caches its result.
+        """
+
+        info = self.lookup(key, need_stream)
+
+        if info:
+            self.hits += 1
+            return info
+
+        if key in self._in_flight:
+            self.coalesced += 1
+            return await asyncio.shield(self._in_flight[key])
+
+        self.misses += 1
+        future = asyncio.get_event_loop().create_future()
+        self._in_flight[key] = future
+
+        try:
+            info = self.store(key, await extract())
+        except BaseException as exc:
+            future.set_exception(exc)
+            # Mark the exception as retrieved in case no identical lookup was waiting for it
+            future.exception()
+            raise
+        else:
+            future.set_result(info)
+            return info
+        finally:
+            del self._in_flight[key]
+
+    def stats(self) -> dict[str, float]:
+        """
+        Returns the cache's size, hit/miss counters and hit rate.
+        """
+
+        total = self.hits + self.misses + self.coalesced
+        return {
+            "entries": len(self),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "hit_rate": (self.hits + self.coalesced) / total if total else 0.0
+        }
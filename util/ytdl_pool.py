@@ -0,0 +1,181 @@
+import asyncio
+import itertools
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Optional
+
+import youtube_dl
+
+# youtube-dl's extraction is CPU-heavy Python, so it runs in worker processes where it can't hold the
+# event loop's GIL. Extractions taking longer than EXTRACTION_TIMEOUT seconds are killed.
+EXTRACTION_WORKERS = 2
+EXTRACTION_TIMEOUT = 30
+
+# Parts of youtube-dl's info that the bot never reads and that make up most of its size
+DROPPED_FIELDS = ("formats", "requested_formats", "thumbnails", "subtitles", "automatic_captions", "requested_subtitles", "http_headers", "fragments")
+
+# Each worker process's own YoutubeDL instance, created by _init_worker, and the one listing playlists,
+# created the first time a playlist is listed
+_ytdl: Optional[youtube_dl.YoutubeDL] = None
+_flat_ytdl: Optional[youtube_dl.YoutubeDL] = None
+_options: dict = {}
+
+
+class ExtractionError(Exception):
+    pass
+
+
+def _init_worker(options: dict) -> None:
+    global _ytdl, _options
+
+    # Silence useless bug reports messages
+    youtube_dl.utils.bug_reports_message = lambda: ""
+    _ytdl = youtube_dl.YoutubeDL(options)
+    _options = options
+
+
+def _trim(info: dict) -> dict:
+    return {key: value for key, value in info.items() if key not in DROPPED_FIELDS}
+
+
+def _extract(url: str, process: bool, max_entries: Optional[int], ytdl: Optional[youtube_dl.YoutubeDL] = None) -> Optional[dict]:
+    try:
+        info = (ytdl or _ytdl).extract_info(url, download=False, process=process)
+    except youtube_dl.utils.YoutubeDLError as ex:
+        # youtube-dl's exceptions carry tracebacks, which can't be sent back to the bot's process
+        raise ExtractionError(str(ex)) from None
+
+    if info is None:
+        return None
+
+    # Unprocessed playlists and searches list their entries lazily, which can't be sent back either
+    if "entries" in info:
+        info["entries"] = [_trim(entry) for entry in itertools.islice(filter(None, info["entries"]), max_entries)]
+
+    return _trim(info)
+
+
+def _extract_playlist(url: str, max_entries: int) -> Optional[dict]:
+    global _flat_ytdl
+
+    if _flat_ytdl is None:
+        # Entries are listed as links with whatever the playlist page says about them, without extracting them
+        _flat_ytdl = youtube_dl.YoutubeDL({**_options, "extract_flat": "in_playlist", "noplaylist": False})
+
+    # youtube-dl fetches the playlist's pages as it goes, so it stops reading them at playlistend
+    _flat_ytdl.params["playlistend"] = max_entries
+    return _extract(url, True, max_entries, _flat_ytdl)
+
+
+class ExtractionPool:
+    """
+    Pool of worker processes that run youtube-dl extractions, each with its own `YoutubeDL` instance.
+
+    Extractions that haven't started yet are dropped when the coroutine waiting for them is cancelled.
+    Ones that time out can't be interrupted, so the workers are killed and the pool is started again.
+
+    Attributes
+    ----------
+    options : `dict`
+        Options for each worker's `YoutubeDL`
+
+    workers : `int`
+        Number of worker processes
+
+    timeout : `float`
+        Seconds an extraction may take
+
+    extractions : `int`
+        Number of extractions run
+
+    timeouts : `int`
+        Number of extractions that timed out
+
+    time_extracting : `float`
+        Total time in seconds extractions have taken, including waiting for a free worker
+    """
+
+    def __init__(self, options: dict, workers: int = EXTRACTION_WORKERS, timeout: float = EXTRACTION_TIMEOUT):
+        self.options = options
+        self.workers = workers
+        self.timeout = timeout
+        self.extractions = 0
+        self.timeouts = 0
+        self.time_extracting = 0.0
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # Forking a process that's running an event loop and other threads isn't safe, so workers are spawned
+            self._executor = ProcessPoolExecutor(self.workers, multiprocessing.get_context("spawn"), _init_worker, (self.options,))
+
+        return self._executor
+
+    async def run(self, func: Callable, *args):
+        """
+        Runs `func(*args)` in a worker process, killing the workers if it takes longer than the timeout.
+        `func` and its arguments must be picklable.
+        """
+
+        executor = self._get_executor()
+        start = time.monotonic()
+
+        try:
+            return await asyncio.wait_for(asyncio.get_event_loop().run_in_executor(executor, func, *args), self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            self._kill(executor)
+            raise
+        except BrokenProcessPool:
+            # Another call timed out and took this one's worker down with it
+            self._kill(executor)
+            raise ExtractionError("Extraction was interrupted, try again") from None
+        finally:
+            self.extractions += 1
+            self.time_extracting += time.monotonic() - start
+
+    async def extract(self, url: str, process: bool = True, max_entries: Optional[int] = None) -> Optional[dict]:
+        """
+        Returns youtube-dl's info for `url`, without the formats, thumbnails and subtitles. A playlist's or
+        search's entries are listed in full, or up to `max_entries` of them.
+        """
+
+        return await self.run(_extract, url, process, max_entries)
+
+    async def extract_playlist(self, url: str, max_entries: int) -> Optional[dict]:
+        """
+        Returns youtube-dl's info for the playlist at `url`, with up to `max_entries` entries. Entries aren't
+        extracted, so they only have a link (`url`, which may be just the video's ID) and what the playlist
+        lists about them, such as their title and duration.
+        """
+
+        return await self.run(_extract_playlist, url, max_entries)
+
+    def _kill(self, executor: ProcessPoolExecutor) -> None:
+        if executor is not self._executor:
+            return
+
+        self._executor = None
+        # The executor has no way to stop a running call, so its processes are terminated directly
+        processes = list((executor._processes or {}).values())
+        executor.shutdown(wait=False, cancel_futures=True)
+
+        for process in processes:
+            process.terminate()
+
+    def shutdown(self) -> None:
+        if self._executor:
+            self._kill(self._executor)
+
+    def stats(self) -> dict[str, float]:
+        """
+        Returns the number of extractions run and timed out, and the average time they took.
+        """
+
+        return {
+            "extractions": self.extractions,
+            "timeouts": self.timeouts,
+            "avg_time": self.time_extracting / self.extractions if self.extractions else 0.0
+        }